@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Latency benchmark of shell completion dynamic values
+
+Creates a fake home folder holding a configuration with several servers, the
+cached projects listing of the default server and a search index of all its
+repositories, then launches "bpc __complete KIND PREFIX" in a fresh
+interpreter, as completion scripts do on every Tab. bpc is run as a module
+with its bytecode cached (python -m bpc), as installed builds are; the cost of
+compiling bpc.py when it is run as a script is reported separately.
+Reported per query:
+    * median and 95th percentile wall time
+    * overhead over a bare interpreter start ("python -c pass"), which
+      depends on the Python installation rather than on bpc
+    * heavy or network modules loaded (from "python -X importtime")
+
+Usage:
+    python benchmarks/completion.py [--projects N] [--repos N] [--runs N] [--budget-ms MS]
+
+The script exits with error when the median overhead of any query exceeds
+--budget-ms (default: 50), or when a query loads stashy, GitPython, click,
+requests or socket.
+"""
+import argparse
+import compileall
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+srcFolder=os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"src")
+sys.path.insert(0,srcFolder)
+bpcScript=os.path.normpath(os.path.join(srcFolder,"bpc.py"))
+
+import cache
+import configstore
+import search
+
+forbiddenModules=["stashy","git","click","requests","socket"]
+words=["api","backend","frontend","service","gateway","billing","auth","user","payment","report"]
+
+queries=[
+    ["servers",""],
+    ["projects",""],
+    ["projects","prj12"],
+    ["projects","prj1","server-1"],
+    ["terms","api"],
+    ["terms",""],
+]
+
+
+class Listing(list):
+    """Completed listing, as cache.ResponseCache.store expects it"""
+    complete=True
+    validators={}
+
+
+def createHome(folder,servers,projects,repos,seed=1):
+    """Create a fake home folder: configuration, projects listing cache and search index"""
+    rnd=random.Random(seed)
+    bpcFolder=os.path.join(folder,".bpc")
+    cacheFolder=os.path.join(bpcFolder,"cache")
+    os.makedirs(cacheFolder)
+
+    store=configstore.ConfigStore(os.path.join(bpcFolder,"config.db"))
+    store.importData({"common":{"version":"3","default_server":"server-0"},
+        "servers":{"server-{}".format(i):{"shortcut":"server-{}".format(i),"baseurl":"http://127.0.0.1:1","username":"bench","token":"bench"}
+            for i in range(servers)}})
+    store.commit()
+
+    keys=["PRJ{}".format(i) for i in range(projects)]
+    responses=cache.ResponseCache(cacheFolder,1024*1024*1024)
+    for i in range(servers):
+        for _ in responses.store("server-{}/projects".format(i),Listing({"key":key,"name":key.title()} for key in keys),600):
+            pass
+
+    index=search.SearchIndex(os.path.join(cacheFolder,"search.db"))
+    sources=[("server-0/projects",str(projects),[{"kind":"project","server":"server-0","title":"{} ({})".format(key,key.title()),
+        "fields":[(key,4)]} for key in keys])]
+    for key in keys:
+        slugs=["{}-{}-{}".format(rnd.choice(words),rnd.choice(words),j) for j in range(repos)]
+        sources.append(("server-0/projects/{}/repos".format(key),str(repos),[{"kind":"repo","server":"server-0","title":"{}/{}".format(key,slug),
+            "fields":[(slug,4),(key,1)]} for slug in slugs]))
+    index.update(sources)
+
+
+def run(cmd,env):
+    """Run command once, return wall time in ms, number of output lines and stderr"""
+    start=time.perf_counter()
+    res=subprocess.run(cmd,env=env,stdout=subprocess.PIPE,stderr=subprocess.PIPE,universal_newlines=True)
+    return (time.perf_counter()-start)*1000,len(res.stdout.splitlines()),res.stderr
+
+
+def loadedModules(stderr):
+    return {line.split("|")[2].strip().split(".")[0] for line in stderr.splitlines() if line.startswith("import time:") and "cumulative" not in line}
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc shell completion latency benchmark")
+    parser.add_argument('--servers',type=int,default=5,help='number of configured servers')
+    parser.add_argument('--projects',type=int,default=2000,help='projects of every server')
+    parser.add_argument('--repos',type=int,default=25,help='repositories per project in search index')
+    parser.add_argument('--runs',type=int,default=20,help='runs per query')
+    parser.add_argument('--budget-ms',type=float,default=50,help='fail when median overhead over bare interpreter start exceeds this value (default: 50)')
+    arguments=parser.parse_args()
+
+    home=tempfile.mkdtemp(prefix="bpc-completion-")
+    failures=[]
+    try:
+        createHome(home,arguments.servers,arguments.projects,arguments.repos)
+        env=dict(os.environ,HOME=home,USERPROFILE=home)
+        env['PYTHONPATH']=os.path.normpath(srcFolder)+os.pathsep+env.get('PYTHONPATH','')
+        bpc=[sys.executable,"-m","bpc"]
+        # bytecode cache of bpc modules, even when PYTHONDONTWRITEBYTECODE is set
+        compileall.compile_dir(srcFolder,quiet=1)
+
+        baseline=statistics.median([run([sys.executable,"-c","pass"],env)[0] for _ in range(arguments.runs)])
+        print("Interpreter start: {:.1f} ms\n".format(baseline))
+        print("{:<28} {:>8} {:>8} {:>8} {:>10}  {}".format("query","values","p50 ms","p95 ms","overhead","forbidden modules"))
+        for query in queries:
+            cmd=bpc+["__complete"]+query
+            times=[]
+            for _ in range(arguments.runs):
+                ms,values,stderr=run(cmd,env)
+                times.append(ms)
+            times.sort()
+            p50=statistics.median(times)
+            p95=times[min(len(times)-1,int(len(times)*0.95))]
+            loaded=[m for m in forbiddenModules if m in loadedModules(run([sys.executable,"-X","importtime"]+cmd[1:],env)[2])]
+            name=" ".join(query[:1]+['"{}"'.format(query[1])]+query[2:])
+            print("{:<28} {:>8} {:>8.1f} {:>8.1f} {:>10.1f}  {}".format(name,values,p50,p95,p50-baseline,",".join(loaded) or "-"))
+            if p50-baseline > arguments.budget_ms:
+                failures.append("'{}' takes {:.1f} ms over interpreter start, budget is {} ms".format(name,p50-baseline,arguments.budget_ms))
+            if loaded:
+                failures.append("'{}' loads {}".format(name,",".join(loaded)))
+
+        script=statistics.median([run([sys.executable,bpcScript,"__complete","servers",""],env)[0] for _ in range(arguments.runs)])
+        print("\nbpc.py run as a script, compiled at every launch: {:.1f} ms for servers query".format(script))
+    finally:
+        shutil.rmtree(home,ignore_errors=True)
+
+    for failure in failures:
+        print("FAIL: "+failure,file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
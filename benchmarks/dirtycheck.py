@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark of uncommitted changes detection strategies
+
+Creates a synthetic repository with many files, then measures every
+strategy of src/dirtycheck.py on a clean working area, on a working area
+with a single modified file and on a working area where 10% of files are
+modified.
+
+Usage:
+    python benchmarks/dirtycheck.py [--files N] [--runs N] [--keep]
+"""
+import argparse
+import importlib
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"src"))
+
+import dirtycheck
+import gitinfo
+
+
+def runGit(folder,*args):
+    subprocess.run(["git"]+list(args),cwd=folder,check=True,stdout=subprocess.DEVNULL)
+
+
+def createRepository(folder,files):
+    """Create a repository with files spread over nested folders"""
+    runGit(folder,"init","-q")
+    runGit(folder,"config","user.email","bench@example.com")
+    runGit(folder,"config","user.name","bench")
+    for i in range(files):
+        subfolder=os.path.join(folder,"d{}".format(i%100),"s{}".format(i%1000//100))
+        if not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+        filePath=os.path.join(subfolder,"f{}.txt".format(i))
+        with open(filePath,"w") as outfile:
+            outfile.write("file {}\n".format(i))
+    runGit(folder,"add","-A")
+    runGit(folder,"commit","-q","-m","synthetic")
+    return filePath
+
+
+def modify(files):
+    for filePath in files:
+        with open(filePath,"a") as outfile:
+            outfile.write("change\n")
+
+
+def measure(location,strategy,runs):
+    times=[]
+    result=None
+    for _ in range(runs):
+        start=time.perf_counter()
+        result=dirtycheck.isDirty(location,strategy)
+        times.append((time.perf_counter()-start)*1000)
+    return statistics.median(times),result
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc dirty check benchmark")
+    parser.add_argument('--files',type=int,default=50000,help='number of files of synthetic repository')
+    parser.add_argument('--runs',type=int,default=5,help='runs per strategy')
+    parser.add_argument('--keep',action='store_true',help='do not delete synthetic repository')
+    arguments=parser.parse_args()
+
+    folder=tempfile.mkdtemp(prefix="bpc-dirty-")
+    try:
+        print("Creating repository with {} files in {}".format(arguments.files,folder))
+        lastFile=createRepository(folder,arguments.files)
+        location=gitinfo.findRepository(folder)
+        manyFiles=[os.path.join(root,name) for root,_,names in os.walk(folder) if ".git" not in root for name in names][::10]
+
+        strategies=list(dirtycheck.strategies)
+        try:
+            # gitpython strategy needs GitPython and a git executable it can find
+            importlib.import_module('git')
+        except ImportError:
+            strategies.remove('gitpython')
+
+        print("{:<12} {:>12} {:>12} {:>12}".format("strategy","clean ms","1 file ms","10% ms"))
+        for strategy in strategies:
+            clean,cleanResult=measure(location,strategy,arguments.runs)
+            modify([lastFile])
+            dirty,dirtyResult=measure(location,strategy,arguments.runs)
+            modify(manyFiles)
+            many,manyResult=measure(location,strategy,arguments.runs)
+            runGit(folder,"checkout","-q","--",".")
+            if cleanResult or not dirtyResult or not manyResult:
+                print("{}: wrong result (clean: {}, dirty: {}/{})".format(strategy,cleanResult,dirtyResult,manyResult),file=sys.stderr)
+            print("{:<12} {:>12.1f} {:>12.1f} {:>12.1f}".format(strategy,clean,dirty,many))
+    finally:
+        if not arguments.keep:
+            shutil.rmtree(folder,ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Startup benchmark of bpc distribution builds
+
+Builds bpc with src/build.py (unpacked folder and zipapp) in a temporary
+folder and compares them with bpc.py run from sources and, when given, with
+PyInstaller executables. "bpc -h", "bpc config --list" and "bpc pr --list"
+(against a local Bitbucket Server mock, pull requests index already synced)
+are launched in a fresh process for every run, reporting per build:
+    * cold start: first launch, with the page cache dropped before it when
+      --drop-caches is given (Linux, root), for sources also without their
+      bytecode cache
+    * warm start: median of the following launches
+
+Usage:
+    python benchmarks/distribution.py [--runs N] [--drop-caches] [--pyinstaller NAME=PATH ...]
+
+PYTHONDONTWRITEBYTECODE is removed from the environment of bpc: sources
+variant caches its bytecode at first launch as for a regular user.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarksFolder=os.path.dirname(os.path.abspath(__file__))
+srcFolder=os.path.normpath(os.path.join(benchmarksFolder,os.pardir,"src"))
+sys.path.insert(0,benchmarksFolder)
+
+import mockserver
+import suite
+
+commands=[["-h"],["config","--list"],["pr","--list"]]
+
+
+def dropCaches():
+    subprocess.run(["sync"],check=True)
+    with open("/proc/sys/vm/drop_caches","w") as outfile:
+        outfile.write("3\n")
+
+
+def run(cmd,cwd,env):
+    """Run command once, return wall time in ms"""
+    start=time.perf_counter()
+    res=subprocess.run(cmd,cwd=cwd,env=env,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,universal_newlines=True)
+    wall=(time.perf_counter()-start)*1000
+    if res.returncode:
+        print("    {} failed: {}".format(" ".join(cmd),res.stderr.strip().splitlines()[-1:]),file=sys.stderr)
+    return wall
+
+
+def buildVariants(dist):
+    """Build with src/build.py, return [(name, command, size in MB)]"""
+    subprocess.run([sys.executable,os.path.join(srcFolder,"build.py"),"--variant","all","--dist",dist],check=True,stdout=subprocess.DEVNULL)
+    folder=os.path.join(dist,"bpc")
+    size=sum(os.path.getsize(os.path.join(root,name)) for root,_,names in os.walk(folder) for name in names)
+    launcher=[os.path.join(folder,"bpc.cmd")] if "win32" == sys.platform else [os.path.join(folder,"bpc")]
+    zipapp=os.path.join(dist,"bpc.pyz")
+    return [("dir",launcher,size/(1024*1024)),
+        ("zipapp",[sys.executable,"-S",zipapp] if "win32" == sys.platform else [zipapp],os.path.getsize(zipapp)/(1024*1024))]
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc distribution builds startup benchmark")
+    parser.add_argument('--runs',type=int,default=10,help='number of warm runs per command')
+    parser.add_argument('--drop-caches',action='store_true',help='drop page cache before cold runs (Linux, needs root)')
+    parser.add_argument('--pyinstaller',action='append',default=[],metavar='NAME=PATH',help='PyInstaller executable to compare, e.g. onefile=dist/bpc')
+    parser.add_argument('--prs',type=int,default=50,help='pull requests of the benchmarked repository')
+    arguments=parser.parse_args()
+
+    server=mockserver.start(0,1,1,arguments.prs)
+    port=server.server_address[1]
+    home=tempfile.mkdtemp(prefix="bpc-distribution-")
+    try:
+        repository=suite.prepareHome(home,port)
+        env=dict(os.environ,HOME=home,USERPROFILE=home)
+        env.pop('PYTHONDONTWRITEBYTECODE',None)
+        variants=[("sources",[sys.executable,os.path.join(srcFolder,"bpc.py")],None)]+buildVariants(os.path.join(home,"dist"))
+        for option in arguments.pyinstaller:
+            name,_,path=option.partition("=")
+            variants.append((name,[os.path.abspath(path)],os.path.getsize(path)/(1024*1024) if os.path.isfile(path) else None))
+        # configuration migration and first pull requests index sync are not startup costs
+        run(variants[0][1]+["pr","--list"],repository,env)
+
+        print("{:<10} {:>8}  {:<16} {:>10} {:>10}".format("build","MB","command","cold ms","warm ms"))
+        for name,cmd,size in variants:
+            for args in commands:
+                if "sources" == name:
+                    shutil.rmtree(os.path.join(srcFolder,"__pycache__"),ignore_errors=True)
+                if arguments.drop_caches:
+                    dropCaches()
+                cold=run(cmd+args,repository,env)
+                warm=statistics.median([run(cmd+args,repository,env) for _ in range(arguments.runs)])
+                print("{:<10} {:>8}  {:<16} {:>10.1f} {:>10.1f}".format(name,"-" if size is None else "{:.1f}".format(size)," ".join(args),cold,warm))
+        if not arguments.drop_caches:
+            print("\nCold runs used the page cache, use --drop-caches to measure them from disk")
+    finally:
+        server.shutdown()
+        shutil.rmtree(home,ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""Local stand-in for Bitbucket Server REST API, used by benchmarks
+
+Implements the resources used by bpc (through stashy or directly): projects,
+repositories, pull requests (list, create, get, changes, diff, reviewer
+status, merge, decline), build statuses, branches, users and group members, with paging, ETag validation, configurable latency and dataset
+size. Statistics (requests, bytes) are served by GET /_stats and reset by
+POST /_reset.
+
+Usage:
+    python benchmarks/mockserver.py [--port N] [--projects N] [--repos N] [--prs N] [--page-size N] [--latency S]
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+users=[{"name":name,"slug":name.lower(),"displayName":name.title(),"emailAddress":"{}@example.com".format(name.lower())}
+    for name in ["alice","bob","Carol","dave","erin"]]
+groups={"team":["alice","bob","dave"]}
+branches=["master","develop"]+["feature/f{}".format(i) for i in range(50)]
+
+
+class Dataset:
+    """Synthetic projects, repositories and pull requests"""
+    def __init__(self,projects,repos,prs):
+        self.projects=[{"key":"P{}".format(i),"id":i,"name":"Project {}".format(i),"public":False,"type":"NORMAL"} for i in range(projects)]
+        self.repos={}
+        for i in range(repos):
+            project=self.projects[i%projects]
+            slug="repo-{}".format(i//projects)
+            self.repos.setdefault(project['key'],[]).append({"slug":slug,"id":i,"name":"Repo {}".format(i//projects),
+                "project":project,"state":"AVAILABLE","scmId":"git"})
+        self.prs={}
+        # commit: {key: build status}
+        self.builds={}
+        self.lock=threading.Lock()
+        now=int(time.time()*1000)
+        for project,repoList in self.repos.items():
+            for repo in repoList[:10]:
+                for n in range(prs):
+                    self.createPr(project,repo['slug'],{"title":"Change {}".format(n),"description":"",
+                        "fromRef":{"id":"feature/f{}".format(n%50)},"toRef":{"id":"master"},
+                        "reviewers":[{"user":{"name":"bob"}}]},now-(prs-n)*1000)
+
+    def createPr(self,project,slug,data,updated=None):
+        with self.lock:
+            prs=self.prs.setdefault((project,slug),[])
+            pr={"id":len(prs)+1,"version":0,"title":data.get("title",""),"description":data.get("description",""),
+                "state":"OPEN","open":True,"closed":False,"createdDate":updated or int(time.time()*1000),
+                "updatedDate":updated or int(time.time()*1000),"author":{"user":users[0],"role":"AUTHOR","approved":False}}
+            for side in ["fromRef","toRef"]:
+                branch=data[side]["id"].replace("refs/heads/","")
+                pr[side]={"id":"refs/heads/"+branch,"displayId":branch,"latestCommit":hashlib.sha1(branch.encode()).hexdigest(),
+                    "repository":{"slug":slug,"project":{"key":project}}}
+            pr["reviewers"]=[{"user":{"name":reviewer["user"]["name"],"displayName":reviewer["user"]["name"].title()},
+                "role":"REVIEWER","approved":False,"status":"UNAPPROVED"} for reviewer in data.get("reviewers",[])]
+            prs.append(pr)
+            return pr
+
+    def updatePr(self,pr,change):
+        """Apply change(pr) and bump pull request version and update date"""
+        with self.lock:
+            change(pr)
+            pr['version']+=1
+            pr['updatedDate']=max(int(time.time()*1000),pr['updatedDate']+1)
+            return pr
+
+    def setBuild(self,commit,status):
+        with self.lock:
+            status=dict(status,dateAdded=int(time.time()*1000))
+            self.builds.setdefault(commit,{})[status.get('key')]=status
+
+
+def setReviewerStatus(pr,user,status):
+    reviewers=[reviewer for reviewer in pr['reviewers'] if reviewer['user']['name'] == user]
+    if not reviewers:
+        reviewers=[{"user":{"name":user,"displayName":user.title()},"role":"PARTICIPANT"}]
+        pr['reviewers'].append(reviewers[0])
+    reviewers[0]['status']=status
+    reviewers[0]['approved']='APPROVED' == status
+
+
+def changes(pr):
+    """Return changed files of a pull request: 10 files per pull request id"""
+    return [{"path":{"toString":"src/module{}/file{}.py".format(pr['id'],n)},"type":"MODIFY" if n else "ADD"} for n in range(10)]
+
+
+def diff(pr,lines=200):
+    """Return unified diff of changes of a pull request"""
+    text=[]
+    for change in changes(pr):
+        path=change['path']['toString']
+        text+=["diff --git a/{0} b/{0}".format(path),"--- a/{}".format(path),"+++ b/{}".format(path),"@@ -1,{0} +1,{0} @@".format(lines)]
+        text+=["-old line {}".format(n) if n%2 else "+new line {}".format(n) for n in range(lines)]
+    return "\n".join(text)+"\n"
+
+
+class Stats:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests=0
+        self.bytes=0
+        self.resources={}
+
+    def add(self,path,size):
+        # numbers are replaced, to group resources of every repository together
+        resource=re.sub(r'/(P\d+|repo-\d+|\d+)(?=/|$)','/*',path)
+        with self.lock:
+            self.requests+=1
+            self.bytes+=size
+            self.resources[resource]=self.resources.get(resource,0)+1
+
+
+def page(values,query,pageSize):
+    start=int(query.get('start',['0'])[0])
+    limit=min(int(query.get('limit',[str(pageSize)])[0]),pageSize)
+    chunk=values[start:start+limit]
+    data={"size":len(chunk),"limit":limit,"start":start,"isLastPage":start+limit >= len(values),"values":chunk}
+    if not data["isLastPage"]:
+        data["nextPageStart"]=start+limit
+    return data
+
+
+def makeHandler(dataset,stats,latency,pageSize):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version="HTTP/1.1"
+        # headers and body are sent separately: Nagle algorithm would delay the body until headers are acknowledged
+        disable_nagle_algorithm=True
+
+        def log_message(self,*args):
+            pass
+
+        def send(self,code,data=None,etag=False):
+            body=b"" if data is None else json.dumps(data).encode()
+            headers={"Content-Type":"application/json"}
+            if etag and 200 == code:
+                headers["ETag"]='"{}"'.format(hashlib.sha1(body).hexdigest())
+                if self.headers.get("If-None-Match") == headers["ETag"]:
+                    code,body=304,b""
+            self.send_response(code)
+            for name,value in headers.items():
+                self.send_header(name,value)
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            if "HEAD" != self.command:
+                self.wfile.write(body)
+            if not self.path.startswith("/_"):
+                stats.add(urlparse(self.path).path,len(body))
+
+        def sendText(self,text):
+            body=text.encode()
+            self.send_response(200)
+            self.send_header("Content-Type","text/plain")
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            stats.add(urlparse(self.path).path,len(body))
+
+        def notFound(self,message):
+            self.send(404,{"errors":[{"message":message}]})
+
+        def route(self):
+            url=urlparse(self.path)
+            query=parse_qs(url.query)
+            # project keys are case insensitive
+            path=re.sub(r'/projects/([^/]+)',lambda m: '/projects/'+m[1].upper(),url.path)
+            if "/_stats" == path:
+                return self.send(200,{"requests":stats.requests,"bytes":stats.bytes,"resources":stats.resources})
+            if "/_reset" == path:
+                stats.reset()
+                return self.send(200,{})
+            time.sleep(latency)
+            if "HEAD" == self.command:
+                return self.send(200)
+
+            m=re.match(r'^/rest/api/1\.0/projects/?$',path)
+            if m:
+                return self.send(200,page(dataset.projects,query,pageSize),etag=True)
+            m=re.match(r'^/rest/api/1\.0/projects/([^/]+)/repos/?$',path)
+            if m:
+                if m[1] not in dataset.repos:
+                    return self.notFound("Project {} does not exist.".format(m[1]))
+                return self.send(200,page(dataset.repos[m[1]],query,pageSize),etag=True)
+            m=re.match(r'^/rest/api/1\.0/projects/([^/]+)/repos/([^/]+)/?$',path)
+            if m:
+                repo=[repo for repo in dataset.repos.get(m[1],[]) if repo['slug'] == m[2]]
+                return self.send(200,repo[0]) if repo else self.notFound("Repository {}/{} does not exist.".format(m[1],m[2]))
+            m=re.match(r'^/rest/api/1\.0/projects/([^/]+)/repos/([^/]+)/pull-requests/?$',path)
+            if m:
+                if "POST" == self.command:
+                    data=json.loads(self.rfile.read(int(self.headers.get("Content-Length",0))) or b"{}")
+                    return self.send(201,dataset.createPr(m[1],m[2],data))
+                state=query.get('state',['OPEN'])[0]
+                prs=[pr for pr in dataset.prs.get((m[1],m[2]),[]) if state in ('ALL',pr['state'])]
+                prs.sort(key=lambda pr: pr['updatedDate'],reverse='OLDEST' != query.get('order',['NEWEST'])[0])
+                return self.send(200,page(prs,query,pageSize),etag=True)
+            m=re.match(r'^/rest/api/1\.0/projects/([^/]+)/repos/([^/]+)/pull-requests/(\d+)(/changes|\.diff|/merge|/decline|/participants/[^/]+)?/?$',path)
+            if m:
+                prs=[pr for pr in dataset.prs.get((m[1],m[2]),[]) if pr['id'] == int(m[3])]
+                if not prs:
+                    return self.notFound("Pull request {} does not exist in {}/{}.".format(m[3],m[1],m[2]))
+                if m[4] in ("/merge","/decline") and "POST" == self.command:
+                    state="MERGED" if "/merge" == m[4] else "DECLINED"
+                    return self.send(200,dataset.updatePr(prs[0],lambda pr: pr.update(state=state,open=False,closed=True)))
+                if (m[4] or "").startswith("/participants/") and "PUT" == self.command:
+                    data=json.loads(self.rfile.read(int(self.headers.get("Content-Length",0))) or b"{}")
+                    return self.send(200,dataset.updatePr(prs[0],lambda pr: setReviewerStatus(pr,m[4].split("/")[-1],data.get("status","UNAPPROVED"))))
+                if "/changes" == m[4]:
+                    return self.send(200,page(changes(prs[0]),query,pageSize))
+                if ".diff" == m[4]:
+                    return self.sendText(diff(prs[0]))
+                return self.send(200,prs[0])
+            m=re.match(r'^/rest/api/1\.0/projects/([^/]+)/repos/([^/]+)/branches/?$',path)
+            if m:
+                text=query.get('filterText',[''])[0]
+                return self.send(200,page([{"id":"refs/heads/"+name,"displayId":name,"type":"BRANCH"} for name in branches if text in name],query,pageSize))
+            m=re.match(r'^/rest/build-status/1\.0/commits/([0-9a-f]+)/?$',path)
+            if m:
+                if "POST" == self.command:
+                    dataset.setBuild(m[1],json.loads(self.rfile.read(int(self.headers.get("Content-Length",0))) or b"{}"))
+                    return self.send(204)
+                return self.send(200,page(sorted(dataset.builds.get(m[1],{}).values(),key=lambda status: status.get('key') or ''),query,pageSize),etag=True)
+            m=re.match(r'^/rest/api/1\.0/users/([^/]+)$',path)
+            if m:
+                user=[user for user in users if user['slug'] == m[1]]
+                return self.send(200,user[0]) if user else self.notFound("User {} does not exist.".format(m[1]))
+            m=re.match(r'^/rest/api/1\.0/users/?$',path)
+            if m:
+                text=query.get('filter',[''])[0].lower()
+                return self.send(200,page([user for user in users if text in user['name'].lower() or text in user['emailAddress']],query,pageSize))
+            m=re.match(r'^/rest/api/1\.0/admin/groups/more-members$',path)
+            if m:
+                group=query.get('context',[''])[0]
+                if group not in groups:
+                    return self.notFound("Group {} does not exist.".format(group))
+                return self.send(200,page([user for user in users if user['name'] in groups[group]],query,pageSize))
+            return self.notFound("Resource {} not found".format(path))
+
+        do_GET=route
+        do_POST=route
+        do_PUT=route
+        do_HEAD=route
+
+    return Handler
+
+
+def start(port=0,projects=10,repos=100,prs=3,pageSize=25,latency=0.0):
+    """Start server in a background thread, return it: its port is server.server_address[1]"""
+    dataset=Dataset(projects,repos,prs)
+    server=ThreadingHTTPServer(("127.0.0.1",port),makeHandler(dataset,Stats(),latency,pageSize))
+    server.daemon_threads=True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Bitbucket Server mock")
+    parser.add_argument('--port',type=int,default=0,help='listening port (default: any free port)')
+    parser.add_argument('--projects',type=int,default=10,help='number of projects')
+    parser.add_argument('--repos',type=int,default=100,help='number of repositories, spread over projects')
+    parser.add_argument('--prs',type=int,default=3,help='open pull requests of the first 10 repositories of each project')
+    parser.add_argument('--page-size',type=int,default=25,help='maximum page size')
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds added to every request')
+    arguments=parser.parse_args()
+
+    server=start(arguments.port,arguments.projects,arguments.repos,arguments.prs,arguments.page_size,arguments.latency)
+    print("Listening on port {}".format(server.server_address[1]),flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Benchmark of the offline search index
+
+Indexes a synthetic server (projects, repositories and pull requests) with
+src/search.py, then reports index size on disk, full and incremental
+refresh time and query latency.
+
+Usage:
+    python benchmarks/search.py [--projects N] [--repos N] [--prs N] [--runs N]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"src"))
+
+import search
+
+words=["api","backend","frontend","service","gateway","billing","auth","user","payment","report",
+    "legacy","mobile","core","data","pipeline","config","tools","docs","infra","search"]
+
+
+def syntheticSources(projects,repos,prs,seed=1):
+    """Return {source: documents}, documents shaped as bpc search refresh builds them"""
+    rnd=random.Random(seed)
+    sources={}
+    projectList=[("PRJ{}".format(i),"{} {}".format(rnd.choice(words).title(),i)) for i in range(projects)]
+    sources["bench/projects"]=[{"kind":"project","server":"bench","title":"{} ({})".format(key,name),
+        "fields":[(key,4),(name,2)]} for key,name in projectList]
+    for key,_ in projectList:
+        slugs=["{}-{}-{}".format(rnd.choice(words),rnd.choice(words),j) for j in range(repos)]
+        sources["bench/projects/{}/repos".format(key)]=[{"kind":"repo","server":"bench","title":"{}/{}".format(key,slug),
+            "fields":[(slug,4),(slug.replace("-"," ").title(),2),(key,1)]} for slug in slugs]
+        for slug in slugs:
+            sources["bench/pullrequests/{}/{}".format(key,slug)]=[{"kind":"pr","server":"bench",
+                "title":"{}/{} #{}".format(key,slug,n),
+                "fields":[("Fix {} {} in {}".format(rnd.choice(words),rnd.choice(words),rnd.choice(words)),2)]} for n in range(prs)]
+    return sources
+
+
+def refresh(index,sources):
+    start=time.perf_counter()
+    changed=index.update([(source,str(len(documents)),documents) for source,documents in sources.items()])
+    return (time.perf_counter()-start)*1000,changed
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc search index benchmark")
+    parser.add_argument('--projects',type=int,default=100,help='number of projects')
+    parser.add_argument('--repos',type=int,default=50,help='repositories per project')
+    parser.add_argument('--prs',type=int,default=5,help='pull requests per repository')
+    parser.add_argument('--runs',type=int,default=20,help='runs per query')
+    arguments=parser.parse_args()
+
+    folder=tempfile.mkdtemp(prefix="bpc-search-")
+    try:
+        path=os.path.join(folder,"search.db")
+        index=search.SearchIndex(path)
+        sources=syntheticSources(arguments.projects,arguments.repos,arguments.prs)
+
+        fullMs,changed=refresh(index,sources)
+        documents,tokens=index.size()
+        print("Indexed {} sources, {} documents, {} tokens".format(changed,documents,tokens))
+        print("{:<32} {:>10.1f}".format("full refresh ms",fullMs))
+        print("{:<32} {:>10.1f}".format("index size KB",os.path.getsize(path)/1024))
+
+        unchangedMs,_=refresh(index,sources)
+        print("{:<32} {:>10.1f}".format("unchanged refresh ms",unchangedMs))
+        key=next(source for source in sources if source.endswith("/repos"))
+        sources[key]=sources[key][:-1]
+        incrementalMs,changed=refresh(index,sources)
+        print("{:<32} {:>10.1f}  ({} source changed)".format("incremental refresh ms",incrementalMs,changed))
+
+        print("\n{:<24} {:>8} {:>10} {:>10}".format("query","results","p50 ms","p95 ms"))
+        for query in ["billing","pay","api gate","prj4","prj42 core","fix auth","s","zzz"]:
+            times=[]
+            for _ in range(arguments.runs):
+                start=time.perf_counter()
+                results=index.search(query)
+                times.append((time.perf_counter()-start)*1000)
+            times.sort()
+            print("{:<24} {:>8} {:>10.2f} {:>10.2f}".format(query,len(results),statistics.median(times),times[int(len(times)*0.95)-1]))
+    finally:
+        shutil.rmtree(folder,ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
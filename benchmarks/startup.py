@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Startup benchmark for bpc subcommands
+
+Launches bpc in a fresh interpreter for every run and reports, per subcommand:
+    * cold start wall time (first run, no bytecode cache for bpc sources)
+    * warm start wall time (median of the following runs)
+    * total import time and heavy libraries loaded (from "python -X importtime")
+
+Usage:
+    python benchmarks/startup.py [--runs N] [--budget-ms MS]
+
+With --budget-ms the script exits with error when the warm start of any
+subcommand exceeds the budget, or when a subcommand that should not need them
+loads stashy/GitPython/click: it can be used to catch startup regressions.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+srcFolder=os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"src")
+bpcScript=os.path.normpath(os.path.join(srcFolder,"bpc.py"))
+
+heavyModules=["stashy","git","click","requests"]
+
+# Subcommands to benchmark and heavy libraries they are allowed to load
+scenarios=[
+    (["-h"],[]),
+    (["config","--list"],[]),
+    (["config","-h"],[]),
+    (["remote","-h"],[]),
+    (["pr","-h"],[]),
+]
+
+
+def createHome(folder):
+    """Create a fake home folder containing a minimal bpc configuration"""
+    bpcFolder=os.path.join(folder,".bpc")
+    os.makedirs(bpcFolder)
+    config={"common":{"version":2,"default_server":"bench","pr_set_repo_title":"true"},
+        "servers":{"bench":{"shortcut":"bench","baseurl":"http://127.0.0.1:1","username":"bench","token":"bench"}},
+        "url-shortcut-map":{"http://127.0.0.1:1":"bench"},"repositories":{},"projects":{}}
+    with open(os.path.join(bpcFolder,"config.json"),"w") as outfile:
+        json.dump(config,outfile)
+
+
+def runBpc(args,env,importtime=False):
+    """Run bpc once, return wall time in ms and stderr output"""
+    cmd=[sys.executable]
+    if importtime:
+        cmd+=["-X","importtime"]
+    cmd+=[bpcScript]+args
+    start=time.perf_counter()
+    res=subprocess.run(cmd,env=env,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,universal_newlines=True)
+    return (time.perf_counter()-start)*1000,res.stderr
+
+
+def parseImportTime(stderr):
+    """Return total import time in ms and the set of loaded top level modules"""
+    total=0
+    modules=set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields=line[len("import time:"):].split("|")
+        name=fields[2].rstrip()
+        # top level imports are not indented
+        if not name.startswith("  "):
+            total+=int(fields[1])
+        modules.add(name.strip().split(".")[0])
+    return total/1000,modules
+
+
+def clearBytecode():
+    shutil.rmtree(os.path.join(srcFolder,"__pycache__"),ignore_errors=True)
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc startup benchmark")
+    parser.add_argument('--runs',type=int,default=10,help='number of warm runs per subcommand')
+    parser.add_argument('--budget-ms',type=float,help='fail when warm start of a subcommand exceeds this value')
+    arguments=parser.parse_args()
+
+    home=tempfile.mkdtemp(prefix="bpc-bench-")
+    failures=[]
+    try:
+        createHome(home)
+        env=dict(os.environ,HOME=home,USERPROFILE=home)
+
+        print("{:<20} {:>10} {:>10} {:>12}  {}".format("subcommand","cold ms","warm ms","import ms","heavy modules"))
+        for args,allowed in scenarios:
+            clearBytecode()
+            cold,_=runBpc(args,env)
+            warm=statistics.median([runBpc(args,env)[0] for _ in range(arguments.runs)])
+            importms,modules=parseImportTime(runBpc(args,env,importtime=True)[1])
+            heavy=[m for m in heavyModules if m in modules]
+            name=" ".join(args)
+            print("{:<20} {:>10.1f} {:>10.1f} {:>12.1f}  {}".format(name,cold,warm,importms,",".join(heavy) or "-"))
+
+            if arguments.budget_ms is not None:
+                if warm > arguments.budget_ms:
+                    failures.append("'{}' warm start {:.1f} ms exceeds budget {} ms".format(name,warm,arguments.budget_ms))
+                unexpected=[m for m in heavy if m not in allowed]
+                if unexpected:
+                    failures.append("'{}' loads {}".format(name,",".join(unexpected)))
+    finally:
+        shutil.rmtree(home,ignore_errors=True)
+
+    for failure in failures:
+        print("FAIL: "+failure,file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
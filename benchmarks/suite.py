@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""End to end benchmark of bpc commands against a local Bitbucket Server mock
+
+For every dataset size a mock server (benchmarks/mockserver.py) is started
+and the real bpc command line is run in a separate HOME, from a git
+repository whose remote points to the mock. Every scenario reports wall
+time, number of requests and bytes received from the server, and peak RSS
+of the bpc process.
+
+Usage:
+    python benchmarks/suite.py [--sizes 10,1000,50000] [--latency S] [--page-size N] [--runs N] [--scenarios NAMES] [--json FILE]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+benchmarksFolder=os.path.dirname(os.path.abspath(__file__))
+bpc=os.path.join(benchmarksFolder,os.pardir,"src","bpc.py")
+sys.path.insert(0,benchmarksFolder)
+
+import mockserver
+
+# name, bpc arguments, folders (relative to HOME/.bpc) removed before every run
+scenarios=[
+    ("config --list",["config","--list"],[]),
+    ("remote projects",["remote","--no-cache"],[]),
+    ("remote --project",["remote","--project","P0","--no-cache"],[]),
+    ("remote --all-projects cold",["remote","--all-projects"],["cache"]),
+    ("remote --all-projects warm",["remote","--all-projects"],[]),
+    ("pr --list cold",["pr","--list"],["cache/pullrequests.db"]),
+    ("pr --list incremental",["pr","--list"],[]),
+    ("pr --list --all cold",["pr","--list","--all"],["cache/pullrequests.db"]),
+    ("pr --list --all incremental",["pr","--list","--all"],[]),
+    ("pr create",["pr","--title","Benchmark","--description","bench","--target-branch","master"],[]),
+    ("search --refresh",["search","--refresh","repo"],["cache/search.db"]),
+    ("search offline",["search","repo"],[]),
+]
+
+
+def runGit(folder,*args):
+    subprocess.run(["git"]+list(args),cwd=folder,check=True,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+
+
+def prepareHome(home,port):
+    """Create bpc configuration and a git repository bound to the mock server, return repository folder"""
+    baseurl="http://127.0.0.1:{}".format(port)
+    os.makedirs(os.path.join(home,".bpc"))
+    config={"common":{"version":2,"default_server":"mock","pr_message":"true","pr_message_commits":"false",
+        "pr_title_reponame":"true","pr_set_repo_title":"true","pr_set_empty_description":"false",
+        "pr_set_auto_fetch":"false","pr_set_auto_push":"false"},
+        "servers":{"mock":{"shortcut":"mock","baseurl":baseurl,"username":"alice","token":"secret"}},
+        "url-shortcut-map":{baseurl:"mock"},"repositories":{},"projects":{}}
+    with open(os.path.join(home,".bpc","config.json"),"w") as outfile:
+        json.dump(config,outfile)
+
+    repository=os.path.join(home,"repo-0")
+    os.makedirs(repository)
+    runGit(repository,"init","-q")
+    runGit(repository,"config","user.email","bench@example.com")
+    runGit(repository,"config","user.name","bench")
+    with open(os.path.join(repository,"README"),"w") as outfile:
+        outfile.write("benchmark\n")
+    runGit(repository,"add","-A")
+    runGit(repository,"commit","-q","-m","benchmark")
+    runGit(repository,"checkout","-q","-b","feature")
+    runGit(repository,"remote","add","origin","{}/scm/P0/repo-0.git".format(baseurl))
+    return repository
+
+
+def serverStats(port,reset=False):
+    request=urllib.request.Request("http://127.0.0.1:{}/{}".format(port,"_reset" if reset else "_stats"),method="POST" if reset else "GET")
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def runBpc(args,cwd,env):
+    """Run bpc, return (wall seconds, exit code, peak RSS in MB or None)"""
+    # output goes to a file: a full pipe would block bpc while waiting for it
+    with tempfile.TemporaryFile() as output:
+        start=time.perf_counter()
+        process=subprocess.Popen([sys.executable,bpc]+args,cwd=cwd,env=env,stdin=subprocess.DEVNULL,stdout=output,stderr=subprocess.STDOUT)
+        if hasattr(os,'wait4'):
+            _,status,usage=os.wait4(process.pid,0)
+            wall=time.perf_counter()-start
+            process.returncode=os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            # ru_maxrss is in KB on Linux, in bytes on macOS
+            rss=usage.ru_maxrss/(1024*1024 if "darwin" == sys.platform else 1024)
+        else:
+            process.wait()
+            wall=time.perf_counter()-start
+            rss=None
+        if process.returncode:
+            output.seek(0)
+            print("    bpc {} failed: {}".format(" ".join(args),output.read().decode(errors="replace").strip().splitlines()[-1:]),file=sys.stderr)
+    return wall,process.returncode,rss
+
+
+def runSize(repos,arguments,selected):
+    projects=max(1,min(arguments.projects,repos))
+    server=mockserver.start(0,projects,repos,arguments.prs,arguments.page_size,arguments.latency)
+    port=server.server_address[1]
+    home=tempfile.mkdtemp(prefix="bpc-suite-")
+    results=[]
+    try:
+        repository=prepareHome(home,port)
+        env=dict(os.environ,HOME=home,USERPROFILE=home,EDITOR="true",VISUAL="true")
+        # first run migrates configuration file
+        runBpc(["config","--list"],repository,env)
+
+        print("\n{} repositories in {} projects, latency {:.0f} ms, page size {}".format(repos,projects,arguments.latency*1000,arguments.page_size))
+        print("{:<30} {:>10} {:>9} {:>10} {:>9}".format("scenario","wall ms","requests","KB","RSS MB"))
+        for name,args,cleanup in selected:
+            walls=[]
+            for _ in range(arguments.runs):
+                for path in cleanup:
+                    path=os.path.join(home,".bpc",path)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    elif os.path.exists(path):
+                        os.remove(path)
+                serverStats(port,reset=True)
+                wall,code,rss=runBpc(args,repository,env)
+                walls.append(wall)
+                stats=serverStats(port)
+            result={"repos":repos,"scenario":name,"wall_ms":statistics.median(walls)*1000,"requests":stats["requests"],
+                "bytes":stats["bytes"],"peak_rss_mb":rss,"exit_code":code}
+            results.append(result)
+            print("{:<30} {:>10.1f} {:>9} {:>10.1f} {:>9}".format(name,result["wall_ms"],result["requests"],result["bytes"]/1024,
+                "-" if rss is None else "{:.1f}".format(rss)))
+    finally:
+        server.shutdown()
+        if not arguments.keep:
+            shutil.rmtree(home,ignore_errors=True)
+    return results
+
+
+def main():
+    parser=argparse.ArgumentParser(description="bpc end to end benchmark against a Bitbucket Server mock")
+    parser.add_argument('--sizes',default="10,1000",help='comma separated numbers of repositories, e.g. 10,1000,50000 (default: 10,1000)')
+    parser.add_argument('--projects',type=int,default=50,help='number of projects (default: 50)')
+    parser.add_argument('--prs',type=int,default=3,help='open pull requests of the first 10 repositories of each project')
+    parser.add_argument('--page-size',type=int,default=25,help='maximum page size of the server (default: 25)')
+    parser.add_argument('--latency',type=float,default=0.02,help='seconds added by the server to every request (default: 0.02)')
+    parser.add_argument('--runs',type=int,default=1,help='runs of every scenario, median wall time is reported')
+    parser.add_argument('--scenarios',help='comma separated scenario names prefixes (default: all): {}'.format(", ".join(name for name,_,_ in scenarios)))
+    parser.add_argument('--json',help='write results to this json file')
+    parser.add_argument('--keep',action='store_true',help='do not delete temporary HOME folders')
+    arguments=parser.parse_args()
+
+    selected=scenarios
+    if arguments.scenarios:
+        prefixes=[prefix.strip() for prefix in arguments.scenarios.split(",")]
+        selected=[scenario for scenario in scenarios if any(scenario[0].startswith(prefix) for prefix in prefixes)]
+
+    results=[]
+    for size in arguments.sizes.split(","):
+        results+=runSize(int(size),arguments,selected)
+
+    if arguments.json:
+        with open(arguments.json,"w") as outfile:
+            json.dump(results,outfile,indent=4)
+
+    if any(result["exit_code"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
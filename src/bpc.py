@@ -1,31 +1,56 @@
 #!/usr/bin/env python
-import traceback
+# Heavy libraries (stashy, GitPython, click) are imported lazily inside the
+# functions that need them, so that commands such as "bpc -h" or
+# "bpc config --list" do not pay for loading them: see benchmarks/startup.py
 import os  
-from os import path  
 import sys    
+
+if __name__ == "__main__" and sys.argv[1:2] == ["__complete"]:
+    # shell completion of dynamic values, answered before loading anything else: see completion.py
+    import completion
+    sys.exit(completion.answer(sys.argv[2:],os.path.join(os.path.expanduser("~"),".bpc")))
+
 import logging
 import argparse
-from git import exc
-import stashy
-import git
-from git import Repo
-import urllib
+import urllib.parse
 import json
 from pathlib import Path
-import click
-import distutils.core
-import shutil
 from datetime import datetime
 
 from version import __version__
+import timings
 
 
-configFileVersion=2
+configFileVersion=3
 configFileFolder=str(Path.home())+os.path.sep+".bpc"
-configFile=configFileFolder+os.path.sep+"config.json"
-configFileBackup=configFileFolder+os.path.sep+"config.json.backup"
+configFile=configFileFolder+os.path.sep+"config.db"
+# json configuration file used up to version 2
+legacyConfigFile=configFileFolder+os.path.sep+"config.json"
+legacyConfigFileBackup=configFileFolder+os.path.sep+"config.json.migrated"
+cacheFolder=configFileFolder+os.path.sep+"cache"
+daemonSocket=configFileFolder+os.path.sep+"daemon.sock"
+prIndexFile=cacheFolder+os.path.sep+"pullrequests.db"
+searchIndexFile=cacheFolder+os.path.sep+"search.db"
+usersCacheFile=cacheFolder+os.path.sep+"users.json"
+syncStateFile=cacheFolder+os.path.sep+"sync.json"
+diffCacheFolder=cacheFolder+os.path.sep+"diffs"
+branchIndexFolder=cacheFolder+os.path.sep+"branches"
+defaultCacheTtl=600
+defaultCacheMaxSize=50
+defaultMaxWorkers=8
+defaultDirtyCheck='quick'
+defaultUsersCacheTtl=86400
+defaultRateLimit=0
+defaultDiffCacheMaxSize=200
+# branches listing page size: the server caps it (page.max.branches, 1000 by default)
+branchesPageSize=1000
+defaultMaxRetries=4
+configStore=None
 configData=None
 currentServer=None
+daemonRunning=None
+# ask daemon to query the server instead of answering from its memory cache
+refreshRequested=False
 defaultEditor=None
 
 def errorExit(msg: str):
@@ -40,100 +65,131 @@ def criticalError(msg: str):
     logging.critical("Critical error: {}, exiting!".format(msg))
     sys.exit(2)
 
+def stashyErrorMessage(e):
+    """Extract error message from stashy exception"""
+    try:
+        return e.data['errors'][0]['message']
+    except (AttributeError,KeyError,IndexError,TypeError):
+        return str(e)
+
 def handleStashyException(e):
-    logging.error("Error creating PR: '{}'".format(e.data['errors'][0]['message']))
+    logging.error("Error creating PR: '{}'".format(stashyErrorMessage(e)))
 
 
 class repoInfo:
     """Hosts git repository details"""
-    def __init__(self,repositoryProject,repositoryName,basepath,baseurl,branch,url):
+    def __init__(self,repositoryProject,repositoryName,basepath,baseurl,branch,url,location=None):
         self.repositoryProject=repositoryProject
         self.repositoryName=repositoryName
         self.basepath=basepath
         self.baseurl=baseurl
         self.branch=branch
         self.url=url
+        self.location=location
 
 
-def getRepo() -> Repo:
-    """Get repository handle from current folder"""  
-    	#search the folder containing .git
-    drive=os.path.splitdrive(os.getcwd())[0]
-    logging.debug("Drive is {}".format(drive))
+def strtobool(val: str) -> bool:
+    """Convert a string representation of truth to True or False (same rules as distutils.util.strtobool)"""
+    val=val.lower()
+    if val in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    elif val in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    else:
+        raise ValueError("invalid truth value {}".format(val))
 
-    while not path.exists(".git"):
-        os.chdir("../")
-        logging.debug("new dir "+ os.getcwd())
-        curdir=os.getcwd().replace("\\","")
-        if curdir== drive or "/"==curdir :
-            break
 
-    if not path.exists(".git"):
+def findRepository(folder=None):
+    """Locate git repository containing folder (default: current folder)"""
+    import gitinfo
+    location=gitinfo.findRepository(folder or os.getcwd())
+    if location is None:
         criticalError("Please invoke bpc in folder containing git repository")
+    logging.debug("Repository found in {}".format(location.worktree))
+    return location
 
-    logging.debug("final dir "+ os.getcwd())
 
+def getRepo(folder=None):
+    """Get repository handle (git.Repo) from folder (default: current folder)"""  
+    return openRepo(findRepository(folder))
 
-    return Repo(".")
+@timings.phase("openRepo")
+def openRepo(location):
+    """Get repository handle (git.Repo) from an already located repository"""
+    from git import Repo
 
-def getLocalRepoInfo():
-    "Retrieve git information from working directory"
-    repo=getRepo()
-    
-    # Retrieve repo uri, then retrieve repo name and project
-    # Bitbucket server URL are like:
-    #       https://www.example.com:PORT/scm/PROJECT_KEY/REPO_NAME
-    #       https://www.example.com:PORT/scm/PROJECT_KEY/REPO_NAME.git
-    # But it can be deployed to different path:
-    #       https://www.example.com:PORT/subpath/scm/PROJECT_KEY/REPO_NAME.git
-    
-    remotes=repo.remotes
-    remote=remotes[0]
-    o=urllib.parse.urlparse(remote.url.lower())
-    
-    it=iter(o.path.split("/"))
-    # get rid of first empty token
-    next(it)
-    token=next(it)
-    basepath=""
-    try:
-        # Search for 'scm' in the URL
-        try:
-            while "scm" != token:
-                basepath=basepath + "/" + token
-                token=next(it)
-        except StopIteration:
-            pass
-        
-        repositoryProject=next(it)
-        repositoryName=next(it)
-        repositoryName=repositoryName.replace(".git","")
-    except:
-        logging.info("This repository seems not to be hosted in Bibucket Server: I cannot find 'scm' string on the URL '{}'".format(remote.url))
-    
-    baseurl=urllib.parse.urlunsplit([o.scheme,o.netloc,basepath,"",""])
-    
-    basepath=basepath.replace("/","")
-    
-    logging.info("Repository project name: {}".format(repositoryProject))
-    logging.info("Repository name: {}".format(repositoryName))
-    logging.info("Bitbucket basepath: {}".format(basepath))
-    logging.info("Bitbucket baseurl: {}".format(baseurl))
-    
-    branch=repo.active_branch.name
-    logging.info ("Current branch: {}".format(branch))
+    # GitPython resolves worktree from GIT_DIR/GIT_WORK_TREE by itself
+    if os.environ.get("GIT_DIR"):
+        return Repo(location.gitdir)
+    return Repo(location.worktree)
 
-    return repoInfo(repositoryProject,repositoryName,basepath,baseurl,branch,remote.url)
+@timings.phase("getLocalRepoInfo")
+def getLocalRepoInfo(folder=None):
+    "Retrieve git information from folder (default: current folder), without opening the repository"
+    import gitinfo
+
+    location=findRepository(folder)
+    try:
+        info=readLocalRepoInfo(location)
+    except gitinfo.RepositoryError as e:
+        criticalError(str(e))
+
+    logging.info("Repository project name: {}".format(info.repositoryProject))
+    logging.info("Repository name: {}".format(info.repositoryName))
+    logging.info("Bitbucket basepath: {}".format(info.basepath))
+    logging.info("Bitbucket baseurl: {}".format(info.baseurl))
+    logging.info ("Current branch: {}".format(info.branch))
+    return info
+
+def readLocalRepoInfo(location):
+    """Return git information of an already located repository, raise gitinfo.RepositoryError when it is not a Bitbucket one"""
+    import gitinfo
+    # Remote url parsing is cached until git config file changes
+    remoteInfo,branch=gitinfo.bitbucketInfo(location,cacheFolder+os.path.sep+"remotes.json")
+    bitbucket=remoteInfo['bitbucket']
+    return repoInfo(bitbucket['project'],bitbucket['name'],bitbucket['basepath'],bitbucket['baseurl'],branch,remoteInfo['url'],location)
 
 def get_pr_description():
+    import click
     MARKER = '#Insert PR comment above this line...(click without saving to avoid adding a comment)\n'
     message = click.edit('\n\n\n' + MARKER)
     if message is not None:
         return message.split(MARKER, 1)[0].rstrip('\n')
 
-def do_connect(config):
+def isDaemonRunning():
+    """Check once whether bpc daemon is available"""
+    global daemonRunning
+    if daemonRunning is None:
+        import daemon
+        daemonRunning=daemon.isRunning(daemonSocket)
+    return daemonRunning
+
+
+@timings.phase("connect")
+def do_connect(config, poolSize=None):
+    """Connect to Bitbucket server; poolSize sets how many connections can be kept open for concurrent requests
+
+    Requests are sent through bpc daemon when it is running"""
+    import stashy
+    import requests
+    import throttle
     logging.debug("Connecting...{} {} ".format(config['baseurl'], config['username']))
-    return stashy.connect(config['baseurl'], config['username'], config['token'])
+    session=requests.Session()
+    adapter=requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=poolSize or requests.adapters.DEFAULT_POOLSIZE)
+    if isDaemonRunning():
+        import daemon
+        logging.debug("Using bpc daemon {}".format(daemonSocket))
+        adapter=daemon.adapter(daemonSocket,adapter)
+        if refreshRequested:
+            session.headers['Cache-Control']='no-cache'
+    if timings.enabled:
+        adapter=timings.adapter(adapter)
+    # rate, concurrency and failures are tracked per server, whatever the connection used
+    adapter=throttle.adapter(adapter,float(getConfigOption('rate_limit',defaultRateLimit)),max(poolSize or 0,int(getConfigOption('max_workers',defaultMaxWorkers))),
+        int(getConfigOption('max_retries',defaultMaxRetries)))
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    return stashy.client.Stash(config['baseurl'], config['username'], config['token'], session=session)
 
 
 def printHeader():
@@ -141,30 +197,63 @@ def printHeader():
         logging.info(">> Using {} ".format(currentServer))
 
 
-def printPRinfo(pr):
-    logging.info (">> PR {} - {}".format(pr["id"],pr["title"]))
-    logging.info ("\t{} > {}".format(pr['fromRef']['displayId'],pr['toRef']['displayId']))
+def formatPRinfo(pr):
+    lines=[">> PR {} - {}".format(pr["id"],pr["title"])]
+    lines.append("\t{} > {}".format(pr['fromRef']['displayId'],pr['toRef']['displayId']))
     if "description" in pr:
-        logging.info ("\tDescription: {} ".format(pr["description"]))
+        lines.append("\tDescription: {} ".format(pr["description"]))
     else:
-        logging.info ("\tDescription: empty")
-    logging.info ("\tReviewers: " )
-
-    
-    it=iter(pr["reviewers"])
-    for reviewer in it:
-        logging.info ("\t\t{} -\t {}".format(reviewer["user"]["displayName"],reviewer["user"]["name"]))
-    
-def printProjectInfo(prj):
-    logging.info ("\t{} ({})".format(prj["key"],prj["name"]))
-
-def printBitbucketRepoInfo(repo):
-    logging.info ("\t{}".format(repo['slug']))
+        lines.append("\tDescription: empty")
+    lines.append("\tReviewers: ")
+    for reviewer in pr["reviewers"]:
+        lines.append("\t\t{} -\t {}".format(reviewer["user"]["displayName"],reviewer["user"]["name"]))
+    return "\n".join(lines)
 
+def printPRinfo(pr):
+    logging.info(formatPRinfo(pr))
+
+def formatProjectInfo(prj):
+    return "\t{} ({})".format(prj["key"],prj["name"])
+
+def formatBitbucketRepoInfo(repo):
+    return "\t{}".format(repo['slug'])
+
+# Listings output: text formatter and default fields of tsv format, by record kind
+outputFormatters={'project':formatProjectInfo,'repo':formatBitbucketRepoInfo,'pr':formatPRinfo}
+outputFields={'project':['server','key','name'],
+    'repo':['server','project.key','slug','name'],
+    'pr':['server','project','repo','id','state','title','author.user.name','fromRef.displayId','toRef.displayId','updatedDate']}
+
+def openRenderer(args,kind):
+    """Return renderer of records of kind (project, repo or pr) on standard output, in the format requested by command line"""
+    import output
+    return output.Renderer(args.format,outputFormatters[kind],output.parseFields(args.fields),outputFields[kind])
+
+
+def openListing(resource, validators=None, params=None, limit=None, prefetch=True):
+    """Start streaming listing of a stashy paged resource, using configured page size"""
+    from paging import PagedListing
+    pageSize=getConfigOption('page_size',None)
+    if pageSize:
+        pageSize=int(pageSize)
+    return PagedListing(resource._client,resource.url(),params,pageSize,limit,validators,prefetch).open()
+
+def openCache(args):
+    """Return listing cache, or None when disabled from command line"""
+    if getattr(args,'no_cache',False):
+        return None
+    from cache import ResponseCache
+    maxSize=int(getConfigOption('cache_max_size',defaultCacheMaxSize))*1024*1024
+    return ResponseCache(cacheFolder,maxSize)
 
 def do_list(args):
     "Lists projects or repositories"
+    from itertools import islice
+    from cache import cachedListing
+    global refreshRequested
+
     loadConfig(args)
+    refreshRequested=args.refresh
     printHeader()
     serverToUse=currentServer
 
@@ -175,33 +264,760 @@ def do_list(args):
         else:
             logging.error("Server {} not found in bpc configuration, using default one {}".format(args.server,currentServer))
 
-    remote=do_connect(configData['servers'][serverToUse])
+    serverConfig=configData['servers'][serverToUse]
+    cache=openCache(args)
+    ttl=int(getConfigOption('cache_ttl',defaultCacheTtl))
+
+    if args.all_servers or args.all_projects:
+        servers=[serverToUse]
+        if args.all_servers:
+            servers=sorted(configData['servers'])
+        do_list_all(args,servers,cache,ttl)
+        return
 
+    # Connection is opened only when cache cannot answer; items are printed
+    # as soon as they are received (or read from cache)
     if args.project:
             logging.info("Listing repositories for project {}".format(args.project))
             repoList=""
             try :
-                repoList=remote.projects[args.project].repos.list()
+                repoList=cachedListing(cache,"{}/projects/{}/repos".format(serverToUse,args.project),ttl,
+                    lambda validators: openListing(do_connect(serverConfig).projects[args.project].repos,validators,limit=args.limit),args.refresh)
             except:
-                logging.error("Project {} does not existing in server {}".format(args.project,configData['servers'][serverToUse]['shortcut']))
+                logging.error("Project {} does not existing in server {}".format(args.project,serverConfig['shortcut']))
 
-            for repo in repoList:
-                printBitbucketRepoInfo(repo)
+            with openRenderer(args,'repo') as renderer:
+                for repo in islice(repoList,args.limit):
+                    renderer.write(dict(repo,server=serverToUse))
     else :
         logging.info("Listing Bitbucket projects")
-        logging.info("\tkey (name)")
-        for prj in remote.projects.list():
-            printProjectInfo(prj)
+        prjList=cachedListing(cache,"{}/projects".format(serverToUse),ttl,
+            lambda validators: openListing(do_connect(serverConfig).projects,validators,limit=args.limit),args.refresh)
+        with openRenderer(args,'project') as renderer:
+            renderer.heading("\tkey (name)")
+            for prj in islice(prjList,args.limit):
+                renderer.write(dict(prj,server=serverToUse))
         
     return
 
 
+def do_list_all(args,servers,cache,ttl):
+    "Lists projects or repositories of many servers/projects concurrently"
+    from itertools import islice
+    from cache import cachedListing
+    from workers import runParallel
+
+    jobs=args.jobs or int(getConfigOption('max_workers',defaultMaxWorkers))
+
+    # One connection pool per server, shared by all worker threads
+    getRemote=sharedConnections(jobs)
+
+    # Listings are collected in memory, to print them in a stable order
+    def listProjects(shortcut):
+        return list(islice(cachedListing(cache,"{}/projects".format(shortcut),ttl,
+            lambda validators: openListing(getRemote(shortcut).projects,validators,limit=args.limit),args.refresh),args.limit))
+
+    def listRepos(task):
+        shortcut,project=task
+        return list(islice(cachedListing(cache,"{}/projects/{}/repos".format(shortcut,project),ttl,
+            lambda validators: openListing(getRemote(shortcut).projects[project].repos,validators,limit=args.limit),args.refresh),args.limit))
+
+    # Retrieve projects of each server, unless just one project is requested
+    projects={}
+    if args.project and not args.all_projects:
+        for shortcut in servers:
+            projects[shortcut]=[{"key":args.project,"name":args.project}]
+    else:
+        for shortcut,(prjList,error) in zip(servers,runParallel(listProjects,servers,jobs)):
+            if error:
+                logging.error("Cannot list projects of server {}: {}".format(shortcut,error))
+                prjList=[]
+            projects[shortcut]=prjList
+
+    listRepositories=args.project or args.all_projects
+    repos={}
+    if listRepositories:
+        tasks=[(shortcut,prj['key']) for shortcut in servers for prj in projects[shortcut]]
+        repos=dict(zip(tasks,runParallel(listRepos,tasks,jobs)))
+
+    # Print results in a stable order: servers sorted by shortcut, projects as returned by server
+    with openRenderer(args,'repo' if listRepositories else 'project') as renderer:
+        for shortcut in servers:
+            renderer.heading(">> Server {}".format(shortcut))
+            if not listRepositories:
+                renderer.heading("\tkey (name)")
+            for prj in projects[shortcut]:
+                if not listRepositories:
+                    renderer.write(dict(prj,server=shortcut))
+                    continue
+                repoList,error=repos[(shortcut,prj['key'])]
+                if error:
+                    logging.error("Project {} does not existing in server {}".format(prj['key'],shortcut))
+                    continue
+                renderer.heading(formatProjectInfo(prj))
+                for repo in repoList:
+                    renderer.write(dict(repo,server=shortcut))
+
+
+def cloneUrl(repo,baseurl,protocol):
+    """Return clone url of a server repository: its link with protocol (http or ssh), or the usual http one"""
+    for link in repo.get('links',{}).get('clone',[]):
+        if link.get('name') == protocol:
+            return link['href']
+    if 'ssh' == protocol:
+        return None
+    return "{}/scm/{}/{}.git".format(baseurl.rstrip('/'),repo['project']['key'].lower(),repo['slug'])
+
+def do_clone(args):
+    "Clones all repositories of a project concurrently"
+    import threading
+    import time
+    import clone
+    from cache import cachedListing
+    from workers import runParallel
+
+    loadConfig(args)
+    shortcut=args.server or currentServer
+    if shortcut not in configData['servers']:
+        errorExit("Server {} not found in bpc configuration".format(shortcut))
+    serverConfig=configData['servers'][shortcut]
+    jobs=args.jobs or int(getConfigOption('max_workers',defaultMaxWorkers))
+
+    # Same repositories listing (and cache) of "remote --project" command
+    try:
+        repos=list(cachedListing(openCache(args),"{}/projects/{}/repos".format(shortcut,args.project),int(getConfigOption('cache_ttl',defaultCacheTtl)),
+            lambda validators: openListing(do_connect(serverConfig).projects[args.project].repos,validators),args.refresh))
+    except Exception as e:
+        errorExit("Cannot list repositories of project {} in server {}: {}".format(args.project,shortcut,stashyErrorMessage(e)))
+
+    directory=os.path.abspath(args.directory)
+    os.makedirs(directory,exist_ok=True)
+    tasks=[]
+    skipped=0
+    for repo in repos:
+        destination=os.path.join(directory,repo['slug'])
+        if clone.isCloned(destination):
+            skipped+=1
+        else:
+            tasks.append((repo,destination))
+    logging.info("Cloning {} repositories of project {} into {} ({} already cloned, {} concurrent clones)".format(
+        len(tasks),args.project,directory,skipped,min(jobs,len(tasks))))
+
+    progress={'done':0,'bytes':0}
+    lock=threading.Lock()
+    start=time.monotonic()
+
+    def cloneRepo(task):
+        repo,destination=task
+        url=cloneUrl(repo,serverConfig['baseurl'],args.protocol)
+        if url is None:
+            raise RuntimeError("no {} clone url".format(args.protocol))
+        if os.path.exists(destination) and os.listdir(destination):
+            raise RuntimeError("{} already exists and is not a git repository".format(destination))
+        repoStart=time.monotonic()
+        with timings.span("clone"):
+            size=clone.cloneRepository(url,destination,args.depth,args.blobless,clone.referenceRepository(args.reference,repo['slug']),args.dissociate)
+        with lock:
+            progress['done']+=1
+            progress['bytes']+=size
+            elapsed=time.monotonic()-start
+            logging.info("[{}/{}] {} cloned in {:.1f}s, {:.1f} MB ({:.1f} MB/s overall)".format(progress['done'],len(tasks),repo['slug'],
+                time.monotonic()-repoStart,size/1048576,progress['bytes']/1048576/max(elapsed,0.001)))
+        return size
+
+    failures=0
+    for (repo,_),(_,error) in zip(tasks,runParallel(cloneRepo,tasks,jobs)):
+        if error:
+            failures+=1
+            logging.error("Cannot clone {}: {}".format(repo['slug'],error))
+    elapsed=time.monotonic()-start
+    logging.info("{} cloned, {} skipped, {} failed in {:.1f}s: {:.1f} MB, {:.1f} MB/s, {:.1f} repositories/min".format(
+        len(tasks)-failures,skipped,failures,elapsed,progress['bytes']/1048576,progress['bytes']/1048576/max(elapsed,0.001),
+        (len(tasks)-failures)*60/max(elapsed,0.001)))
+    if failures:
+        logging.info("Launch the same command again to retry failed clones")
+        sys.exit(1)
+
+def do_sync(args):
+    "Fetches many local repositories concurrently, skipping the ones whose remote did not change"
+    import time
+    import gitinfo
+    import gitsync
+    from workers import runParallel
+
+    loadConfig(args)
+    jobs=args.jobs or int(getConfigOption('max_workers',defaultMaxWorkers))
+
+    # Folders can be repositories (or folders inside them) or contain repositories
+    tasks=[]
+    seen=set()
+    for folder in args.folders or [os.getcwd()]:
+        if not os.path.isdir(folder):
+            logging.error("Folder {} does not exist".format(folder))
+            continue
+        locations=gitinfo.findRepositories(folder,args.depth) or [location for location in [gitinfo.findRepository(folder)] if location]
+        if not locations:
+            logging.warning("No git repository found in {}".format(folder))
+        for location in locations:
+            if location.worktree in seen:
+                continue
+            seen.add(location.worktree)
+            # same remote used by pr_set_auto_fetch: the first one
+            remotes=gitinfo.readRemotes(location.configPath)
+            if remotes:
+                tasks.append((location,remotes[0][0],remotes[0][1]))
+            else:
+                logging.warning("Repository {} has no remote".format(location.worktree))
+
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    state=gitsync.SyncState(syncStateFile)
+    start=time.monotonic()
+
+    def syncRepo(task):
+        location,remote,url=task
+        with timings.span("sync"):
+            result=gitsync.syncRepository(location,remote,url,state,args.force,args.prune)
+        logging.debug("{}: {}".format(location.worktree,result))
+        return result
+
+    results=runParallel(syncRepo,tasks,jobs)
+    state.save()
+
+    counts={gitsync.FETCHED:0,gitsync.UNCHANGED:0}
+    failures=0
+    for (location,remote,_),(result,error) in zip(tasks,results):
+        if error:
+            failures+=1
+            logging.error("{:<50} FAILED: {}".format(location.worktree,error))
+        else:
+            counts[result]+=1
+            if gitsync.FETCHED == result:
+                logging.info("{:<50} fetched from {}".format(location.worktree,remote))
+    logging.info("{} repositories synchronized in {:.1f}s: {} fetched, {} up to date, {} failed".format(
+        len(tasks),time.monotonic()-start,counts[gitsync.FETCHED],counts[gitsync.UNCHANGED],failures))
+    if failures:
+        sys.exit(1)
+
 def areSameUrl(first,second):
     """Compare url item to see if repository server matches bcp configured one"""
     f=urllib.parse.urlparse(first)
     s=urllib.parse.urlparse(second)
     return (f.path == s.path ) and (f.hostname == s.hostname) and (f.scheme == s.scheme) and (f.port == s.port)
 
+@timings.phase("isDirty")
+def isDirty(location,repo=None):
+    """Check whether working area contains uncommitted changes, using configured strategy"""
+    import dirtycheck
+    return dirtycheck.isDirty(location,getConfigOption('pr_dirty_check',defaultDirtyCheck),repo)
+
+def gitErrorMessage(error):
+    """Return the significant line of a GitPython command error"""
+    stderr=(getattr(error,'stderr','') or '').strip().strip("'").replace("stderr: '","")
+    lines=[line.strip() for line in stderr.splitlines() if line.strip()]
+    fatal=[line for line in lines if line.startswith(("fatal:","error:"))]
+    return (fatal or lines or [str(error)])[0]
+
+def updateRemoteBranch(repo,defaultOrigin,branch,location,interactive=True):
+    """Fetch from remote and push branch, according to auto fetch/push config options
+
+    When not interactive (background thread) git fails instead of prompting the user"""
+    import gitinfo
+    with repo.git.custom_environment(**({} if interactive else gitinfo.nonInteractiveEnv())):
+        _updateRemoteBranch(defaultOrigin,branch,location)
+
+def _updateRemoteBranch(defaultOrigin,branch,location):
+    if isConfigOptionEnabled('pr_set_auto_fetch'):
+        logging.info(f'Fetching from remote: {defaultOrigin}')
+        with timings.span("fetch"):
+            defaultOrigin.fetch()
+
+    if isConfigOptionEnabled('pr_set_auto_push'):
+        import tracking
+        upstream=tracking.upstreamOf(location,branch)
+        if upstream is None:
+            # Branch not yet pushed to upstream
+            logging.info(f'Local brach {branch} will be pushed, since it is not present in remote {defaultOrigin}')
+            with timings.span("push"):
+                defaultOrigin.push(f'{branch}:{branch}',None,set_upstream=True)
+            return
+
+        ahead,behind=tracking.aheadBehind(location,branch,upstream)
+        logging.info(f'Local brach {branch}: {ahead} ahead / {behind} behind {upstream.replace("refs/remotes/","")}')
+        if behind:
+            logging.warning(f'Local brach {branch} is missing {behind} commit(s) of remote branch')
+        if ahead:
+            logging.info(f'Local brach {branch} contains new commit, pushing to remote server')
+            with timings.span("push"):
+                defaultOrigin.push(branch)
+
+def formatPrTitle(info,prTitle):
+    """Add repo name to PR title, if enabled"""
+    if isConfigOptionEnabled('pr_set_repo_title'):
+        prTitle="[{}] - ".format(info.repositoryName) + prTitle
+    return prTitle
+
+def getDefaultTargetBranch(info):
+    """Retrieve default PR target branch of repository"""
+    defaultBranch='master'
+    if info.url in configData['repositories']:
+        repositorySetting=configData['repositories'][info.url]
+        if 'pr_default_branch' in repositorySetting:
+            defaultBranch=repositorySetting['pr_default_branch']
+    return defaultBranch
+
+def getDefaultReviewers(info):
+    """Search for default reviewers of repository project"""
+    prjkey=info.basepath+"-"+info.repositoryProject
+    prReviewers=None
+    if prjkey in configData['projects']: 
+        prReviewers=configData['projects'][prjkey]['pr-reviewers']
+    if prReviewers:
+        return prReviewers.split(",")
+    return None
+
+def branchExists(remote,info,branch):
+    """Check whether branch exists in Bitbucket repository"""
+    for ref in remote.projects[info.repositoryProject].repos[info.repositoryName].branches(filterText=branch):
+        if ref['displayId'] == branch:
+            return True
+    return False
+
+def openBranchIndex():
+    """Return target branches index, entries lasting as listings cache"""
+    from branchindex import BranchIndex
+    return BranchIndex(branchIndexFolder,int(getConfigOption('cache_ttl',defaultCacheTtl)))
+
+def branchIndexKey(config,info):
+    return "{}/{}/{}".format(config['shortcut'],info.repositoryProject.lower(),info.repositoryName.lower())
+
+def indexServerBranches(remote,info,index,key):
+    """List all branches of Bitbucket repository, store them in branch index and return them"""
+    from paging import PagedListing
+    # whole listing is always read: pages as large as the server accepts
+    listing=PagedListing(remote._client,"api/1.0/projects/{}/repos/{}/branches".format(info.repositoryProject,info.repositoryName),
+        {'orderBy':'ALPHABETICAL'},branchesPageSize)
+    branches=sorted(ref['displayId'] for ref in listing)
+    index.store(key,branches,'server')
+    return branches
+
+def promptTargetBranch(defaultBranch,getBranches):
+    """Ask target branch: tab completes names, unknown names are rejected once showing similar ones
+
+    getBranches() returns the sorted branch names known at the time. A name entered again is returned as is,
+    to be checked on the server (branch created after the listing)"""
+    import branchindex
+    try:
+        import readline
+    except ImportError:
+        readline=None
+    if readline:
+        def completer(text,state):
+            matches=branchindex.complete(getBranches(),text,100)
+            return matches[state] if state < len(matches) else None
+        # branch names contain "/" and "-"
+        readline.set_completer_delims('')
+        readline.set_completer(completer)
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind("bind ^I rl_complete")
+        else:
+            readline.parse_and_bind("tab: complete")
+    rejected=None
+    try:
+        while True:
+            branch=input("Please provide target branch (default: {}): ".format(defaultBranch)).strip() or defaultBranch
+            branches=getBranches()
+            if not branches or branch == rejected or branchindex.contains(branches,branch):
+                return branch
+            suggestions=branchindex.suggest(branches,branch)
+            logging.warning("Branch '{}' not found{}, enter it again to check it on the server".format(branch,
+                " (did you mean: {}?)".format(", ".join(suggestions)) if suggestions else ""))
+            rejected=branch
+    finally:
+        if readline:
+            readline.set_completer(None)
+
+def openReviewerResolver():
+    """Return reviewers resolver, backed by local users cache"""
+    from reviewers import ReviewerResolver,UserDirectory
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    ttl=int(getConfigOption('users_cache_ttl',defaultUsersCacheTtl))
+    return ReviewerResolver(UserDirectory(usersCacheFile,ttl),int(getConfigOption('max_workers',defaultMaxWorkers)))
+
+@timings.phase("validatePrSettings")
+def validatePrSettings(remote,info,config,reviewers,targetBranch,resolver):
+    """Check PR settings against server: return (server user names of reviewers, list of unknown reviewers, whether target branch exists)"""
+    users,unknown=resolver.resolve(config['shortcut'],remote._client,reviewers,config['username'])
+    return users,unknown,branchExists(remote,info,targetBranch)
+
+def getServerConfig(info):
+    """Return configuration of Bitbucket server hosting repository, or None"""
+    shortcut=configData['url-shortcut-map'].get(info.baseurl)
+    if shortcut not in configData['servers']:
+        return None
+    config=configData['servers'][shortcut]
+    if not areSameUrl(info.baseurl,config['baseurl']):
+        return None
+    return config
+
+def sharedConnections(poolSize):
+    """Return a function giving the connection to a server, created once and shared by worker threads"""
+    import threading
+    connections={}
+    lock=threading.Lock()
+    def getRemote(shortcut):
+        with lock:
+            if shortcut not in connections:
+                connections[shortcut]=(threading.Lock(),[])
+            serverLock,holder=connections[shortcut]
+        with serverLock:
+            if not holder:
+                holder.append(do_connect(configData['servers'][shortcut],poolSize))
+            return holder[0]
+    return getRemote
+
+def loadBatchManifest(items):
+    """Return (settings, repositories) from --batch arguments: a json manifest file or a list of folders"""
+    if 1 == len(items) and os.path.isfile(items[0]):
+        with open(items[0]) as infile:
+            manifest=json.load(infile)
+        basedir=os.path.dirname(os.path.abspath(items[0]))
+        repositories=[]
+        for entry in manifest.get('repositories',[]):
+            if isinstance(entry,str):
+                entry={'path':entry}
+            entry=dict(entry)
+            entry['path']=os.path.join(basedir,entry['path'])
+            repositories.append(entry)
+        return manifest,repositories
+    return {},[{'path':item} for item in items]
+
+def do_pr_batch(args):
+    """Creates the same Pull Request on many local repositories concurrently"""
+    import stashy
+    from workers import runParallel
+
+    settings,entries=loadBatchManifest(args.batch)
+    title=args.title or settings.get('title')
+    if not title:
+        errorExit("Please provide PR title using --title flag or 'title' manifest entry")
+    description=args.description or settings.get('description','')
+    sourceBranch=args.source_branch or settings.get('source_branch')
+    targetBranch=args.target_branch or settings.get('target_branch')
+    jobs=args.jobs or int(getConfigOption('max_workers',defaultMaxWorkers))
+
+    import gitinfo
+    tasks=[]
+    results={}
+    for entry in entries:
+        location=gitinfo.findRepository(entry['path'])
+        if location is None:
+            results[entry['path']]=(None,"not a git repository")
+            continue
+        try:
+            info=readLocalRepoInfo(location)
+            tasks.append((entry,info,openRepo(info.location)))
+        except Exception as e:
+            results[entry['path']]=(None,e)
+
+    getRemote=sharedConnections(jobs)
+    # users lookups are shared by all repositories
+    resolver=openReviewerResolver()
+
+    def createPr(task):
+        entry,info,repo=task
+        config=getServerConfig(info)
+        if config is None:
+            raise RuntimeError("no Bitbucket server configuration found for {}".format(info.baseurl))
+        if not isConfigOptionEnabled('pr_set_ignore_dirty_workarea') and isDirty(info.location,repo):
+            raise RuntimeError("uncommitted changes")
+
+        branch=entry.get('source_branch',sourceBranch) or info.branch
+        try:
+            # several workers run git at the same time: none of them can prompt the user
+            updateRemoteBranch(repo,repo.remotes[0],branch,info.location,interactive=False)
+        except Exception as e:
+            raise RuntimeError("fetch/push failed: {}".format(gitErrorMessage(e)))
+
+        remote=getRemote(config['shortcut'])
+        reviewers,unknown=resolver.resolve(config['shortcut'],remote._client,getDefaultReviewers(info),config['username'])
+        if unknown:
+            raise RuntimeError("reviewers not found in Bitbucket server: {}".format(",".join(unknown)))
+        return remote.projects[info.repositoryProject].repos[info.repositoryName].pull_requests.create(
+            formatPrTitle(info,entry.get('title',title)),branch,
+            entry.get('target_branch',targetBranch) or getDefaultTargetBranch(info),
+            entry.get('description',description),reviewers=reviewers)
+
+    for task,result in zip(tasks,runParallel(createPr,tasks,jobs)):
+        results[task[0]['path']]=result
+    resolver.directory.save()
+
+    # Summary table
+    failures=0
+    logging.info("\n{:<50} {}".format("Repository","Result"))
+    for entry in entries:
+        res,error=results[entry['path']]
+        if error is None:
+            logging.info("{:<50} PR {} created".format(entry['path'],res['id']))
+        else:
+            failures+=1
+            if isinstance(error,stashy.errors.GenericException):
+                error=stashyErrorMessage(error)
+            logging.info("{:<50} FAILED: {}".format(entry['path'],error))
+    logging.info("{} PR created, {} failed".format(len(entries)-failures,failures))
+
+    if failures:
+        sys.exit(1)
+
+def openPullRequestIndex():
+    """Open local pull requests index"""
+    from prindex import PullRequestIndex
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    return PullRequestIndex(prIndexFile)
+
+@timings.phase("syncPullRequests")
+def syncPullRequests(index,shortcut,remote,project,repo,full=False):
+    """Update local index with pull requests of a repository changed since last sync, return their number
+
+    Incremental syncs are conditional, using validators of the first page of previous sync stored in the index"""
+    from prindex import sync
+    def fetch(prefetch,validators):
+        # whole listing is read (prefetch) when repository was never synchronized: it cannot be conditional
+        return openListing(remote.projects[project].repos[repo].pull_requests,validators,params={'state':'ALL','order':'NEWEST'},prefetch=prefetch)
+    return sync(index,shortcut,project.lower(),repo.lower(),fetch,full)
+
+def printPullRequests(args,server,pullRequests,showRepository=False):
+    """Print (project, repo, pull request) tuples, grouped by repository"""
+    lastRepository=None
+    with openRenderer(args,'pr') as renderer:
+        for project,repo,pr in pullRequests:
+            if showRepository and (project,repo) != lastRepository:
+                renderer.heading("\n>> Repository {}/{}".format(project,repo))
+                lastRepository=(project,repo)
+            renderer.write(dict(pr,server=server,project=project,repo=repo))
+
+def watchPullRequests(args,info,config):
+    """Poll pull request args.watch (0: all pull requests of repository), printing their changes until interrupted or closed"""
+    import time
+    import stashy
+    import requests
+    from paging import PagedListing
+    import prwatch
+    serverErrors=(stashy.errors.GenericException,stashy.errors.NotFoundException,stashy.errors.AuthenticationException,requests.RequestException)
+
+    index=openPullRequestIndex()
+    shortcut=config['shortcut']
+    project,repo=info.repositoryProject.lower(),info.repositoryName.lower()
+    remote=do_connect(config)
+
+    def sync():
+        return syncPullRequests(index,shortcut,remote,info.repositoryProject,info.repositoryName)
+
+    def load(ids):
+        pullRequests={pr['id']:pr for _,_,pr in index.query(shortcut,project,repo,'OPEN')}
+        for id in ids or []:
+            if id not in pullRequests:
+                pr=index.get(shortcut,project,repo,id)
+                if pr is not None:
+                    pullRequests[id]=pr
+        return pullRequests
+
+    def fetchBuilds(commit,buildValidators):
+        listing=PagedListing(remote._client,"build-status/1.0/commits/{}".format(commit),validators=buildValidators).open()
+        if listing.notModified:
+            return None,buildValidators
+        return list(listing),listing.validators
+
+    watcher=prwatch.Watcher(sync,load,fetchBuilds,[args.watch] if args.watch else None)
+    interval=prwatch.PollInterval(args.interval,args.max_interval)
+
+    def emit(id,title,text):
+        sys.stdout.write("{} {}/{} #{} {}: {}\n".format(datetime.now().strftime("%H:%M:%S"),info.repositoryProject,info.repositoryName,id,title,text))
+        sys.stdout.flush()
+
+    try:
+        for id,title,text in watcher.start():
+            emit(id,title,text)
+    except serverErrors as e:
+        errorExit("Cannot get pull requests of {}/{}: {}".format(info.repositoryProject,info.repositoryName,stashyErrorMessage(e)))
+    if args.watch and args.watch not in watcher.states:
+        errorExit("Pull request {} not found in {}/{}".format(args.watch,info.repositoryProject,info.repositoryName))
+    if not args.watch:
+        logging.info("Watching {} open pull requests of {}/{}, press Ctrl+C to stop".format(len(watcher.states),info.repositoryProject,info.repositoryName))
+
+    changed=True
+    try:
+        while not watcher.done():
+            time.sleep(interval.next(changed))
+            try:
+                events=watcher.poll()
+            except serverErrors as e:
+                # server unavailable for a while: keep watching, less often
+                logging.warning("Cannot poll pull requests: {}".format(stashyErrorMessage(e)))
+                changed=False
+                continue
+            for id,title,text in events:
+                emit(id,title,text)
+            changed=bool(events)
+    except KeyboardInterrupt:
+        pass
+
+changeTypes={'ADD':'A','DELETE':'D','MODIFY':'M','MOVE':'R','COPY':'C'}
+
+def openPager():
+    """Return (binary stream, pager process or None): output goes to pager when standard output is a terminal"""
+    import shlex
+    import subprocess
+    if not sys.stdout.isatty():
+        return sys.stdout.buffer,None
+    command=os.environ.get('BPC_PAGER') or os.environ.get('PAGER') or ('more' if 'nt' == os.name else 'less -FRX')
+    try:
+        process=subprocess.Popen(command if 'nt' == os.name else shlex.split(command),stdin=subprocess.PIPE)
+    except OSError as e:
+        logging.debug("Cannot start pager {}: {}".format(command,e))
+        return sys.stdout.buffer,None
+    return process.stdin,process
+
+def showPullRequest(args,info,config):
+    """Print pull request details and changed files, and its diff with --diff
+
+    Changes and diff are cached by commits of source and target branches: an
+    unchanged pull request is shown again without downloading them"""
+    import stashy
+    from diffcache import DiffCache
+    serverErrors=(stashy.errors.GenericException,stashy.errors.NotFoundException,stashy.errors.AuthenticationException)
+
+    index=openPullRequestIndex()
+    shortcut=config['shortcut']
+    remote=None
+    prUrl="api/1.0/projects/{}/repos/{}/pull-requests/{}".format(info.repositoryProject,info.repositoryName,args.show)
+    if args.no_sync:
+        pr=index.get(shortcut,info.repositoryProject.lower(),info.repositoryName.lower(),args.show)
+        if pr is None:
+            errorExit("Pull request {} not found in local index, launch command without --no-sync".format(args.show))
+    else:
+        try:
+            remote=do_connect(config)
+            pr=remote.projects[info.repositoryProject].repos[info.repositoryName].pull_requests[args.show].get()
+        except serverErrors as e:
+            errorExit("Cannot read pull request {}: {}".format(args.show,stashyErrorMessage(e)))
+    fromCommit=pr['fromRef'].get('latestCommit')
+    toCommit=pr['toRef'].get('latestCommit')
+    cache=DiffCache(diffCacheFolder,int(getConfigOption('diff_cache_max_size',defaultDiffCacheMaxSize))*1024*1024)
+
+    def readChunks(infile):
+        with infile:
+            yield from iter(lambda: infile.read(65536),b'')
+
+    def cached(kind,fetch):
+        """Return chunks of cached entry, fetching and storing it when missing"""
+        infile=cache.open(fromCommit,toCommit,kind) if fromCommit and toCommit else None
+        if infile is not None:
+            logging.debug("Diff cache hit for {} {}..{}".format(kind,fromCommit,toCommit))
+            return readChunks(infile)
+        if args.no_sync:
+            errorExit("Changes of pull request {} are not cached, launch command without --no-sync".format(args.show))
+        chunks=fetch(remote or do_connect(config))
+        return cache.store(fromCommit,toCommit,kind,chunks) if fromCommit and toCommit else chunks
+
+    def fetchChanges(remote):
+        from paging import PagedListing
+        yield json.dumps(list(PagedListing(remote._client,prUrl+"/changes"))).encode()
+
+    def fetchDiff(remote):
+        from stashy.errors import maybe_throw
+        response=remote._client.get(prUrl+".diff",stream=True,headers={'Accept':'text/plain'})
+        maybe_throw(response)
+        return response.iter_content(65536)
+
+    try:
+        changes=json.loads(b"".join(cached("changes.json",fetchChanges)))
+    except serverErrors as e:
+        errorExit("Cannot read pull request {}: {}".format(args.show,stashyErrorMessage(e)))
+
+    logging.info(formatPRinfo(pr))
+    logging.info("\tState: {}".format(pr.get('state')))
+    logging.info("\tChanged files: {}".format(len(changes)))
+    for change in changes:
+        filePath=change.get('path',{}).get('toString','')
+        if change.get('srcPath'):
+            filePath="{} -> {}".format(change['srcPath'].get('toString',''),filePath)
+        logging.info("\t\t{} {}".format(changeTypes.get(change.get('type'),'?'),filePath))
+
+    if args.diff:
+        out,pager=openPager()
+        try:
+            for chunk in cached("diff",fetchDiff):
+                if out is not None:
+                    try:
+                        out.write(chunk)
+                    except BrokenPipeError:
+                        # pager closed: diff is still downloaded up to the end, to be cached
+                        out=None
+        except serverErrors as e:
+            errorExit("Cannot read pull request {}: {}".format(args.show,stashyErrorMessage(e)))
+        finally:
+            if out is not None:
+                try:
+                    out.flush()
+                except BrokenPipeError:
+                    pass
+            if pager is not None:
+                try:
+                    pager.stdin.close()
+                except BrokenPipeError:
+                    pass
+                pager.wait()
+
+def do_pr_list_all(args):
+    """Lists pull requests of every repository of a server, from local index synchronized with the server"""
+    from cache import cachedListing
+    from workers import runParallel
+
+    shortcut=args.server or currentServer
+    if shortcut not in configData['servers']:
+        errorExit("Server {} not found in bpc configuration".format(shortcut))
+    index=openPullRequestIndex()
+
+    if not args.no_sync:
+        jobs=args.jobs or int(getConfigOption('max_workers',defaultMaxWorkers))
+        getRemote=sharedConnections(jobs)
+        cache=openCache(args)
+        ttl=int(getConfigOption('cache_ttl',defaultCacheTtl))
+
+        # Repositories list comes from the same cache of "remote" command
+        def listRepos(project):
+            return [(project,repo['slug']) for repo in cachedListing(cache,"{}/projects/{}/repos".format(shortcut,project),ttl,
+                lambda validators: openListing(getRemote(shortcut).projects[project].repos,validators))]
+
+        try:
+            projects=[prj['key'] for prj in cachedListing(cache,"{}/projects".format(shortcut),ttl,
+                lambda validators: openListing(getRemote(shortcut).projects,validators))]
+        except Exception as e:
+            errorExit("Cannot list projects of server {}: {}".format(shortcut,stashyErrorMessage(e)))
+        repositories=[]
+        for project,(repoList,error) in zip(projects,runParallel(listRepos,projects,jobs)):
+            if error:
+                logging.error("Cannot list repositories of project {}: {}".format(project,stashyErrorMessage(error)))
+                continue
+            repositories+=repoList
+
+        def syncRepository(repository):
+            return syncPullRequests(index,shortcut,getRemote(shortcut),repository[0],repository[1],args.resync)
+
+        changed=0
+        for (project,repo),(count,error) in zip(repositories,runParallel(syncRepository,repositories,jobs)):
+            if error:
+                logging.error("Cannot synchronize pull requests of {}/{}: {}".format(project,repo,stashyErrorMessage(error)))
+            else:
+                changed+=count
+        logging.info("Synchronized {} repositories of server {}: {} pull requests changed".format(len(repositories),shortcut,changed))
+
+    printPullRequests(args,shortcut,index.query(shortcut,state=args.state,author=args.author,reviewer=args.reviewer,
+        target=args.target_branch,limit=args.limit),True)
+
 def do_pr(args): 
     """Manages Pull Requests"""
     logging.debug("do_pr...")
@@ -210,6 +1026,14 @@ def do_pr(args):
     
     printHeader()
 
+    if args.batch:
+        do_pr_batch(args)
+        return
+
+    if args.list and args.all:
+        do_pr_list_all(args)
+        return
+
     # Load info fro local git repository
     info=getLocalRepoInfo()
     
@@ -236,101 +1060,166 @@ def do_pr(args):
                 writeConfig()
                 sys.exit(0)
         
-
-            remote=do_connect(config)
+            import stashy
+            import click
             
+            # Show one PR
+            if args.show is not None:
+                showPullRequest(args,info,config)
+
+            elif args.watch is not None:
+                watchPullRequests(args,info,config)
+
             # List already existing PRs
-            if args.list:
+            elif args.list:
                 logging.info("\nListing PR for repository: {}".format(info.repositoryProject+"/"+info.repositoryName))
+                index=openPullRequestIndex()
 
-                try:
-                   
-                    res=remote.projects[info.repositoryProject].repos[info.repositoryName].pull_requests.list()
-                    for pr in res:
-                            printPRinfo(pr)
-                            
-                except stashy.errors.GenericException as e:
-                    handleStashyException(e)
+                if not args.no_sync:
+                    try:
+                        changed=syncPullRequests(index,config['shortcut'],do_connect(config),info.repositoryProject,info.repositoryName,args.resync)
+                        logging.debug("{} pull requests changed since last sync".format(changed))
+                    except stashy.errors.GenericException as e:
+                        handleStashyException(e)
+
+                printPullRequests(args,config['shortcut'],index.query(config['shortcut'],info.repositoryProject.lower(),info.repositoryName.lower(),
+                    args.state,args.author,args.reviewer,args.target_branch,args.limit))
 
             # PR creation
             else:
-                autofetch=True
+                import concurrent.futures
+                from concurrent.futures import ThreadPoolExecutor
+                import branchindex
+                from workers import deferBackgroundLogs
 
-                repo=getRepo()
+                repo=openRepo(info.location)
                 # TODO what to do with multiple remotes?
                 defaultOrigin=repo.remotes[0]
 
                 if not isConfigOptionEnabled('pr_set_ignore_dirty_workarea'):
-                    if list(repo.index.diff(None) or repo.index.diff(repo.head.commit)):
+                    if isDirty(info.location,repo):
                         errorExit("Please commit all uncommitted changes before creating PR")
                 else:
                     logging.warning("Ignoring dirty working area")
-                
-                if isConfigOptionEnabled('pr_set_auto_fetch'):
-                    logging.info(f'Fetching from remote: {defaultOrigin}')
-                    defaultOrigin.fetch()
 
-                if isConfigOptionEnabled('pr_set_auto_push'):
-                    branch=repo.active_branch.name
+                prrevlist=getDefaultReviewers(info)
+                defaultBranch=getDefaultTargetBranch(info)
+                resolver=openReviewerResolver()
+
+                # Network operations run in background while user provides PR details
+                # Target branches come from the index, from the server when index expired, or from local remote-tracking refs meanwhile
+                import gitinfo
+                branchIndex=openBranchIndex()
+                branchKey=branchIndexKey(config,info)
+                indexedBranches=branchIndex.get(branchKey)
+                localBranches=[]
+                fetchedBranches=[]
+
+                def updateBranches(interactive=False):
+                    updateRemoteBranch(repo,defaultOrigin,info.branch,info.location,interactive)
+                    if isConfigOptionEnabled('pr_set_auto_fetch'):
+                        # just fetched: local remote-tracking branches are as recent as the server listing
+                        branchIndex.store(branchKey,gitinfo.remoteBranches(info.location,defaultOrigin.name),'local')
+
+                def knownBranches():
+                    """Return most recent indexed branches, None when not yet available"""
+                    if indexing is not None and indexing.done() and indexing.exception() is None:
+                        return indexing.result()
+                    if updating.done() and not fetchedBranches:
+                        # background fetch replaced index entry with local remote-tracking branches
+                        fetchedBranches.append(branchIndex.get(branchKey))
+                    return (fetchedBranches or [None])[0] or indexedBranches
+
+                def promptBranches():
+                    branches=knownBranches()
+                    if branches is None:
+                        if not localBranches:
+                            localBranches.append(gitinfo.remoteBranches(info.location,defaultOrigin.name))
+                        branches=localBranches[0]
+                    return branches
+
+                executor=ThreadPoolExecutor(max_workers=4)
+                futures=[]
+                try:
+                    with deferBackgroundLogs():
+                        updating=executor.submit(updateBranches)
+                        connecting=executor.submit(do_connect,config)
+                        validating=executor.submit(lambda: validatePrSettings(connecting.result(),info,config,prrevlist,defaultBranch,resolver))
+                        indexing=None
+                        if indexedBranches is None and not args.target_branch:
+                            indexing=executor.submit(lambda: indexServerBranches(connecting.result(),info,branchIndex,branchKey))
+                        futures+=[future for future in (updating,connecting,validating,indexing) if future is not None]
+
+                        if not args.title:
+                            with timings.span("editor"):
+                                prTitle=click.edit("Insert title",defaultEditor)
+                            if None == prTitle and "" != prTitle:
+                                prTitle="Plese customize the title"
+                        else:
+                            prTitle=args.title 
+
+                        prTitle=formatPrTitle(info,prTitle)
+                       
+                        prDescription=""
+                        
+                        if args.description:
+                            prDescription=args.description
+                        elif isConfigOptionEnabled('pr_set_empty_description'):
+                            with timings.span("editor"):
+                                prDescription=get_pr_description()
+                        
+                        if args.target_branch:
+                            prTargetBranch=args.target_branch
+                        else:
+                            with timings.span("prompt"):
+                                prTargetBranch=promptTargetBranch(defaultBranch,promptBranches)
+
+                    # Join background operations before creating PR
+                    if not (updating.done() and validating.done()):
+                        logging.info("Waiting for fetch/push and server checks to complete...")
+                    with timings.span("waitBackground"):
+                        concurrent.futures.wait([updating,connecting,validating])
+                    if updating.exception() is not None:
+                        # background git cannot ask for credentials or confirm a host key: run again, allowed to prompt
+                        logging.warning("Updating remote branch in background failed, retrying: {}".format(updating.exception()))
+                        try:
+                            updateBranches(interactive=True)
+                        except Exception as e:
+                            errorExit("Updating remote branch failed: {}".format(e))
                     try:
-                        if list(repo.iter_commits(f'{branch}..{branch}@{{u}}')) or list(repo.iter_commits(f'{branch}@{{u}}..{branch}')):
-                            logging.info(f'Local brach {branch} contains new commit, pushing to remote server')
-                            defaultOrigin.push(branch)
-                    except Exception as e:
-                        # Repository not yet pushed to upstream
-                        if 128 == e.status:
-                            logging.info(f'Local brach {branch} will be pushed, since it is not present in remote {defaultOrigin}')
-                            defaultOrigin.push(f'{branch}:{branch}',None,set_upstream=True)
+                        remote=connecting.result()
+                        prrevlist,unknownReviewers,defaultBranchExists=validating.result()
+                        resolver.directory.save()
+                        if prTargetBranch == defaultBranch:
+                            targetBranchExists=defaultBranchExists
+                        elif knownBranches() is not None and branchindex.contains(knownBranches(),prTargetBranch):
+                            targetBranchExists=True
                         else:
-                            raise
-                
-
-                if not args.title:
-                    prTitle=click.edit("Insert title",defaultEditor)
-                    if None == prTitle and "" != prTitle:
-                        prTitle="Plese customize the title"
-                else:
-                    prTitle=args.title 
-
-                # Add repo name to PR title
-                if isConfigOptionEnabled('pr_set_repo_title'):
-                    prTitle="[{}] - ".format(info.repositoryName) + prTitle
-               
-                prDescription=""
-                
-                if isConfigOptionEnabled('pr_set_empty_description'):
-                    prDescription=get_pr_description()
-                
-                # Retrieve default brach
-                defaultBranch='master'
-                if info.url in configData['repositories']:
-                    repositorySetting=configData['repositories'][info.url]
-                    if 'pr_default_branch' in repositorySetting:
-                        defaultBranch=repositorySetting['pr_default_branch']
-            
-                
-                prTargetBranch=input("Please provide target branch (default: {}): ".format(defaultBranch))
-                
-                if None == prTargetBranch or "" == prTargetBranch:
-                    prTargetBranch=defaultBranch
-
-                # Search for default reviewers
-                prjkey=info.basepath+"-"+info.repositoryProject
-                prReviewers=None
-                if prjkey in configData['projects']: 
-                    prReviewers=configData['projects'][prjkey]['pr-reviewers']
-                if prReviewers:
-                    prrevlist=prReviewers.split(",")
-                else:
-                    prrevlist=None
+                            # branch may have been created after index was built
+                            targetBranchExists=branchExists(remote,info,prTargetBranch)
+                    except stashy.errors.GenericException as e:
+                        errorExit("Bitbucket server check failed: {}".format(stashyErrorMessage(e)))
+                    except Exception as e:
+                        errorExit("Cannot connect to Bitbucket server {}: {}".format(config['baseurl'],e))
+                finally:
+                    # interrupted (Ctrl-C) or failed: background operations not yet started are not run
+                    for future in futures:
+                        future.cancel()
+                    executor.shutdown(wait=False)
+
+                if unknownReviewers:
+                    errorExit("Reviewers not found in Bitbucket server: {}".format(",".join(unknownReviewers)))
+                if not targetBranchExists:
+                    errorExit("Target branch '{}' does not exist in repository {}".format(prTargetBranch,info.repositoryProject+"/"+info.repositoryName))
 
                 logging.debug("PR recap:\n\tTitle: '{}'".format(prTitle))
                 logging.debug("\tDescription: '{}'".format(prDescription))
                 logging.debug("\tTarget branch:'{}'".format(prTargetBranch))
-                logging.debug("\tReviewers:'{}'".format(prReviewers))
+                logging.debug("\tReviewers:'{}'".format(prrevlist))
 
                 try:
-                    res=remote.projects[info.repositoryProject].repos[info.repositoryName].pull_requests.create(prTitle,info.branch,prTargetBranch,prDescription,reviewers=prrevlist)
+                    with timings.span("createPullRequest"):
+                        res=remote.projects[info.repositoryProject].repos[info.repositoryName].pull_requests.create(prTitle,info.branch,prTargetBranch,prDescription,reviewers=prrevlist)
                     logging.info("PR created:")
                     printPRinfo(res)
                 except stashy.errors.GenericException as e:
@@ -340,88 +1229,92 @@ def do_pr(args):
     return
 
 def writeConfig():
-    "Just dumps configuration data as Json text file"
+    "Write configuration changes to configuration database"
     logging.info("Writing config file {}".format(configFile))
     try:
-        if not os.path.exists(configFileFolder):
-            os.makedirs(configFileFolder)
-        
-        #create a backup copy
-        shutil.copyfile(configFile, configFileBackup)
-        
-        try:
-            with open(configFile, 'w+') as outfile:
-                json.dump(configData, outfile,indent=4, sort_keys=True)
-
-        except Exception as e:
-            #restore original file
-            shutil.copyfile(configFileBackup, configFile)
-            logging.error("Error dumping json data to config file...")
-            raise
-
+        configStore.commit()
     except Exception as e:
-        logging.error("Error writing creating config file...")
+        logging.error("Error writing config file {}: {}".format(configFile,e))
         raise
 
     return None
 
 
 def createConfig():
-    """Create config file from scratch"""
-    global configData
-    common={f'"version":"{configFileVersion}","pr_message": "true", \
-    "pr_message_commits": "false","default_server":"",\
-    "pr_title_reponame":"true","pr_set_repo_title":"true",\
-    "pr_set_empty_description":"true",\
-    "pr_set_auto_fetch":"true",\
-    "pr_set_auto_push":"true"'
+    """Create config from scratch"""
+    common={"version":str(configFileVersion),"pr_message": "true",
+    "pr_message_commits": "false","default_server":"",
+    "pr_title_reponame":"true","pr_set_repo_title":"true",
+    "pr_set_empty_description":"true",
+    "pr_set_auto_fetch":"true",
+    "pr_set_auto_push":"true"
     }
-    configData={"common":common,"servers":{},"url-shortcut-map":{},"repositories":{},"projects":{}}
+    configStore.importData({"common":common})
     logging.debug(configData)
 
+def migrateConfig():
+    """Import legacy json config file (version 2 or older) in configuration database"""
+    logging.warning("Migrating configuration file {} to {}".format(legacyConfigFile,configFile))
+    try:
+        with open(legacyConfigFile) as temp:
+            legacyData=json.load(temp)
+    except ValueError:
+        criticalError("Configuration file '{}' is corrupted, please fix or remove it".format(legacyConfigFile))
+    configStore.importData(legacyData)
+    writeConfig()
+    os.replace(legacyConfigFile,legacyConfigFileBackup)
+
 def isConfigOptionEnabled(option: str):
     if option in configData['common']:
-        return bool(distutils.util.strtobool(configData['common'][option]))
+        return strtobool(configData['common'][option])
     else:
         return False
+
+def getConfigOption(option: str, default):
+    """Return value of a common config option, or default when missing"""
+    if option in configData['common']:
+        return configData['common'][option]
+    else:
+        return default
     
+@timings.phase("loadConfig")
 def loadConfig(args):
     "Load configuration file"
     
     global currentServer
+    global configStore
     global configData
 
-    if not os.path.exists(configFile) or os.stat(configFile).st_size == 0:
-        logging.info("Configuration file is empty, please add at least one Bitbucket server entry, and re-launch the command...")
-        createConfig()
-        addServer(args)
-        sys.exit(0)
+    from configstore import ConfigStore
 
+    if not os.path.exists(configFileFolder):
+        os.makedirs(configFileFolder)
 
     try:
-        with open(configFile) as temp:
-            configData = json.load(temp)
-
-            #Upgrading config file
-            if configData['common']['version']!=configFileVersion:
-                logging.warning("Current config file is using old version {}: upgrading to version {}".format(configData['common']['version'],configFileVersion))
-                shutil.copyfile(configFile, configFileBackup+datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
-                configData['common']['version']=configFileVersion
-
-                #since config v2
-                if 'pr_set_auto_fetch' not in configData['common']:
-                    configData['common']['pr_set_auto_fetch']="true"
-                if 'pr_set_auto_push' not in configData['common']:
-                    configData['common']['pr_set_auto_push']="true"
-                if 'projects' not in configData['common']:
-                    configData['projects']={}
-                writeConfig()
+        configStore=ConfigStore(configFile)
+        configData=configStore.sections
+        if configStore.isEmpty() and os.path.exists(legacyConfigFile) and os.stat(legacyConfigFile).st_size != 0:
+            migrateConfig()
+    except Exception as e:
+        criticalError("Configuration file '{}' is corrupted ({}), please launch bcp with \"config\" command!".format(configFile,e))
 
+    if configStore.isEmpty():
+        logging.info("Configuration file is empty, please add at least one Bitbucket server entry, and re-launch the command...")
+        createConfig()
+        addServer(args)
+        sys.exit(0)
 
-                
+    #Upgrading config file
+    if str(configData['common']['version'])!=str(configFileVersion):
+        logging.warning("Current config file is using old version {}: upgrading to version {}".format(configData['common']['version'],configFileVersion))
+        configData['common']['version']=str(configFileVersion)
 
-    except :
-        logging.error("Configuration file '{}' is corrupted, please launch bcp with \"config\" command!".format(configFile))
+        #since config v2
+        if 'pr_set_auto_fetch' not in configData['common']:
+            configData['common']['pr_set_auto_fetch']="true"
+        if 'pr_set_auto_push' not in configData['common']:
+            configData['common']['pr_set_auto_push']="true"
+        writeConfig()
     
     if configData['common']['default_server']:
         currentServer=configData['servers'][configData['common']['default_server']]
@@ -440,8 +1333,12 @@ def do_config(args):
     if args.list:
         logging.info("Server list: {}".format(configData["servers"])) 
 
+    # Dump whole configuration
+    elif args.export:
+        print(json.dumps(configStore.exportData(),indent=4,sort_keys=True))
+
     # Configure global options
-    elif args.pr_set_repo_title or args.pr_set_empty_description or args.pr_set_auto_fetch or args.pr_set_auto_push : 
+    elif args.pr_set_repo_title or args.pr_set_empty_description or args.pr_set_auto_fetch or args.pr_set_auto_push or args.cache_ttl is not None or args.cache_max_size is not None or args.max_workers is not None or args.page_size is not None or args.pr_dirty_check or args.users_cache_ttl is not None or args.rate_limit is not None or args.max_retries is not None or args.diff_cache_max_size is not None: 
         if args.pr_set_repo_title:
             configData['common']['pr_set_repo_title']=args.pr_set_repo_title
         if args.pr_set_empty_description:
@@ -450,6 +1347,24 @@ def do_config(args):
             configData['common']['pr_set_auto_fetch']=args.pr_set_auto_fetch
         if args.pr_set_auto_push:
             configData['common']['pr_set_auto_push']=args.pr_set_auto_push    
+        if args.cache_ttl is not None:
+            configData['common']['cache_ttl']=str(args.cache_ttl)
+        if args.cache_max_size is not None:
+            configData['common']['cache_max_size']=str(args.cache_max_size)
+        if args.max_workers is not None:
+            configData['common']['max_workers']=str(args.max_workers)
+        if args.page_size is not None:
+            configData['common']['page_size']=str(args.page_size)
+        if args.rate_limit is not None:
+            configData['common']['rate_limit']=str(args.rate_limit)
+        if args.max_retries is not None:
+            configData['common']['max_retries']=str(args.max_retries)
+        if args.diff_cache_max_size is not None:
+            configData['common']['diff_cache_max_size']=str(args.diff_cache_max_size)
+        if args.pr_dirty_check:
+            configData['common']['pr_dirty_check']=args.pr_dirty_check
+        if args.users_cache_ttl is not None:
+            configData['common']['users_cache_ttl']=str(args.users_cache_ttl)
         writeConfig()
 
     # Configure PR reviewers
@@ -480,7 +1395,22 @@ def do_config(args):
         #else:
         #    prsettings={}
 
-        prjsettings['pr-reviewers']=args.set_default_pr_reviewers
+        # Store reviewers as known by server, when it can be reached
+        reviewers=args.set_default_pr_reviewers
+        try:
+            import stashy
+            config=configData['servers'][args.server]
+            resolver=openReviewerResolver()
+            # groups are kept, so that their members are resolved again when PR is created
+            names,unknown=resolver.canonicalize(args.server,do_connect(config)._client,reviewers)
+            resolver.directory.save()
+            if unknown:
+                errorExit("Reviewers not found in Bitbucket server: {}".format(",".join(unknown)))
+            reviewers=",".join(names)
+        except (stashy.errors.GenericException,OSError) as e:
+            logging.warning("Cannot check reviewers against server {}: {}".format(args.server,stashyErrorMessage(e)))
+
+        prjsettings['pr-reviewers']=reviewers
         projects[prjkey]=prjsettings
         configData['projects']=projects
 
@@ -556,45 +1486,272 @@ def addServer(args):
 
 
     
+def listingDigest(values):
+    """Return digest of listing values, telling whether they changed since last indexing"""
+    import hashlib
+    return hashlib.sha1(json.dumps(values,sort_keys=True).encode()).hexdigest()
+
+@timings.phase("refreshSearchIndex")
+def refreshSearchIndex(index,args):
+    """Index projects and repositories of every configured server, and pull requests of local index"""
+    import time
+    from cache import cachedListing
+    from workers import runParallel
+
+    start=time.time()
+    jobs=int(getConfigOption('max_workers',defaultMaxWorkers))
+    getRemote=sharedConnections(jobs)
+    cache=openCache(args)
+    ttl=int(getConfigOption('cache_ttl',defaultCacheTtl))
+    servers=sorted(configData['servers'])
+    # (source, digest, documents) of every listing, source being the listing cache key
+    sources=[]
+    # sources of unreachable servers/projects are kept as they are
+    kept=[]
+
+    def listProjects(shortcut):
+        return list(cachedListing(cache,"{}/projects".format(shortcut),ttl,
+            lambda validators: openListing(getRemote(shortcut).projects,validators)))
+
+    def listRepos(task):
+        shortcut,project=task
+        return list(cachedListing(cache,"{}/projects/{}/repos".format(shortcut,project),ttl,
+            lambda validators: openListing(getRemote(shortcut).projects[project].repos,validators)))
+
+    tasks=[]
+    for shortcut,(prjList,error) in zip(servers,runParallel(listProjects,servers,jobs)):
+        source="{}/projects".format(shortcut)
+        if error:
+            logging.error("Cannot list projects of server {}: {}".format(shortcut,stashyErrorMessage(error)))
+            kept.append(shortcut+"/")
+            continue
+        sources.append((source,listingDigest(prjList),[{"kind":"project","server":shortcut,
+            "title":"{} ({})".format(prj['key'],prj.get('name','')),"data":{"key":prj['key']},
+            "fields":[(prj['key'],4),(prj.get('name'),2)]} for prj in prjList]))
+        tasks+=[(shortcut,prj['key']) for prj in prjList]
+
+    for (shortcut,project),(repoList,error) in zip(tasks,runParallel(listRepos,tasks,jobs)):
+        source="{}/projects/{}/repos".format(shortcut,project)
+        if error:
+            logging.error("Cannot list repositories of project {} of server {}: {}".format(project,shortcut,stashyErrorMessage(error)))
+            kept.append(source)
+            continue
+        sources.append((source,listingDigest(repoList),[{"kind":"repo","server":shortcut,
+            "title":"{}/{}".format(project,repo['slug']),"data":{"project":project,"slug":repo['slug']},
+            "fields":[(repo['slug'],4),(repo.get('name'),2),(project,1)]} for repo in repoList]))
+
+    # pull requests titles come from local pull requests index, see "pr --list --all"
+    if os.path.exists(prIndexFile):
+        prIndex=openPullRequestIndex()
+        for shortcut,project,repo,watermark in prIndex.repositories():
+            if shortcut not in configData['servers']:
+                continue
+            pullRequests=prIndex.query(shortcut,project,repo,state='ALL')
+            sources.append(("{}/pullrequests/{}/{}".format(shortcut,project,repo),"{}/{}".format(watermark,len(pullRequests)),[{"kind":"pr","server":shortcut,
+                "title":"{}/{} #{} {} [{}]".format(project,repo,pr['id'],pr['title'],pr.get('state','')),"data":{"project":project,"repo":repo,"id":pr['id']},
+                "fields":[(pr['title'],2)]} for _,_,pr in pullRequests]))
+
+    indexed=index.update(sources)
+    seen=set(source for source,_,_ in sources)
+    index.removeSources([source for source in index.sources() if source not in seen and not any(source.startswith(prefix) for prefix in kept)])
+    documents,tokens=index.size()
+    logging.info("Search index refreshed in {:.1f}s: {} sources changed, {} documents, {} tokens".format(time.time()-start,indexed,documents,tokens))
+
+def do_search(args):
+    "Search projects, repositories and pull requests in local index"
+    from search import SearchIndex
+
+    loadConfig(args)
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    index=SearchIndex(searchIndexFile)
+
+    if args.refresh or index.isEmpty():
+        refreshSearchIndex(index,args)
+
+    if not args.query:
+        return
+    for kind,server,title,data,score in index.search(" ".join(args.query),args.type,args.limit):
+        logging.info("{}\t{}\t{}".format(kind,server,title))
+
+
+def do_daemon(args):
+    "Run bpc daemon, keeping connections to Bitbucket servers open for next bpc commands"
+    import daemon
+    if not daemon.isSupported():
+        criticalError("bpc daemon is not supported on this platform")
+
+    running=daemon.isRunning(daemonSocket)
+    if args.status or args.stop:
+        if not running:
+            errorExit("bpc daemon is not running")
+        if args.stop:
+            daemon.command(daemonSocket,'stop')
+            logging.info("bpc daemon stopped")
+            return
+        status=daemon.command(daemonSocket,'status')
+        logging.info("bpc daemon running, pid {}, since {}".format(status['pid'],datetime.fromtimestamp(status['started']).strftime("%Y-%m-%d %H:%M:%S")))
+        logging.info("\tservers: {}, sessions: {}".format(status['servers'],status['sessions']))
+        logging.info("\trequests: {}, answered from cache: {}, cached responses: {}".format(status['requests'],status['cache_hits'],status['cached']))
+        return
+
+    loadConfig(args)
+    if running:
+        errorExit("bpc daemon is already running")
+
+    if args.detach:
+        import subprocess
+        import time
+        # frozen executable is bpc itself; otherwise bpc script, launcher or zipapp
+        command=[sys.executable] if getattr(sys,'frozen',False) else [sys.executable,os.path.abspath(sys.argv[0])]
+        command+=['daemon','--idle-timeout',str(args.idle_timeout),'--cache-ttl',str(args.cache_ttl)]
+        process=subprocess.Popen(command,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,start_new_session=True)
+        for _ in range(50):
+            if daemon.isRunning(daemonSocket):
+                logging.info("bpc daemon started, pid {}".format(process.pid))
+                return
+            time.sleep(0.1)
+        errorExit("bpc daemon did not start")
+
+    server=daemon.Daemon(daemonSocket,args.idle_timeout,args.cache_ttl)
+    server.warm(sorted(set(config['baseurl'] for config in configData['servers'].values())))
+    logging.info("bpc daemon listening on {}, press Ctrl-C to stop".format(daemonSocket))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        logging.info("bpc daemon stopped")
+
+
+def do_completion(args):
+    """Print completion script of the whole command line for args.shell"""
+    import completion
+    sys.stdout.write(completion.script(args.parser,args.shell))
+
 def main():
     global __version__
 
     # create top level parser
     parser = argparse.ArgumentParser(description="Bitbucker Server python client",epilog="Version: {}".format(__version__),allow_abbrev=True)
     parser.add_argument('-d',action='store_true',help='print debug logs')
+    parser.add_argument('--timings',action='store_true',help='print time spent in every phase and HTTP request')
+    parser.add_argument('--trace-file',metavar='FILE',help='write phases and HTTP requests timings to FILE, in Chrome trace event format').completer='files'
     subparsers = parser.add_subparsers(title='subcommands', description='valid subcommands',help='sub-command help',dest='subparser_name')
 
     # create the parser for the "pr" command
     parser_pr = subparsers.add_parser('pr', help='manage Pull Request',aliases=['p'])
     parser_pr.add_argument('--list', action='store_true', help='List pull request')
+    parser_pr.add_argument('--show', type=int, metavar='ID', help='Show pull request details and changed files')
+    parser_pr.add_argument('--diff', action='store_true', help='With --show: show pull request diff, using a pager')
+    parser_pr.add_argument('--watch', type=int, nargs='?', const=0, metavar='ID', help='Poll pull request ID (default: all pull requests of repository), printing approvals, needs work, new commits, builds and merges as they happen')
+    parser_pr.add_argument('--interval', type=float, default=10, help='With --watch: seconds between polls after a change (default: 10)')
+    parser_pr.add_argument('--max-interval', type=float, default=300, help='With --watch: seconds between polls when nothing changes for a while (default: 300)')
+    parser_pr.add_argument('--all', action='store_true', help='With --list: list pull requests of every repository of the server')
+    parser_pr.add_argument('--server', help='Server queried by --list --all (default: default server)').completer='servers'
+    parser_pr.add_argument('--state', type=str.upper, choices=['OPEN','MERGED','DECLINED','ALL'], default='OPEN', help='With --list: state of listed pull requests (default: OPEN)')
+    parser_pr.add_argument('--author', help='With --list: only pull requests created by this user')
+    parser_pr.add_argument('--reviewer', help='With --list: only pull requests reviewed by this user')
+    parser_pr.add_argument('--no-sync', action='store_true', help='With --list and --show: do not contact the server, just query local pull requests index and diff cache')
+    parser_pr.add_argument('--resync', action='store_true', help='With --list: download again all pull requests, instead of changed ones only')
+    parser_pr.add_argument('--limit', type=int, help='Maximum number of pull requests to list')
+    parser_pr.add_argument('--format', choices=['text','json','ndjson','tsv'], default='text', help='With --list: output format (default: text)')
+    parser_pr.add_argument('--fields', help='With --list: comma separated list of attributes to print, dotted for nested ones (e.g. id,title,author.user.name)')
     parser_pr.add_argument('--title', help='Pull Request title')
     parser_pr.add_argument('--description', help='Pull Request description')
+    parser_pr.add_argument('--target-branch', help='Pull Request target branch, no prompt is shown; with --list: only pull requests to this branch')
+    parser_pr.add_argument('--source-branch', help='Pull Request source branch for --batch mode (default: current branch of each repository)')
+    parser_pr.add_argument('--batch', nargs='+', metavar='FOLDER|MANIFEST', help='Create the same Pull Request on many repositories: list of folders, or json manifest file').completer='files'
+    parser_pr.add_argument('--jobs', type=int, help='Maximum number of repositories processed concurrently in --batch and --list --all modes (default: max_workers config option)')
     parser_pr.add_argument('--set-default-branch', help='Pull request default target branch for current git repository')
     parser_pr.set_defaults(func=do_pr)
 
     # create the parser for the "config" command
     parser_config = subparsers.add_parser('config', help='configure global bcp options: just invoke it and enter requested informations',aliases=['c'])
     parser_config.add_argument('--list', action='store_true', help='List already configured servers')
+    parser_config.add_argument('--export', action='store_true', help='Print whole configuration as json')
     parser_config.add_argument('--server-base-url', help='Bitbucket server basename, e.g.: www.example.com/myBitbucketInstance')
     parser_config.add_argument('--server-shortcut', help='Bitbucket shortcut, e.g.: myBitbucketInstance')
     parser_config.add_argument('--username', help='Username to access Bitbucket')
     parser_config.add_argument('--token', help='Token to access Bitbucket')
-    parser_config.add_argument('--set-default-server', help='Set default server to query for projects/repositories')
+    parser_config.add_argument('--set-default-server', help='Set default server to query for projects/repositories').completer='servers'
     parser_config.add_argument('--pr-set-repo-title',choices=['true','false'], help='Add repository name to Pull Request title')
     parser_config.add_argument('--pr-set-empty-description',choices=['true','false'], help='Do not add any description to Pull Request')
     parser_config.add_argument('--pr-set-auto-fetch',choices=['true','false'], help='Fetch for latest changes before creating Pull Request')
     parser_config.add_argument('--pr-set-auto-push',choices=['true','false'], help='Push any new commit to remote server before creating Pull Request')
+    parser_config.add_argument('--pr-dirty-check',choices=['quick','status','gitpython'], help='Strategy used to detect uncommitted changes before creating Pull Request (default: {})'.format(defaultDirtyCheck))
+    parser_config.add_argument('--cache-ttl',type=int, help='Seconds projects/repositories listings are served from local cache (default: {})'.format(defaultCacheTtl))
+    parser_config.add_argument('--cache-max-size',type=int, help='Maximum size in MB of local cache (default: {})'.format(defaultCacheMaxSize))
+    parser_config.add_argument('--diff-cache-max-size',type=int, help='Maximum size in MB of pull requests changes and diffs cache (default: {})'.format(defaultDiffCacheMaxSize))
+    parser_config.add_argument('--max-workers',type=int, help='Maximum number of concurrent requests/operations (default: {})'.format(defaultMaxWorkers))
+    parser_config.add_argument('--users-cache-ttl',type=int, help='Seconds reviewers names checked against server are kept in local cache (default: {})'.format(defaultUsersCacheTtl))
+    parser_config.add_argument('--rate-limit',type=float, help='Maximum number of requests per second sent to each server, 0 for no limit (default: {})'.format(defaultRateLimit))
+    parser_config.add_argument('--max-retries',type=int, help='Number of retries of requests failed because server is busy or unreachable (default: {})'.format(defaultMaxRetries))
+    parser_config.add_argument('--page-size',type=int, help='Number of items requested to server for each page of listings (default: server default)')
     parser_config.add_argument('--set-default-pr-reviewers', help='Comma separate list of users that will be used as reviewers for Pull Request; it is mandatory to specify project using --project option')
-    parser_config.add_argument('--project', help='Specifies project when setting Pull Request reviewers')
-    parser_config.add_argument('--server', help='Specifies server when setting Pull Request reviewers')
+    parser_config.add_argument('--project', help='Specifies project when setting Pull Request reviewers').completer='projects'
+    parser_config.add_argument('--server', help='Specifies server when setting Pull Request reviewers').completer='servers'
     parser_config.set_defaults(func=do_config)
 
     # create the parser for the "remote" command
     parser_remote = subparsers.add_parser('remote', help='Show remote server information',aliases=['r'])
-    parser_remote.add_argument('--server', help='Specify server to query for projects/repositories')
-    parser_remote.add_argument('--project', help='List already configured servers')
+    parser_remote.add_argument('--server', help='Specify server to query for projects/repositories').completer='servers'
+    parser_remote.add_argument('--project', help='List already configured servers').completer='projects'
+    parser_remote.add_argument('--refresh', action='store_true', help='Ignore cached listing and query the server, updating the cache')
+    parser_remote.add_argument('--no-cache', action='store_true', help='Do not read nor write local cache')
+    parser_remote.add_argument('--all-servers', action='store_true', help='Query all configured servers')
+    parser_remote.add_argument('--all-projects', action='store_true', help='List repositories of all projects')
+    parser_remote.add_argument('--limit', type=int, help='Maximum number of projects/repositories to list')
+    parser_remote.add_argument('--jobs', type=int, help='Maximum number of concurrent requests (default: max_workers config option)')
+    parser_remote.add_argument('--format', choices=['text','json','ndjson','tsv'], default='text', help='Output format (default: text)')
+    parser_remote.add_argument('--fields', help='Comma separated list of attributes to print, dotted for nested ones (e.g. project.key,slug)')
     parser_remote.set_defaults(func=do_list)
 
+    # create the parser for the "clone" command
+    parser_clone = subparsers.add_parser('clone', help='Clone all repositories of a project concurrently')
+    parser_clone.add_argument('--project', required=True, help='Project whose repositories are cloned').completer='projects'
+    parser_clone.add_argument('--server', help='Server hosting the project (default: default server)').completer='servers'
+    parser_clone.add_argument('--directory', default='.', help='Folder receiving a folder for every repository (default: current folder)').completer='directories'
+    parser_clone.add_argument('--protocol', choices=['http','ssh'], default='http', help='Clone url used (default: http)')
+    parser_clone.add_argument('--depth', type=int, help='Shallow clone with history truncated to this number of commits')
+    parser_clone.add_argument('--blobless', action='store_true', help='Partial clone: file contents are downloaded only when needed (--filter=blob:none)')
+    parser_clone.add_argument('--reference', metavar='FOLDER', help='Folder containing repositories (plain or bare, named as their slug) whose objects are reused').completer='directories'
+    parser_clone.add_argument('--dissociate', action='store_true', help='With --reference: copy reused objects, so that clones do not depend on reference repositories')
+    parser_clone.add_argument('--jobs', type=int, help='Maximum number of concurrent clones (default: max_workers config option)')
+    parser_clone.add_argument('--refresh', action='store_true', help='Ignore cached repositories listing')
+    parser_clone.add_argument('--no-cache', action='store_true', help='Do not read nor write local cache')
+    parser_clone.set_defaults(func=do_clone)
+
+    # create the parser for the "sync" command
+    parser_sync = subparsers.add_parser('sync', help='Fetch many local repositories concurrently, skipping the ones whose remote did not change')
+    parser_sync.add_argument('folders', nargs='*', help='Repositories, or folders containing repositories (default: current folder)').completer='directories'
+    parser_sync.add_argument('--depth', type=int, default=2, help='Levels of subfolders searched for repositories (default: 2)')
+    parser_sync.add_argument('--force', action='store_true', help='Fetch even when remote branches and tags did not change since last sync')
+    parser_sync.add_argument('--prune', action='store_true', help='Remove remote-tracking branches deleted on remote')
+    parser_sync.add_argument('--jobs', type=int, help='Maximum number of concurrent fetches (default: max_workers config option)')
+    parser_sync.set_defaults(func=do_sync)
+
+    # create the parser for the "search" command
+    parser_search = subparsers.add_parser('search', help='Search projects, repositories and pull requests of all servers, using a local index',aliases=['s'])
+    parser_search.add_argument('query', nargs='*', help='Words to search, matching the beginning of words of keys, names and titles').completer='terms'
+    parser_search.add_argument('--refresh', action='store_true', help='Update local index from servers before searching')
+    parser_search.add_argument('--type', choices=['project','repo','pr'], help='Search only projects, repositories or pull requests')
+    parser_search.add_argument('--limit', type=int, default=20, help='Maximum number of results (default: 20)')
+    parser_search.add_argument('--no-cache', action='store_true', help='Do not use listing cache when refreshing index')
+    parser_search.set_defaults(func=do_search)
+
+    # create the parser for the "daemon" command
+    parser_daemon = subparsers.add_parser('daemon', help='Keep connections to Bitbucket servers open, speeding up next bpc commands')
+    parser_daemon.add_argument('--detach', action='store_true', help='Start daemon in background')
+    parser_daemon.add_argument('--stop', action='store_true', help='Stop running daemon')
+    parser_daemon.add_argument('--status', action='store_true', help='Show running daemon statistics')
+    parser_daemon.add_argument('--idle-timeout', type=int, default=3600, help='Exit after this number of seconds without requests (0: never, default: 3600)')
+    parser_daemon.add_argument('--cache-ttl', type=int, default=30, help='Seconds server responses are kept in memory (default: 30)')
+    parser_daemon.set_defaults(func=do_daemon)
+
+    # create the parser for the "completion" command
+    parser_completion = subparsers.add_parser('completion', help='Print shell completion script')
+    parser_completion.add_argument('shell', choices=['bash','zsh','fish'], help='Shell the script is written for')
+    parser_completion.set_defaults(func=do_completion,parser=parser)
+
     # Parse command line arguments
     arguments=parser.parse_args()
 
@@ -606,9 +1763,19 @@ def main():
     else:
         logging.basicConfig(format='%(message)s', level=loglevel)
 
+    if arguments.timings or arguments.trace_file:
+        timings.enable()
+
     # Invoke function associated with requested command
     if 'func' in arguments:
-        arguments.func(arguments)
+        try:
+            with timings.span("bpc {}".format(arguments.subparser_name)):
+                arguments.func(arguments)
+        finally:
+            if arguments.trace_file:
+                timings.writeTrace(arguments.trace_file,{'version':__version__,'command':arguments.subparser_name})
+            if arguments.timings:
+                timings.summary()
     else:
         parser.print_help(sys.stderr)
     
@@ -0,0 +1,87 @@
+"""Index of branches of a repository, for target branch completion and validation
+
+Branch names of every repository are stored sorted in a json file, so that
+prefix lookups are binary searches whatever the number of branches. Names
+come either from the server listing (source "server"), kept for ttl seconds,
+or from local remote-tracking refs right after a fetch (source "local"),
+which replace the server listing since they are at least as recent.
+"""
+import bisect
+import difflib
+import hashlib
+import json
+import os
+import time
+
+
+class BranchIndex:
+    def __init__(self,folder,ttl):
+        self.folder=folder
+        self.ttl=ttl
+
+    def _path(self,key):
+        return os.path.join(self.folder,hashlib.sha1(key.encode()).hexdigest()+".json")
+
+    def get(self,key):
+        """Return sorted branch names of repository key, None when not indexed or expired"""
+        try:
+            with open(self._path(key)) as infile:
+                entry=json.load(infile)
+        except (OSError,ValueError):
+            return None
+        if entry.get('key') != key or time.time()-entry['stored'] > self.ttl:
+            return None
+        return entry['branches']
+
+    def store(self,key,branches,source):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        path=self._path(key)
+        tmpPath=path+".{}.tmp".format(os.getpid())
+        with open(tmpPath,'w') as outfile:
+            json.dump({'key':key,'stored':time.time(),'source':source,'branches':sorted(set(branches))},outfile)
+        os.replace(tmpPath,path)
+
+
+def complete(branches,prefix,limit=None):
+    """Return branches starting with prefix, branches being sorted"""
+    start=bisect.bisect_left(branches,prefix)
+    end=len(branches) if limit is None else min(len(branches),start+limit)
+    matches=[]
+    for name in branches[start:end]:
+        if not name.startswith(prefix):
+            break
+        matches.append(name)
+    return matches
+
+
+def contains(branches,name):
+    i=bisect.bisect_left(branches,name)
+    return i < len(branches) and branches[i] == name
+
+
+def suggest(branches,name,limit=5):
+    """Return up to limit branches similar to name: with name as prefix, containing it (case insensitive), then close matches"""
+    matches=complete(branches,name,limit)
+    if len(matches) < limit:
+        lowered=name.lower()
+        matches+=[branch for branch in branches if lowered in branch.lower() and branch not in matches][:limit-len(matches)]
+    if len(matches) < limit:
+        matches+=[branch for branch in difflib.get_close_matches(name,_similarCandidates(branches,name),limit,0.6) if branch not in matches][:limit-len(matches)]
+    return matches
+
+
+def _similarCandidates(branches,name):
+    # close matches have about the same length, and usually the same folder (e.g. "feature/"): comparing every branch would be too slow
+    band=max(3,len(name)//3)
+    candidates=[branch for branch in branches if abs(len(branch)-len(name)) <= band]
+    if '/' in name:
+        folder=name.split('/')[0]
+        folders={branch.split('/')[0] for branch in candidates if '/' in branch}
+        if folder not in folders:
+            # typo in folder name
+            folder=(difflib.get_close_matches(folder,folders,1) or [folder])[0]
+        sameFolder=complete(candidates,folder+'/')
+        if sameFolder:
+            return sameFolder
+    return candidates
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Fast startup builds of bpc, as an alternative to PyInstaller onefile executables
+
+A PyInstaller onefile executable unpacks the interpreter, libraries and
+modules into a temporary folder at every launch before running anything. The
+builds made here run on an installed Python and are ready to import:
+    * dir: folder holding a "bpc" launcher (and "bpc.cmd" on Windows) and a
+      "lib" folder with bpc modules and their dependencies, bytecode
+      precompiled in __pycache__; nothing is extracted or compiled at launch
+    * zipapp: single "bpc.pyz" file holding the same modules with their
+      bytecode beside them, imported directly from the archive. Compiled
+      extensions are replaced by their pure Python fallback; the certificates
+      bundle of certifi is extracted to a temporary file when an https server
+      is contacted
+
+Dependencies are those of requirements.txt and their own requirements,
+copied from the current environment (install requirements.txt first) without
+tests, type stubs, packaging records and libraries bpc never imports.
+Launchers run the interpreter that made the build with -S: every module is in
+the build, so site-packages are neither scanned nor imported. Precompiled
+bytecode is only used by the same Python version; use --python to change the
+interpreter of the launchers, e.g. "/usr/bin/python3" when the build is
+installed on another machine.
+
+Usage:
+    python src/build.py [--variant dir|zipapp|all] [--dist FOLDER] [--python PATH]
+"""
+import argparse
+import compileall
+import os
+import re
+import shutil
+import stat
+import sys
+import warnings
+import zipapp
+try:
+    from importlib import metadata
+except ImportError:
+    # Python 3.7
+    import importlib_metadata as metadata
+
+srcFolder=os.path.dirname(os.path.abspath(__file__))
+
+# declared as runtime requirements but never imported by bpc
+unusedDistributions={'mock'}
+trimmedFolders={'__pycache__','tests','test'}
+trimmedSuffixes=('.pyi','.pyc','py.typed')
+keptDistInfo={'METADATA','top_level.txt'}
+extensionSuffixes=('.so','.pyd')
+
+launcher='''import os
+import runpy
+import sys
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),"lib"))
+runpy.run_module("bpc",run_name="__main__")
+'''
+
+zipLauncher='''import runpy
+runpy.run_module("bpc",run_name="__main__")
+'''
+
+
+def requirementName(requirement):
+    """Return (distribution name, marker or None) of a requirement specification"""
+    spec,_,marker=requirement.partition(';')
+    return re.match(r"\s*([A-Za-z0-9._-]+)",spec).group(1),marker.strip() or None
+
+
+def markerMatches(marker):
+    try:
+        from packaging.markers import Marker
+    except ImportError:
+        try:
+            from pip._vendor.packaging.markers import Marker
+        except ImportError:
+            # no way to evaluate: keep requirement unless it is an extra
+            return 'extra' not in marker
+    return Marker(marker).evaluate({'extra':''})
+
+
+def distributions(requirementsFile):
+    """Return installed distributions needed by requirementsFile, with their requirements"""
+    with open(requirementsFile) as infile:
+        pending=[line.split('#')[0].strip() for line in infile]
+    pending=[requirement for requirement in pending if requirement]
+    found={}
+    while pending:
+        name,marker=requirementName(pending.pop())
+        key=re.sub(r"[-_.]+","-",name).lower()
+        if key in found or key in unusedDistributions or (marker and not markerMatches(marker)):
+            continue
+        try:
+            distribution=metadata.distribution(name)
+        except metadata.PackageNotFoundError:
+            sys.exit("Distribution {} is not installed, install {} first".format(name,requirementsFile))
+        found[key]=distribution
+        pending+=distribution.requires or []
+    return sorted(found.values(),key=lambda distribution:distribution.metadata['Name'].lower())
+
+
+def keepFile(path):
+    parts=path.split('/')
+    if parts[0] == '..' or trimmedFolders.intersection(parts[:-1]) or parts[-1].endswith(trimmedSuffixes):
+        return False
+    if parts[0].endswith('.dist-info'):
+        return parts[-1] in keptDistInfo or 'LICENSE' in parts[-1].upper() or 'licenses' in parts
+    return True
+
+
+def copyDistribution(distribution,lib,pure):
+    """Copy files of an installed distribution into lib, return number of files copied"""
+    if distribution.files is None:
+        sys.exit("Files of {} are unknown (no RECORD), reinstall it with pip".format(distribution.metadata['Name']))
+    files=[str(path).replace('\\','/') for path in distribution.files]
+    files=[path for path in files if keepFile(path)]
+    if pure:
+        # extension modules cannot be imported from a zip archive
+        extensions=[path for path in files if path.endswith(extensionSuffixes)]
+        for path in extensions:
+            folder,name=os.path.split(path)
+            source=(folder+'/' if folder else '')+name.split('.')[0]+'.py'
+            if source not in files:
+                sys.exit("{} needs compiled module {}, use --variant dir".format(distribution.metadata['Name'],path))
+            files.remove(path)
+    for path in files:
+        target=os.path.join(lib,*path.split('/'))
+        os.makedirs(os.path.dirname(target),exist_ok=True)
+        shutil.copy2(str(distribution.locate_file(path)),target)
+    return len(files)
+
+
+def copyModules(lib):
+    for name in sorted(os.listdir(srcFolder)):
+        if name.endswith('.py') and 'build.py' != name:
+            shutil.copy2(os.path.join(srcFolder,name),os.path.join(lib,name))
+
+
+def populate(lib,pure):
+    os.makedirs(lib)
+    copyModules(lib)
+    for distribution in distributions(os.path.join(srcFolder,"requirements.txt")):
+        count=copyDistribution(distribution,lib,pure)
+        print("  {} {}: {} files".format(distribution.metadata['Name'],distribution.version,count))
+
+
+def precompile(folder,legacy=False):
+    with warnings.catch_warnings():
+        # old dependencies compare with literals using "is"
+        warnings.simplefilter('ignore',SyntaxWarning)
+        if not compileall.compile_dir(folder,quiet=1,legacy=legacy):
+            sys.exit("Compilation of {} failed".format(folder))
+
+
+def folderSize(folder):
+    return sum(os.path.getsize(os.path.join(root,name)) for root,_,names in os.walk(folder) for name in names)
+
+
+def buildDir(dist,python):
+    target=os.path.join(dist,"bpc")
+    print("Building {}".format(target))
+    shutil.rmtree(target,ignore_errors=True)
+    lib=os.path.join(target,"lib")
+    populate(lib,False)
+    precompile(lib)
+    path=os.path.join(target,"bpc")
+    with open(path,'w') as outfile:
+        outfile.write("#!{} -S\n# bpc launcher: runs bpc from the precompiled modules of lib folder\n".format(python)+launcher)
+    os.chmod(path,os.stat(path).st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+    with open(os.path.join(target,"bpc.cmd"),'w') as outfile:
+        outfile.write('@"{}" -S "%~dp0bpc" %*\n'.format(python))
+    print("  {:.1f} MB".format(folderSize(target)/(1024*1024)))
+    return path
+
+
+def buildZipapp(dist,python):
+    target=os.path.join(dist,"bpc.pyz")
+    print("Building {}".format(target))
+    staging=os.path.join(dist,"bpc.pyz.tmp")
+    shutil.rmtree(staging,ignore_errors=True)
+    try:
+        populate(staging,True)
+        with open(os.path.join(staging,"__main__.py"),'w') as outfile:
+            outfile.write(zipLauncher)
+        # zipimport only loads bytecode stored beside sources, never from __pycache__
+        precompile(staging,legacy=True)
+        # archive is not compressed: modules are read without inflating them
+        zipapp.create_archive(staging,target,interpreter="{} -S".format(python),filter=lambda path:'__pycache__' not in path.parts)
+    finally:
+        shutil.rmtree(staging,ignore_errors=True)
+    print("  {:.1f} MB".format(os.path.getsize(target)/(1024*1024)))
+    return target
+
+
+def main():
+    parser=argparse.ArgumentParser(description="Build bpc for fast startup")
+    parser.add_argument('--variant',choices=['dir','zipapp','all'],default='dir',help='build to make (default: dir)')
+    parser.add_argument('--dist',default=os.path.join(srcFolder,"dist"),help='output folder (default: src/dist)')
+    parser.add_argument('--python',default=sys.executable,help='interpreter run by launchers (default: current one)')
+    arguments=parser.parse_args()
+
+    os.makedirs(arguments.dist,exist_ok=True)
+    if arguments.variant in ('dir','all'):
+        buildDir(arguments.dist,arguments.python)
+    if arguments.variant in ('zipapp','all'):
+        buildZipapp(arguments.dist,arguments.python)
+
+
+if __name__ == "__main__":
+    main()
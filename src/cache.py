@@ -0,0 +1,147 @@
+"""On-disk cache for Bitbucket REST responses
+
+Every entry is made of two files stored in the cache folder:
+    * <hash>.json: key, time the entry was stored, its time to live and the
+      HTTP validators (ETag/Last-Modified) returned by the server, if any
+    * <hash>.ndjson: cached values, one json document per line, so that they
+      can be written and read back as a stream
+Entries are evicted in least recently used order when the folder grows over
+the configured size.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+
+
+class ResponseCache:
+    """Size bounded cache of REST listings with per entry TTL"""
+    def __init__(self,folder,maxSize):
+        self.folder=folder
+        self.maxSize=maxSize
+
+    def _path(self,key,ext):
+        return os.path.join(self.folder,hashlib.sha1(key.encode("utf-8")).hexdigest()+ext)
+
+    def get(self,key):
+        """Return cached entry metadata for key, or None"""
+        metaPath=self._path(key,".json")
+        try:
+            with open(metaPath) as infile:
+                entry=json.load(infile)
+        except (OSError,ValueError):
+            return None
+
+        if entry.get('key')!=key or not os.path.exists(self._path(key,".ndjson")):
+            return None
+
+        # mtime tracks last access for LRU eviction
+        try:
+            os.utime(metaPath)
+        except OSError:
+            pass
+        return entry
+
+    def isFresh(self,entry):
+        return time.time()-entry['stored'] < entry['ttl']
+
+    def values(self,key):
+        """Yield cached values for key"""
+        with open(self._path(key,".ndjson")) as infile:
+            for line in infile:
+                yield json.loads(line)
+
+    def store(self,key,listing,ttl):
+        """Yield items of listing while writing them to cache
+
+        Entry is committed only when listing has been completely consumed
+        (listing.complete is True), so truncated listings are never cached."""
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        dataPath=self._path(key,".ndjson")
+        tmpPath=dataPath+".{}.tmp".format(os.getpid())
+        try:
+            with open(tmpPath,"w") as outfile:
+                for item in listing:
+                    outfile.write(json.dumps(item)+"\n")
+                    yield item
+            if listing.complete:
+                os.replace(tmpPath,dataPath)
+                self._writeMeta(key,{"key":key,"stored":time.time(),"ttl":ttl,"validators":listing.validators})
+                self.evict()
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def touch(self,key,entry,ttl):
+        """Mark entry as fresh again, e.g. after server answered 304 Not Modified"""
+        entry['stored']=time.time()
+        entry['ttl']=ttl
+        self._writeMeta(key,entry)
+
+    def _writeMeta(self,key,entry):
+        metaPath=self._path(key,".json")
+        tmpPath=metaPath+".{}.tmp".format(os.getpid())
+        with open(tmpPath,"w") as outfile:
+            json.dump(entry,outfile)
+        os.replace(tmpPath,metaPath)
+
+    def evict(self):
+        """Remove least recently used entries until cache size is below maxSize"""
+        try:
+            files=[e for e in os.scandir(self.folder) if e.name.endswith(".json") or e.name.endswith(".ndjson")]
+        except OSError:
+            return
+
+        # group metadata and values files of the same entry
+        entries={}
+        for e in files:
+            stem,ext=os.path.splitext(e.name)
+            stat=e.stat()
+            mtime,size,paths=entries.get(stem,(0,0,[]))
+            if ext == ".json":
+                mtime=stat.st_mtime
+            entries[stem]=(mtime,size+stat.st_size,paths+[e.path])
+
+        total=sum(e[1] for e in entries.values())
+        for mtime,size,paths in sorted(entries.values()):
+            if total <= self.maxSize:
+                break
+            for entryPath in paths:
+                logging.debug("Evicting cache entry {}".format(entryPath))
+                try:
+                    os.remove(entryPath)
+                except OSError:
+                    pass
+            total-=size
+
+
+def cachedListing(cache,key,ttl,fetch,refresh=False):
+    """Return an iterable over values for key, calling fetch only when needed
+
+    fetch(validators) shall return an opened listing (see paging.PagedListing):
+    when its notModified attribute is set, cached values are returned.
+    When cache is None the cache is bypassed completely.
+    """
+    entry=None
+    if cache is not None:
+        entry=cache.get(key)
+
+    if entry is not None and not refresh and cache.isFresh(entry):
+        logging.debug("Cache hit for {}".format(key))
+        return cache.values(key)
+
+    validators=None
+    if entry is not None and not refresh:
+        validators=entry['validators']
+
+    listing=fetch(validators)
+    if listing.notModified:
+        logging.debug("Cache entry {} revalidated".format(key))
+        cache.touch(key,entry,ttl)
+        return cache.values(key)
+
+    if cache is None:
+        return iter(listing)
+    return cache.store(key,listing,ttl)
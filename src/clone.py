@@ -0,0 +1,81 @@
+"""Cloning of repositories with git command line
+
+A repository is cloned into a temporary folder next to its destination,
+renamed when clone succeeds: an existing destination is a complete clone,
+and can be skipped when cloning again after an interruption.
+"""
+import os
+import shutil
+import subprocess
+
+import gitinfo
+
+
+def partialFolder(destination):
+    """Return temporary folder used while cloning into destination"""
+    parent,name=os.path.split(os.path.abspath(destination))
+    return os.path.join(parent,".{}.bpc-clone".format(name))
+
+
+def isCloned(destination):
+    return os.path.isdir(os.path.join(destination,".git"))
+
+
+def folderSize(folder):
+    """Return size in bytes of files in folder"""
+    size=0
+    for root,_,files in os.walk(folder):
+        for name in files:
+            try:
+                size+=os.lstat(os.path.join(root,name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def referenceRepository(referenceFolder,name):
+    """Return repository named name (plain or bare) in referenceFolder, or None"""
+    if not referenceFolder:
+        return None
+    for candidate in [name,name+".git"]:
+        path=os.path.join(referenceFolder,candidate)
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def cloneRepository(url,destination,depth=None,blobless=False,reference=None,dissociate=False,timeout=None):
+    """Clone url into destination, return size in bytes of the clone
+
+    Raises RuntimeError with git error message when clone fails; nothing is
+    left in destination in that case"""
+    temp=partialFolder(destination)
+    if os.path.exists(temp):
+        # left over by an interrupted clone: git cannot resume it
+        shutil.rmtree(temp)
+    command=["git","clone","--quiet"]
+    if depth:
+        command+=["--depth",str(depth)]
+    if blobless:
+        command+=["--filter=blob:none"]
+    if reference:
+        command+=["--reference-if-able",reference]
+        if dissociate:
+            command+=["--dissociate"]
+    command+=[url,temp]
+    # credentials must come from git credential helpers or ssh agent: a prompt would block a worker forever
+    env=dict(os.environ,**gitinfo.nonInteractiveEnv())
+    try:
+        res=subprocess.run(command,stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+            universal_newlines=True,env=env,timeout=timeout)
+    except BaseException:
+        shutil.rmtree(temp,ignore_errors=True)
+        raise
+    if res.returncode:
+        shutil.rmtree(temp,ignore_errors=True)
+        lines=res.stderr.strip().splitlines()
+        errors=[line for line in lines if line.startswith("fatal:")]
+        raise RuntimeError((errors or lines or ["git clone failed with code {}".format(res.returncode)])[0])
+    size=folderSize(temp)
+    os.replace(temp,destination)
+    return size
@@ -0,0 +1,376 @@
+"""Shell completion for bash, zsh and fish
+
+Completion scripts are generated from the argparse tree of bpc: subcommands,
+options and option choices are completed by the shell itself. Dynamic values
+are asked to "bpc __complete KIND PREFIX [SERVER]", which bpc dispatches here
+before loading anything else: they are answered from local files only
+(configuration database, listings cache and search index), using the
+standard library, and never from the servers. Kinds of dynamic values:
+    * servers: configured server shortcuts
+    * projects: project keys of SERVER (default server when empty), from the
+      projects listing cached by "remote", "clone" or "search --refresh"
+    * terms: words of the search index (project keys, repository slugs and
+      names split as "search" matches them), read from its token index
+Arguments completed with dynamic values, files or directories are marked by a
+completer attribute on their argparse action (see completers).
+"""
+import json
+import os
+import sys
+
+command="__complete"
+shells=['bash','zsh','fish']
+completers=['servers','projects','terms','files','directories']
+# search terms returned at most: the search index may hold any number of repositories
+maxTerms=500
+
+
+def _config(configFolder):
+    """Return (common, servers) configuration sections"""
+    path=os.path.join(configFolder,"config.db")
+    if os.path.exists(path):
+        from configstore import ConfigStore
+        store=ConfigStore(path)
+        if not store.isEmpty():
+            return store.sections['common'],store.sections['servers']
+    # configuration not yet migrated by bpc
+    try:
+        with open(os.path.join(configFolder,"config.json")) as infile:
+            data=json.load(infile)
+    except (OSError,ValueError):
+        return {},{}
+    return data.get('common',{}),data.get('servers',{})
+
+
+def servers(configFolder,server,prefix=""):
+    return sorted(_config(configFolder)[1])
+
+
+def projects(configFolder,server,prefix=""):
+    if not server:
+        server=_config(configFolder)[0].get('default_server')
+    if not server:
+        return []
+    import hashlib
+    # file names of cache.ResponseCache, not imported since it loads logging
+    key="{}/projects".format(server)
+    path=os.path.join(configFolder,"cache",hashlib.sha1(key.encode("utf-8")).hexdigest()+".ndjson")
+    try:
+        with open(path) as infile:
+            # a single json document decodes much faster than one per line
+            listing=json.loads("["+",".join(infile.read().splitlines())+"]")
+        return sorted(project['key'] for project in listing)
+    except (OSError,ValueError,KeyError,TypeError):
+        return []
+
+
+def terms(configFolder,server,prefix=""):
+    path=os.path.join(configFolder,"cache","search.db")
+    if not os.path.exists(path):
+        return []
+    import sqlite3
+    # range scan of the tokens index: reading documents would take as long as the number of repositories
+    prefix=prefix.lower()
+    db=sqlite3.connect("file:{}?mode=ro".format(path),uri=True)
+    try:
+        rows=db.execute("SELECT DISTINCT token FROM tokens WHERE token >= ? AND token < ? ORDER BY token LIMIT ?",
+            (prefix,prefix+"\uffff",maxTerms)).fetchall()
+    finally:
+        db.close()
+    return [token for token, in rows]
+
+
+sources={'servers':servers,'projects':projects,'terms':terms}
+
+
+def answer(argv,configFolder,out=None):
+    """Print values of kind argv[0] starting with argv[1] (case insensitive), one per line; return exit code
+
+    argv[2], when given, is the server the values belong to"""
+    out=out or sys.stdout
+    kind,prefix,server=(list(argv)+["","",""])[:3]
+    if kind not in sources:
+        return 2
+    try:
+        values=sources[kind](configFolder,server,prefix)
+    except Exception:
+        # a traceback would be printed in the middle of the command line being edited
+        return 1
+    lowered=prefix.lower()
+    for value in values:
+        if value.lower().startswith(lowered):
+            out.write(value+"\n")
+    return 0
+
+
+class _Command:
+    """Subcommand (or top level parser when name is empty) described for script generation"""
+    def __init__(self,name,aliases,help,parser):
+        self.name=name
+        self.aliases=aliases
+        self.help=help or ''
+        self.options=[]
+        self.positional=None
+        import argparse
+        for action in parser._actions:
+            if isinstance(action,argparse._SubParsersAction):
+                continue
+            if action.option_strings:
+                self.options.append(action)
+            elif self.positional is None:
+                self.positional=action
+
+    @property
+    def names(self):
+        return [self.name]+self.aliases
+
+
+def _commands(parser):
+    """Return top level parser and subcommands descriptions"""
+    import argparse
+    commands=[_Command('',[],'',parser)]
+    for action in parser._actions:
+        if not isinstance(action,argparse._SubParsersAction):
+            continue
+        helps={choice.dest:choice.help for choice in action._choices_actions}
+        byParser={}
+        for name,subparser in action.choices.items():
+            if id(subparser) in byParser:
+                byParser[id(subparser)].aliases.append(name)
+            else:
+                byParser[id(subparser)]=_Command(name,[],helps.get(name),subparser)
+                commands.append(byParser[id(subparser)])
+    return commands
+
+
+def _takesValue(action):
+    return action.nargs != 0
+
+
+def _completer(action):
+    return getattr(action,'completer',None)
+
+
+def _bashValues(action,program):
+    """Return bash statements filling COMPREPLY with values of action"""
+    completer=_completer(action)
+    if action.choices:
+        return 'COMPREPLY=($(compgen -W "{}" -- "$cur"))'.format(" ".join(str(choice) for choice in action.choices))
+    if completer == 'files':
+        return 'compopt -o filenames 2>/dev/null; COMPREPLY=($(compgen -f -- "$cur"))'
+    if completer == 'directories':
+        return 'compopt -o filenames 2>/dev/null; COMPREPLY=($(compgen -d -- "$cur"))'
+    if completer:
+        return '_{}_dynamic {}'.format(program,completer)
+    return ':'
+
+
+def bashScript(parser,program):
+    commands=_commands(parser)
+    subcommands=[command for command in commands if command.name]
+    lines=[
+        '# bash completion for {0}, generated by "{0} completion bash"'.format(program),
+        '_{}_dynamic()'.format(program),
+        '{',
+        "    local IFS=$'\\n'",
+        '    COMPREPLY=($("${{COMP_WORDS[0]}}" {} "$1" "$cur" "$server" 2>/dev/null))'.format(command),
+        '}',
+        '',
+        '_{}()'.format(program),
+        '{',
+        '    local cur=${COMP_WORDS[COMP_CWORD]} prev=${COMP_WORDS[COMP_CWORD-1]}',
+        '    local sub="" server="" i',
+        '    for ((i=1; i < COMP_CWORD; i++)); do',
+        '        [[ ${COMP_WORDS[i]} == --server ]] && server=${COMP_WORDS[i+1]}',
+        '        if [[ -z $sub ]]; then',
+        '            case ${COMP_WORDS[i]} in',
+        '                {}) sub=${{COMP_WORDS[i]}} ;;'.format("|".join(name for command in subcommands for name in command.names)),
+        '            esac',
+        '        fi',
+        '    done',
+        '    case "$sub $prev" in',
+    ]
+    for cmd in commands:
+        for action in cmd.options:
+            if not _takesValue(action):
+                continue
+            patterns="|".join('"{} {}"'.format(name,option) for name in cmd.names for option in action.option_strings)
+            lines.append('        {}) {}; return ;;'.format(patterns,_bashValues(action,program)))
+    lines+=[
+        '    esac',
+        '    if [[ $cur == -* ]]; then',
+        '        local opts',
+        '        case $sub in',
+    ]
+    for cmd in commands:
+        lines.append('            {}) opts="{}" ;;'.format("|".join(cmd.names) if cmd.name else '""',
+            " ".join(option for action in cmd.options for option in action.option_strings)))
+    lines+=[
+        '        esac',
+        '        COMPREPLY=($(compgen -W "$opts" -- "$cur"))',
+        '        return',
+        '    fi',
+        '    case $sub in',
+        '        "") COMPREPLY=($(compgen -W "{}" -- "$cur")) ;;'.format(" ".join(command.name for command in subcommands)),
+    ]
+    for cmd in subcommands:
+        if cmd.positional is not None:
+            lines.append('        {}) {} ;;'.format("|".join(cmd.names),_bashValues(cmd.positional,program)))
+    lines+=[
+        '    esac',
+        '}',
+        'complete -F _{0} {0}'.format(program),
+    ]
+    return "\n".join(lines)+"\n"
+
+
+def _zshQuote(text):
+    return "'"+text.replace("'","'\\''")+"'"
+
+
+def _zshDescription(text):
+    return (text or '').replace('\\','\\\\').replace('[','\\[').replace(']','\\]').replace(':','\\:')
+
+
+def _zshValues(action,program):
+    completer=_completer(action)
+    if action.choices:
+        return "({})".format(" ".join(str(choice) for choice in action.choices))
+    if completer == 'files':
+        return "_files"
+    if completer == 'directories':
+        return "_files -/"
+    if completer:
+        return "_{}_dynamic {}".format(program,completer)
+    return " "
+
+
+def _zshSpecs(cmd,program):
+    specs=[]
+    for action in cmd.options:
+        description=_zshDescription(action.help)
+        for option in action.option_strings:
+            spec="{}[{}]".format(option,description)
+            if _takesValue(action):
+                spec+=":{}:{}".format((action.metavar or action.dest).lower(),_zshValues(action,program))
+            specs.append(_zshQuote(spec))
+    if cmd.positional is not None:
+        position="*" if cmd.positional.nargs in ('*','+') else "1"
+        specs.append(_zshQuote("{}:{}:{}".format(position,cmd.positional.dest,_zshValues(cmd.positional,program))))
+    return specs
+
+
+def zshScript(parser,program):
+    commands=_commands(parser)
+    subcommands=[command for command in commands if command.name]
+    lines=[
+        '#compdef {}'.format(program),
+        '# zsh completion for {0}, generated by "{0} completion zsh"'.format(program),
+        '_{}_dynamic() {{'.format(program),
+        '    local server i=${words[(I)--server]}',
+        '    (( i )) && server=${words[i+1]}',
+        '    local -a values',
+        '    values=(${{(f)"$($_{}_program {} $1 "$PREFIX" "$server" 2>/dev/null)"}})'.format(program,command),
+        "    compadd -M 'm:{a-zA-Z}={A-Za-z}' -a values",
+        '}',
+        '',
+        '_{}() {{'.format(program),
+        '    local _{}_program=$words[1]'.format(program),
+        '    local curcontext="$curcontext" state line',
+        '    typeset -A opt_args',
+        '    _arguments -C \\',
+    ]
+    lines+=['        {} \\'.format(spec) for spec in _zshSpecs(commands[0],program)]
+    lines+=[
+        "        '1: :->subcommand' \\",
+        "        '*:: :->args'",
+        '    case $state in',
+        '        subcommand)',
+        '            local -a subcommands',
+        '            subcommands=({})'.format(" ".join(_zshQuote("{}:{}".format(cmd.name,cmd.help)) for cmd in subcommands)),
+        '            _describe -t subcommands subcommand subcommands ;;',
+        '        args)',
+        '            case $line[1] in',
+    ]
+    for cmd in subcommands:
+        lines.append('                {})'.format("|".join(cmd.names)))
+        lines.append('                    _arguments \\')
+        lines+=['                        {} \\'.format(spec) for spec in _zshSpecs(cmd,program)[:-1]]
+        lines.append('                        {} ;;'.format(_zshSpecs(cmd,program)[-1]))
+    lines+=[
+        '            esac ;;',
+        '    esac',
+        '}',
+        '',
+        'if [ "$funcstack[1]" = "_{0}" ]; then _{0} "$@"; else compdef _{0} {0}; fi'.format(program),
+    ]
+    return "\n".join(lines)+"\n"
+
+
+def _fishQuote(text):
+    return "'"+(text or '').replace('\\','\\\\').replace("'","\\'")+"'"
+
+
+def _fishOption(action,program):
+    """Return complete flags describing option action"""
+    flags=[]
+    for option in action.option_strings:
+        flags.append("-l "+option[2:] if option.startswith("--") else "-s "+option[1:])
+    if _takesValue(action):
+        completer=_completer(action)
+        if action.choices:
+            flags.append("-x -a "+_fishQuote(" ".join(str(choice) for choice in action.choices)))
+        elif completer == 'files':
+            flags.append("-r -F")
+        elif completer == 'directories':
+            flags.append("-x -a '(__fish_complete_directories (commandline -ct))'")
+        elif completer:
+            flags.append("-x -a '(__{}_dynamic {})'".format(program,completer))
+        else:
+            flags.append("-x")
+    if action.help:
+        flags.append("-d "+_fishQuote(action.help))
+    return " ".join(flags)
+
+
+def fishScript(parser,program):
+    commands=_commands(parser)
+    lines=[
+        '# fish completion for {0}, generated by "{0} completion fish"'.format(program),
+        'function __{}_dynamic'.format(program),
+        '    set -l tokens (commandline -opc)',
+        '    set -l server',
+        '    if set -l i (contains -i -- --server $tokens)',
+        '        set server $tokens[(math $i + 1)]',
+        '    end',
+        '    $tokens[1] {} $argv[1] (commandline -ct) "$server" 2>/dev/null'.format(command),
+        'end',
+        '',
+        'complete -c {} -f'.format(program),
+    ]
+    for cmd in commands:
+        condition="__fish_seen_subcommand_from {}".format(" ".join(cmd.names)) if cmd.name else "__fish_use_subcommand"
+        prefix="complete -c {} -n {}".format(program,_fishQuote(condition))
+        if cmd.name:
+            lines.append("complete -c {} -n __fish_use_subcommand -a {} -d {}".format(program,cmd.name,_fishQuote(cmd.help)))
+        for action in cmd.options:
+            lines.append("{} {}".format(prefix,_fishOption(action,program)))
+        if cmd.positional is not None:
+            action=cmd.positional
+            if action.choices:
+                values=_fishQuote(" ".join(str(choice) for choice in action.choices))
+            elif _completer(action) == 'directories':
+                values="'(__fish_complete_directories (commandline -ct))'"
+            elif _completer(action) == 'files':
+                values="'(__fish_complete_path (commandline -ct))'"
+            elif _completer(action):
+                values="'(__{}_dynamic {})'".format(program,_completer(action))
+            else:
+                continue
+            lines.append("{} -a {}".format(prefix,values))
+    return "\n".join(lines)+"\n"
+
+
+def script(parser,shell,program="bpc"):
+    """Return completion script of parser for shell"""
+    return {'bash':bashScript,'zsh':zshScript,'fish':fishScript}[shell](parser,program)
@@ -0,0 +1,144 @@
+"""SQLite backed configuration storage
+
+Configuration is stored in a single table, one row per (section, key) with
+json encoded values; the primary key index makes lookups of a repository,
+project or url independent of the number of configured items.
+Every section is exposed as a dict-like object: values are loaded on first
+access, and only changed keys are written back, in a single transaction.
+SQLite file locking makes concurrent bpc processes safe: updates of
+different keys never overwrite each other.
+"""
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+# Sections loaded with a single query when store is opened
+smallSections=['common','servers']
+sections=['common','servers','url-shortcut-map','repositories','projects']
+
+
+class Section(MutableMapping):
+    """Dict-like view of a configuration section"""
+    def __init__(self,store,name):
+        self._store=store
+        self._name=name
+        # key -> [value, json text as stored, or None if not stored]
+        self._loaded={}
+        self._deleted=set()
+        self._complete=False
+
+    def _load(self,key):
+        if key in self._loaded or key in self._deleted or self._complete:
+            return
+        row=self._store._query("SELECT value FROM settings WHERE section=? AND key=?",(self._name,key)).fetchone()
+        if row is not None:
+            self._loaded[key]=[json.loads(row[0]),row[0]]
+
+    def _loadAll(self):
+        if self._complete:
+            return
+        for key,value in self._store._query("SELECT key,value FROM settings WHERE section=?",(self._name,)).fetchall():
+            if key not in self._loaded and key not in self._deleted:
+                self._loaded[key]=[json.loads(value),value]
+        self._complete=True
+
+    def __getitem__(self,key):
+        self._load(key)
+        if key not in self._loaded:
+            raise KeyError(key)
+        return self._loaded[key][0]
+
+    def __setitem__(self,key,value):
+        self._load(key)
+        self._deleted.discard(key)
+        if key in self._loaded:
+            self._loaded[key][0]=value
+        else:
+            self._loaded[key]=[value,None]
+
+    def __delitem__(self,key):
+        self._load(key)
+        if key not in self._loaded:
+            raise KeyError(key)
+        del self._loaded[key]
+        self._deleted.add(key)
+
+    def __contains__(self,key):
+        self._load(key)
+        return key in self._loaded
+
+    def __iter__(self):
+        self._loadAll()
+        return iter(sorted(self._loaded))
+
+    def __len__(self):
+        self._loadAll()
+        return len(self._loaded)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def _changes(self):
+        """Yield (key, json text or None for deleted keys) of changed keys"""
+        for key in self._deleted:
+            yield key,None
+        for key,(value,stored) in self._loaded.items():
+            text=json.dumps(value,sort_keys=True)
+            if text != stored:
+                yield key,text
+
+    def _committed(self):
+        for key,entry in self._loaded.items():
+            entry[1]=json.dumps(entry[0],sort_keys=True)
+        self._deleted.clear()
+
+
+class ConfigStore:
+    """bpc configuration stored in a SQLite database"""
+    def __init__(self,path):
+        self._lock=threading.Lock()
+        # connection is shared with worker threads, access is serialized by _lock
+        self._db=sqlite3.connect(path,timeout=30,isolation_level=None,check_same_thread=False)
+        self._query("CREATE TABLE IF NOT EXISTS settings (section TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (section, key))")
+        self.sections={name:Section(self,name) for name in sections}
+        for name in smallSections:
+            self.sections[name]._loadAll()
+
+    def _query(self,sql,params=()):
+        with self._lock:
+            return self._db.execute(sql,params)
+
+    def isEmpty(self):
+        return self._query("SELECT 1 FROM settings LIMIT 1").fetchone() is None
+
+    def commit(self):
+        """Write changed keys of every section in a single transaction"""
+        changes=[(name,key,text) for name,section in self.sections.items() for key,text in section._changes()]
+        if not changes:
+            return
+        with self._lock:
+            # IMMEDIATE takes the write lock upfront, waiting for other bpc processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for name,key,text in changes:
+                    if text is None:
+                        self._db.execute("DELETE FROM settings WHERE section=? AND key=?",(name,key))
+                    else:
+                        self._db.execute("INSERT OR REPLACE INTO settings (section,key,value) VALUES (?,?,?)",(name,key,text))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        for section in self.sections.values():
+            section._committed()
+
+    def importData(self,data):
+        """Import configuration dictionary, e.g. from legacy json configuration file"""
+        for name in sections:
+            for key,value in data.get(name,{}).items():
+                self.sections[name][key]=value
+
+    def exportData(self):
+        """Return whole configuration as a dictionary"""
+        return {name:dict(section.items()) for name,section in self.sections.items()}
@@ -0,0 +1,297 @@
+"""Background daemon keeping HTTP connections to Bitbucket servers warm
+
+bpc commands send their HTTP requests to the daemon through a Unix socket;
+the daemon forwards them with a keep-alive requests.Session per server and
+credentials, so TLS handshake and authentication (session cookie) are paid
+once instead of on every command. Successful GET responses are kept in memory
+for a short time; any other request invalidates the responses of its server.
+Streamed requests (e.g. pull request diffs) bypass the daemon, and responses
+larger than cacheMaxBodySize are never kept.
+
+Protocol: every message is a json line, optionally followed by the number of
+raw body bytes given in its "length" field.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+defaultIdleTimeout=3600
+defaultCacheTtl=30
+cacheMaxEntries=1000
+cacheMaxBodySize=1024*1024
+# seconds allowed to the server when the request has no timeout, and to the daemon on top of it
+forwardTimeout=60
+daemonTimeoutMargin=5
+# connections kept open for each server
+poolSize=10
+# headers that change the response of a GET request
+cacheKeyHeaders=['Authorization','Accept','If-None-Match','If-Modified-Since']
+# requests decodes body, so the daemon does not forward these headers
+droppedHeaders=['content-encoding','content-length','transfer-encoding','connection']
+# methods sent again directly when the daemon fails after receiving them
+safeMethods=('GET','HEAD')
+
+
+def isSupported():
+    return hasattr(socket,'AF_UNIX')
+
+
+def _send(stream,header,body=b''):
+    header=dict(header,length=len(body))
+    stream.write(json.dumps(header).encode()+b'\n')
+    stream.write(body)
+    stream.flush()
+
+
+def _receive(stream):
+    line=stream.readline()
+    if not line:
+        raise ConnectionError("daemon closed connection")
+    header=json.loads(line)
+    body=stream.read(header.get('length',0))
+    return header,body
+
+
+def _connect(socketPath,timeout=None):
+    client=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        client.connect(socketPath)
+    except BaseException:
+        client.close()
+        raise
+    return client
+
+
+def _exchange(client,header,body=b''):
+    """Send a message on a connected socket and return the answer, closing the socket"""
+    try:
+        stream=client.makefile('rwb')
+        _send(stream,header,body)
+        return _receive(stream)
+    finally:
+        client.close()
+
+
+def _call(socketPath,header,body=b'',timeout=None):
+    return _exchange(_connect(socketPath,timeout),header,body)
+
+
+def command(socketPath,name):
+    """Send a control command (status, stop) to the daemon, return its answer"""
+    header,_=_call(socketPath,{'command':name},timeout=5)
+    return header
+
+
+def isRunning(socketPath):
+    if not isSupported() or not os.path.exists(socketPath):
+        return False
+    try:
+        command(socketPath,'ping')
+        return True
+    except (OSError,ValueError):
+        return False
+
+
+class Daemon:
+    """Forward HTTP requests received on a Unix socket"""
+    def __init__(self,socketPath,idleTimeout=defaultIdleTimeout,cacheTtl=defaultCacheTtl):
+        self.socketPath=socketPath
+        self.idleTimeout=idleTimeout
+        self.cacheTtl=cacheTtl
+        self.adapters={}
+        self.sessions={}
+        self.cache=OrderedDict()
+        self.lock=threading.Lock()
+        self.stats={'started':time.time(),'requests':0,'cache_hits':0}
+        self.lastActivity=time.time()
+        self.server=None
+
+    def _session(self,url,authorization=''):
+        """Return session for url and credentials
+
+        Sessions of the same server share its connection pool, but each
+        credential has its own session cookies"""
+        import requests
+        parts=urlsplit(url)
+        origin=parts.scheme+'://'+parts.netloc
+        key=(origin,hashlib.sha256(authorization.encode()).hexdigest())
+        with self.lock:
+            if origin not in self.adapters:
+                self.adapters[origin]=requests.adapters.HTTPAdapter(pool_maxsize=poolSize)
+            if key not in self.sessions:
+                session=requests.Session()
+                session.mount(origin,self.adapters[origin])
+                self.sessions[key]=session
+            return self.sessions[key]
+
+    def warm(self,urls):
+        """Open connections to servers in background, before first command needs them"""
+        import requests
+        def head(url):
+            try:
+                self._session(url).head(url,timeout=10)
+            except requests.RequestException as e:
+                logging.debug("Cannot reach {}: {}".format(url,e))
+        for url in urls:
+            threading.Thread(target=head,args=(url,),daemon=True).start()
+
+    def _cacheKey(self,request):
+        headers={k.lower():v for k,v in request['headers'].items()}
+        return (request['url'],)+tuple(headers.get(h.lower(),'') for h in cacheKeyHeaders)
+
+    def _invalidate(self,url):
+        origin=urlsplit(url)[:2]
+        with self.lock:
+            for key in [k for k in self.cache if urlsplit(k[0])[:2] == origin]:
+                del self.cache[key]
+
+    def forward(self,request,body):
+        with self.lock:
+            self.stats['requests']+=1
+        method=request['method'].upper()
+        noCache='no-cache' in {k.lower():v for k,v in request['headers'].items()}.get('cache-control','')
+        if 'GET' == method and not noCache:
+            key=self._cacheKey(request)
+            with self.lock:
+                entry=self.cache.get(key)
+                if entry and time.time()-entry[0] < self.cacheTtl:
+                    self.cache.move_to_end(key)
+                    self.stats['cache_hits']+=1
+                    return entry[1],entry[2]
+        elif 'GET' != method and 'HEAD' != method:
+            self._invalidate(request['url'])
+
+        authorization={k.lower():v for k,v in request['headers'].items()}.get('authorization','')
+        session=self._session(request['url'],authorization)
+        response=session.request(method,request['url'],headers=request['headers'],data=body or None,
+            verify=request.get('verify',True),timeout=request.get('timeout') or forwardTimeout,allow_redirects=False)
+        header={'status':response.status_code,'reason':response.reason,
+            'headers':{k:v for k,v in response.headers.items() if k.lower() not in droppedHeaders}}
+        content=response.content
+        if 'GET' == method and 200 == response.status_code and len(content) <= cacheMaxBodySize:
+            with self.lock:
+                self.cache[self._cacheKey(request)]=(time.time(),header,content)
+                while len(self.cache) > cacheMaxEntries:
+                    self.cache.popitem(last=False)
+        return header,content
+
+    def handle(self,stream):
+        self.lastActivity=time.time()
+        request,body=_receive(stream)
+        if 'command' in request:
+            if 'stop' == request['command']:
+                _send(stream,{'stopping':True})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            with self.lock:
+                status=dict(self.stats,servers=len(self.adapters),sessions=len(self.sessions),cached=len(self.cache),pid=os.getpid())
+            _send(stream,status)
+            return
+        try:
+            header,content=self.forward(request,body)
+        except Exception as e:
+            header,content={'error':"{}: {}".format(type(e).__name__,e)},b''
+        _send(stream,header,content)
+
+    def _watchIdle(self):
+        while True:
+            time.sleep(min(60,self.idleTimeout))
+            if time.time()-self.lastActivity > self.idleTimeout:
+                logging.info("Daemon idle for {} seconds, exiting".format(self.idleTimeout))
+                self.server.shutdown()
+                return
+
+    def serve(self):
+        """Serve requests until stopped or idle for idleTimeout seconds"""
+        import socketserver
+        daemon=self
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    daemon.handle(self.request.makefile('rwb'))
+                except (OSError,ValueError) as e:
+                    logging.debug("Daemon client error: {}".format(e))
+
+        if os.path.exists(self.socketPath):
+            # left over by a daemon that did not exit cleanly
+            os.remove(self.socketPath)
+        oldMask=os.umask(0o077)
+        try:
+            self.server=socketserver.ThreadingUnixStreamServer(self.socketPath,Handler)
+        finally:
+            os.umask(oldMask)
+        self.server.daemon_threads=True
+        if self.idleTimeout:
+            threading.Thread(target=self._watchIdle,daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+
+
+def adapter(socketPath,fallback):
+    """Return a requests transport adapter sending requests through the daemon
+
+    fallback adapter is used when daemon cannot be reached, does not answer in
+    time, and for streamed requests: the daemon would read the whole response
+    before sending it"""
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    class DaemonAdapter(requests.adapters.BaseAdapter):
+        def send(self,request,stream=False,timeout=None,verify=True,cert=None,proxies=None):
+            if stream or unavailable:
+                return fallback.send(request,stream=stream,timeout=timeout,verify=verify,cert=cert,proxies=proxies)
+            body=request.body or b''
+            if isinstance(body,str):
+                body=body.encode('utf-8')
+            readTimeout=timeout[1] if isinstance(timeout,tuple) else timeout
+            header={'method':request.method,'url':request.url,'headers':dict(request.headers),'verify':verify,'timeout':readTimeout}
+            try:
+                client=_connect(socketPath,(readTimeout or forwardTimeout)+daemonTimeoutMargin)
+            except OSError as e:
+                logging.debug("Daemon not available ({}), using direct connection".format(e))
+                return fallback.send(request,stream=stream,timeout=timeout,verify=verify,cert=cert,proxies=proxies)
+            # from now on the daemon may have forwarded the request: only safe methods are sent again
+            try:
+                answer,content=_exchange(client,header,body)
+            except socket.timeout:
+                # daemon is stuck: following requests of this process do not wait for it
+                unavailable.append(True)
+                if request.method not in safeMethods:
+                    raise requests.ReadTimeout("daemon did not answer, request may have been sent",request=request)
+                logging.debug("Daemon did not answer, using direct connection")
+                return fallback.send(request,stream=stream,timeout=timeout,verify=verify,cert=cert,proxies=proxies)
+            except (OSError,ValueError) as e:
+                if request.method not in safeMethods:
+                    raise requests.ConnectionError("daemon connection failed ({}), request may have been sent".format(e),request=request)
+                logging.debug("Daemon connection failed ({}), using direct connection".format(e))
+                return fallback.send(request,stream=stream,timeout=timeout,verify=verify,cert=cert,proxies=proxies)
+            if 'error' in answer:
+                raise requests.ConnectionError(answer['error'],request=request)
+            response=requests.Response()
+            response.status_code=answer['status']
+            response.reason=answer['reason']
+            response.headers=CaseInsensitiveDict(answer['headers'])
+            response.encoding=get_encoding_from_headers(response.headers)
+            response._content=content
+            response.url=request.url
+            response.request=request
+            response.connection=self
+            return response
+
+        def close(self):
+            fallback.close()
+
+    unavailable=[]
+    return DaemonAdapter()
@@ -0,0 +1,70 @@
+"""Content addressed cache of pull request changes and diffs
+
+Changes and diff of a pull request only depend on the commits its source
+and target branches point to: entries are keyed on the (fromRef commit,
+toRef commit) pair and never expire, a pull request updated with new commits
+simply gets new entries. Files are read and written as streams, so diffs of
+any size go straight from the server (or disk) to the pager.
+Least recently used entries are evicted when the cache grows over maxSize.
+"""
+import hashlib
+import logging
+import os
+
+
+class DiffCache:
+    def __init__(self,folder,maxSize):
+        self.folder=folder
+        self.maxSize=maxSize
+
+    def _path(self,fromCommit,toCommit,kind):
+        key=hashlib.sha256("{}..{}".format(fromCommit,toCommit).encode()).hexdigest()
+        return os.path.join(self.folder,"{}.{}".format(key,kind))
+
+    def open(self,fromCommit,toCommit,kind):
+        """Return cached entry as a binary file, or None"""
+        path=self._path(fromCommit,toCommit,kind)
+        try:
+            infile=open(path,'rb')
+        except OSError:
+            return None
+        # mtime tracks last access for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return infile
+
+    def store(self,fromCommit,toCommit,kind,chunks):
+        """Yield chunks (bytes) while writing them to cache; entry is stored only when chunks are completely consumed"""
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        path=self._path(fromCommit,toCommit,kind)
+        tmpPath=path+".{}.tmp".format(os.getpid())
+        try:
+            with open(tmpPath,'wb') as outfile:
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    yield chunk
+            os.replace(tmpPath,path)
+            self.evict()
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def evict(self):
+        """Remove least recently used entries until cache size is below maxSize"""
+        try:
+            entries=[(e.stat().st_mtime,e.stat().st_size,e.path) for e in os.scandir(self.folder) if not e.name.endswith(".tmp")]
+        except OSError:
+            return
+        total=sum(size for _,size,_ in entries)
+        for _,size,path in sorted(entries):
+            if total <= self.maxSize:
+                break
+            logging.debug("Evicting diff cache entry {}".format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total-=size
@@ -0,0 +1,66 @@
+"""Uncommitted changes detection
+
+Available strategies:
+    * quick (default): "git diff --quiet HEAD", a single git process that
+      refreshes index stat information in memory and stops at the first
+      modified file
+    * status: "git status --porcelain --untracked-files=no"; git computes the
+      whole status before printing anything, so it cannot stop early
+    * gitpython: GitPython index diff against working tree and HEAD (slowest,
+      builds the complete list of changes)
+Untracked files are never considered. git itself uses fsmonitor and
+untracked cache when they are enabled in repository configuration
+(core.fsmonitor, core.untrackedCache), so they speed up quick and status
+strategies as well.
+"""
+import logging
+import subprocess
+
+strategies=['quick','status','gitpython']
+
+
+def _git(location,args,**kw):
+    return subprocess.Popen(["git"]+args,cwd=location.worktree,stdout=subprocess.PIPE,stderr=subprocess.PIPE,**kw)
+
+
+def _quick(location):
+    diff=_git(location,["diff","--quiet","--no-ext-diff","HEAD","--"])
+    _,err=diff.communicate()
+    if diff.returncode not in [0,1]:
+        raise RuntimeError("git diff failed: {}".format(err.decode(errors="replace").strip()))
+    return 1 == diff.returncode
+
+
+def _status(location):
+    status=_git(location,["status","--porcelain","--untracked-files=no"])
+    out,err=status.communicate()
+    if status.returncode:
+        raise RuntimeError("git status failed: {}".format(err.decode(errors="replace").strip()))
+    return bool(out)
+
+
+def _gitpython(location,repo):
+    if repo is None:
+        from git import Repo
+        repo=Repo(location.worktree)
+    return bool(list(repo.index.diff(None) or repo.index.diff(repo.head.commit)))
+
+
+def isDirty(location,strategy='quick',repo=None):
+    """Check whether working area of repository contains uncommitted changes
+
+    location is a gitinfo.RepositoryLocation, repo an optional already opened
+    GitPython repository, used by gitpython strategy"""
+    logging.debug("Checking uncommitted changes using '{}' strategy".format(strategy))
+    if 'gitpython' == strategy:
+        return _gitpython(location,repo)
+    if 'status' == strategy:
+        return _status(location)
+    if 'quick' == strategy:
+        try:
+            return _quick(location)
+        except RuntimeError as e:
+            # e.g. no commit yet: HEAD cannot be resolved
+            logging.debug("{}, falling back to status".format(e))
+            return _status(location)
+    raise ValueError("Unknown dirty check strategy '{}'".format(strategy))
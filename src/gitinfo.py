@@ -0,0 +1,245 @@
+"""Lightweight git repository discovery
+
+Repository layout, remotes and current branch are read directly from the
+files in the git folder: no subprocess is spawned and GitPython is not
+loaded. Supported layouts:
+    * plain repositories (.git folder)
+    * worktrees and submodules (.git file containing "gitdir: <path>")
+    * GIT_DIR/GIT_WORK_TREE environment variables
+Repositories contained in a folder can be discovered too (findRepositories).
+"""
+import os
+import re
+import json
+import urllib.parse
+
+
+def nonInteractiveEnv():
+    """Return environment variables preventing git from prompting for credentials or ssh host keys"""
+    env={'GIT_TERMINAL_PROMPT':'0'}
+    if not os.environ.get('GIT_SSH'):
+        env['GIT_SSH_COMMAND']=os.environ.get('GIT_SSH_COMMAND','ssh')+' -o BatchMode=yes'
+    return env
+
+
+class RepositoryError(Exception):
+    """Repository cannot be used with a Bitbucket server"""
+
+
+class RepositoryLocation:
+    """Folders of a git repository"""
+    def __init__(self,worktree,gitdir):
+        self.worktree=worktree
+        self.gitdir=gitdir
+        # worktrees share config and refs with main repository
+        self.commondir=gitdir
+        commondirFile=os.path.join(gitdir,"commondir")
+        if os.path.isfile(commondirFile):
+            with open(commondirFile) as infile:
+                self.commondir=os.path.normpath(os.path.join(gitdir,infile.read().strip()))
+        self.configPath=os.path.join(self.commondir,"config")
+
+
+def _readGitFile(dotgit):
+    """Return git folder referenced by a .git file, or None"""
+    try:
+        with open(dotgit) as infile:
+            content=infile.read().strip()
+    except OSError:
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(dotgit),content[len("gitdir:"):].strip()))
+
+
+def findRepository(folder):
+    """Return RepositoryLocation of repository containing folder, or None"""
+    if os.environ.get("GIT_DIR"):
+        gitdir=os.path.abspath(os.environ["GIT_DIR"])
+        worktree=os.path.abspath(os.environ.get("GIT_WORK_TREE",folder))
+        if not os.path.isdir(gitdir):
+            return None
+        return RepositoryLocation(worktree,gitdir)
+
+    current=os.path.abspath(folder)
+    while True:
+        dotgit=os.path.join(current,".git")
+        if os.path.isdir(dotgit):
+            return RepositoryLocation(current,dotgit)
+        if os.path.isfile(dotgit):
+            gitdir=_readGitFile(dotgit)
+            if gitdir and os.path.isdir(gitdir):
+                return RepositoryLocation(current,gitdir)
+
+        parent=os.path.dirname(current)
+        if parent == current:
+            return None
+        current=parent
+
+
+def findRepositories(folder,maxDepth=2):
+    """Return RepositoryLocation of repositories found in folder: folder itself, or its subfolders up to maxDepth levels
+
+    Subfolders of a repository and hidden folders are not searched"""
+    dotgit=os.path.join(folder,".git")
+    if os.path.isdir(dotgit):
+        return [RepositoryLocation(os.path.abspath(folder),os.path.abspath(dotgit))]
+    if os.path.isfile(dotgit):
+        gitdir=_readGitFile(dotgit)
+        return [RepositoryLocation(os.path.abspath(folder),gitdir)] if gitdir and os.path.isdir(gitdir) else []
+    if maxDepth <= 0:
+        return []
+    locations=[]
+    try:
+        entries=sorted(entry.name for entry in os.scandir(folder) if entry.is_dir() and not entry.name.startswith("."))
+    except OSError:
+        return []
+    for name in entries:
+        locations+=findRepositories(os.path.join(folder,name),maxDepth-1)
+    return locations
+
+
+sectionRe=re.compile(r'^\s*\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+urlRe=re.compile(r'^\s*url\s*=\s*(.*?)\s*$',re.IGNORECASE)
+
+def readRemotes(configPath):
+    """Return list of (name, url) of remotes defined in git config file, in file order"""
+    remotes=[]
+    remote=None
+    with open(configPath) as infile:
+        for line in infile:
+            m=sectionRe.match(line)
+            if m:
+                section,subsection=m.group(1).lower(),m.group(2)
+                # old style [remote.name] sections
+                if subsection is None and section.startswith("remote."):
+                    section,subsection="remote",section[len("remote."):]
+                remote=subsection if "remote" == section else None
+                continue
+            if remote is not None:
+                m=urlRe.match(line)
+                if m and remote not in [r[0] for r in remotes]:
+                    url=m.group(1)
+                    if len(url) > 1 and url[0] == url[-1] == '"':
+                        url=url[1:-1]
+                    remotes.append((remote,url))
+    return remotes
+
+
+def currentBranch(location):
+    """Return name of checked out branch, or None when HEAD is detached"""
+    with open(os.path.join(location.gitdir,"HEAD")) as infile:
+        head=infile.read().strip()
+    if head.startswith("ref: refs/heads/"):
+        return head[len("ref: refs/heads/"):]
+    return None
+
+
+def remoteBranches(location,remote):
+    """Return sorted names of remote-tracking branches of remote, read from loose and packed refs"""
+    prefix="refs/remotes/{}/".format(remote)
+    names=set()
+    try:
+        with open(os.path.join(location.commondir,"packed-refs")) as infile:
+            for line in infile:
+                parts=line.split()
+                if len(parts) == 2 and parts[1].startswith(prefix):
+                    names.add(parts[1][len(prefix):])
+    except OSError:
+        pass
+    folder=os.path.join(location.commondir,*prefix.split("/"))
+    for root,_,files in os.walk(folder):
+        for name in files:
+            names.add(os.path.relpath(os.path.join(root,name),folder).replace(os.path.sep,"/"))
+    names.discard("HEAD")
+    return sorted(names)
+
+
+def parseBitbucketUrl(url):
+    """Split Bitbucket server git url in its parts
+
+    Bitbucket server URL are like:
+          https://www.example.com:PORT/scm/PROJECT_KEY/REPO_NAME
+          https://www.example.com:PORT/scm/PROJECT_KEY/REPO_NAME.git
+    But it can be deployed to different path:
+          https://www.example.com:PORT/subpath/scm/PROJECT_KEY/REPO_NAME.git
+    Returns dictionary with project, name, basepath and baseurl, or None if
+    url does not contain 'scm' path item."""
+    o=urllib.parse.urlparse(url.lower())
+
+    it=iter(o.path.split("/"))
+    # get rid of first empty token
+    next(it)
+    basepath=""
+    try:
+        token=next(it)
+        # Search for 'scm' in the URL
+        while "scm" != token:
+            basepath=basepath + "/" + token
+            token=next(it)
+        repositoryProject=next(it)
+        repositoryName=next(it).replace(".git","")
+    except StopIteration:
+        return None
+
+    baseurl=urllib.parse.urlunsplit([o.scheme,o.netloc,basepath,"",""])
+    return {"project":repositoryProject,"name":repositoryName,"basepath":basepath.replace("/",""),"baseurl":baseurl}
+
+
+def getRemoteInfo(location,memoPath):
+    """Return url of first remote and its Bitbucket parts (see parseBitbucketUrl)
+
+    Result is memoized in memoPath json file, keyed on git config path and
+    invalidated when config file modification time or size changes."""
+    stat=os.stat(location.configPath)
+    stamp=[stat.st_mtime_ns,stat.st_size]
+
+    memo={}
+    try:
+        with open(memoPath) as infile:
+            memo=json.load(infile)
+    except (OSError,ValueError):
+        pass
+
+    entry=memo.get(location.configPath)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry
+
+    remotes=readRemotes(location.configPath)
+    if not remotes:
+        # remotes defined through config includes: let GitPython resolve them
+        from git import Repo
+        remotes=[(r.name,r.url) for r in Repo(location.worktree).remotes]
+    if not remotes:
+        return None
+
+    url=remotes[0][1]
+    entry={"stamp":stamp,"url":url,"bitbucket":parseBitbucketUrl(url)}
+    memo[location.configPath]=entry
+    try:
+        folder=os.path.dirname(memoPath)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmpPath=memoPath+".{}.tmp".format(os.getpid())
+        with open(tmpPath,"w") as outfile:
+            json.dump(memo,outfile)
+        os.replace(tmpPath,memoPath)
+    except OSError:
+        pass
+    return entry
+
+
+def bitbucketInfo(location,memoPath):
+    """Return (remote info, current branch) of a located repository, see getRemoteInfo
+
+    Raise RepositoryError when repository has no remote, its remote is not a
+    Bitbucket one or HEAD is detached"""
+    remoteInfo=getRemoteInfo(location,memoPath)
+    if remoteInfo is None:
+        raise RepositoryError("Repository in {} has no remote".format(location.worktree))
+    if remoteInfo['bitbucket'] is None:
+        raise RepositoryError("This repository seems not to be hosted in Bibucket Server: I cannot find 'scm' string on the URL '{}'".format(remoteInfo['url']))
+    branch=currentBranch(location)
+    if branch is None:
+        raise RepositoryError("HEAD is detached, please checkout a branch")
+    return remoteInfo,branch
@@ -0,0 +1,89 @@
+"""Fetch of many local repositories, skipping the ones whose remote did not change
+
+Before fetching, branches and tags advertised by the remote (git ls-remote,
+a single round trip with no object negotiation) are hashed and compared to
+the hash stored after the previous successful fetch of the same repository
+and remote url: when they are equal there is nothing to download.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+import gitinfo
+
+FETCHED='fetched'
+UNCHANGED='up to date'
+
+
+def _git(location,args,timeout=None):
+    # credentials must come from git credential helpers or ssh agent: a prompt would block a worker forever
+    env=dict(os.environ,**gitinfo.nonInteractiveEnv())
+    res=subprocess.run(["git"]+args,cwd=location.worktree,stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+        universal_newlines=True,env=env,timeout=timeout)
+    if res.returncode:
+        lines=res.stderr.strip().splitlines()
+        errors=[line for line in lines if line.startswith("fatal:")]
+        raise RuntimeError((errors or lines or ["git {} failed with code {}".format(args[0],res.returncode)])[0])
+    return res.stdout
+
+
+def advertisedRefsDigest(location,remote,timeout=None):
+    """Return hash of branches and tags of remote, as advertised by the server"""
+    refs=_git(location,["ls-remote","--heads","--tags",remote],timeout)
+    return hashlib.sha256("\n".join(sorted(refs.splitlines())).encode()).hexdigest()
+
+
+class SyncState:
+    """Advertised refs hash of last successful fetch of every repository, stored in a json file"""
+    def __init__(self,path):
+        self.path=path
+        self.lock=threading.Lock()
+        self.entries={}
+        self.changed=False
+        try:
+            with open(path) as infile:
+                self.entries=json.load(infile)
+        except (OSError,ValueError):
+            pass
+
+    @staticmethod
+    def key(location,remote,url):
+        # worktrees of the same repository share remote refs
+        return "{}\n{}\n{}".format(location.commondir,remote,url)
+
+    def get(self,key):
+        with self.lock:
+            entry=self.entries.get(key)
+            return entry['refs'] if entry else None
+
+    def put(self,key,refs):
+        with self.lock:
+            self.entries[key]={'refs':refs,'fetched':time.time()}
+            self.changed=True
+
+    def save(self):
+        """Write state file, dropping repositories that no longer exist"""
+        with self.lock:
+            if not self.changed:
+                return
+            self.entries={key:entry for key,entry in self.entries.items() if os.path.isdir(key.split("\n")[0])}
+            temp=self.path+".{}.tmp".format(os.getpid())
+            with open(temp,'w') as outfile:
+                json.dump(self.entries,outfile)
+            os.replace(temp,self.path)
+            self.changed=False
+
+
+def syncRepository(location,remote,url,state,force=False,prune=False,timeout=None):
+    """Fetch remote of repository unless its advertised refs did not change since last sync; return FETCHED or UNCHANGED"""
+    key=SyncState.key(location,remote,url)
+    refs=advertisedRefsDigest(location,remote,timeout)
+    if not force and refs == state.get(key):
+        return UNCHANGED
+    _git(location,["fetch","--quiet"]+(["--prune"] if prune else [])+[remote],timeout)
+    # refs read before fetching: when they changed meanwhile, next sync just fetches again
+    state.put(key,refs)
+    return FETCHED
@@ -0,0 +1,128 @@
+"""Rendering of listings on standard output, separate from logging
+
+Records (projects, repositories, pull requests as returned by the server)
+are written as they arrive in one of the formats:
+* text: human readable lines, as produced by a formatter function
+* json: a single array of records
+* ndjson: one json record per line
+* tsv: tab separated values, with a header line
+fields, dotted paths such as "project.key", selects the attributes written:
+json and ndjson write whole records when no field is selected, tsv uses
+default fields.
+Lines are buffered and written in chunks, at most flushInterval seconds
+after the record arrived, so that big listings are not slowed down by a
+write for every line while slow ones are still shown progressively.
+"""
+import json
+import os
+import sys
+import time
+
+formats=['text','json','ndjson','tsv']
+
+
+def parseFields(text):
+    """Return list of fields of a comma separated string, None when empty"""
+    fields=[field.strip() for field in (text or '').split(',') if field.strip()]
+    return fields or None
+
+
+def fieldValue(record,field):
+    """Return value of a dotted path in record, None when missing"""
+    value=record
+    for name in field.split('.'):
+        if not isinstance(value,dict):
+            return None
+        value=value.get(name)
+    return value
+
+
+def _tsvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value,bool):
+        value=str(value).lower()
+    elif isinstance(value,(dict,list)):
+        value=json.dumps(value)
+    return str(value).replace('\\','\\\\').replace('\t','\\t').replace('\n','\\n').replace('\r','\\r')
+
+
+class Renderer:
+    """Buffered writer of records in a given format"""
+    def __init__(self,format,textFormatter,fields=None,defaultFields=None,out=None,flushInterval=0.2,bufferSize=65536):
+        if format not in formats:
+            raise ValueError("Unknown output format {}".format(format))
+        self.format=format
+        self.textFormatter=textFormatter
+        self.fields=fields
+        self.tsvFields=fields or defaultFields
+        self.out=out or sys.stdout
+        self.flushInterval=flushInterval
+        self.bufferSize=bufferSize
+        self.count=0
+        self._buffer=[]
+        self._size=0
+        self._lastFlush=time.monotonic()
+        self._broken=False
+        if 'json' == format:
+            self._append('[')
+        elif 'tsv' == format:
+            self._append('\t'.join(self.tsvFields)+'\n')
+
+    def _append(self,text):
+        self._buffer.append(text)
+        self._size+=len(text)
+        if self._size >= self.bufferSize or time.monotonic()-self._lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer and not self._broken:
+            try:
+                self.out.write(''.join(self._buffer))
+                self.out.flush()
+            except BrokenPipeError:
+                # reader went away (e.g. output piped to head): next records are dropped
+                self._broken=True
+        self._buffer=[]
+        self._size=0
+        self._lastFlush=time.monotonic()
+
+    def heading(self,text):
+        """Write a line giving context to next records, in text format only"""
+        if 'text' == self.format:
+            self._append(text+'\n')
+
+    def _project(self,record):
+        if not self.fields:
+            return record
+        return {field:fieldValue(record,field) for field in self.fields}
+
+    def write(self,record):
+        if 'text' == self.format:
+            if self.fields:
+                text='\t'+'\t'.join(_tsvValue(fieldValue(record,field)) for field in self.fields)
+            else:
+                text=self.textFormatter(record)
+        elif 'tsv' == self.format:
+            text='\t'.join(_tsvValue(fieldValue(record,field)) for field in self.tsvFields)
+        elif 'ndjson' == self.format:
+            text=json.dumps(self._project(record))
+        else:
+            text=('\n' if self.count == 0 else ',\n')+json.dumps(self._project(record))
+        self._append(text if 'json' == self.format else text+'\n')
+        self.count+=1
+
+    def close(self):
+        if 'json' == self.format:
+            self._append('\n]\n' if self.count else ']\n')
+        self.flush()
+        if self._broken:
+            # avoid another broken pipe error when interpreter flushes stdout at exit
+            sys.stdout=open(os.devnull,'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+        return False
@@ -0,0 +1,102 @@
+"""Streaming access to paged Bitbucket REST resources"""
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PagedListing:
+    """Iterates items of a paged REST resource
+
+    While items of a page are consumed, next page is already fetched in
+    background; at most two pages are kept in memory, whatever the size of
+    the whole listing.
+    First request can be made conditional using validators (etag and
+    last-modified values) of a previous response: call open() and check
+    notModified before iterating.
+    Set prefetch to False when the listing is usually not read up to the
+    end, so that no page is requested in vain.
+    """
+    def __init__(self,client,url,params=None,pageSize=None,limit=None,validators=None,prefetch=True):
+        self.client=client
+        self.url=url
+        self.params=params or {}
+        self.pageSize=pageSize
+        self.limit=limit
+        self.prefetch=prefetch
+        self.requestValidators=validators or {}
+        self.validators={}
+        self.notModified=False
+        # True when the listing has been consumed up to the last page
+        self.complete=False
+        self._firstPage=None
+
+    def _get(self,start,fetched,headers=None):
+        from stashy.errors import maybe_throw
+
+        params=dict(self.params)
+        if start is not None:
+            params['start']=start
+        size=self.pageSize
+        if self.limit is not None:
+            remaining=self.limit-fetched
+            size=min(size or remaining,remaining)
+        if size:
+            params['limit']=size
+
+        response=self.client.get(self.url,params=params,headers=headers or {})
+        if 304 == response.status_code and headers:
+            return response,None
+        maybe_throw(response)
+        return response,response.json()
+
+    def open(self):
+        """Perform first request, return self"""
+        if self._firstPage is not None or self.notModified:
+            return self
+
+        headers={}
+        if 'etag' in self.requestValidators:
+            headers['If-None-Match']=self.requestValidators['etag']
+        if 'last-modified' in self.requestValidators:
+            headers['If-Modified-Since']=self.requestValidators['last-modified']
+
+        response,data=self._get(None,0,headers)
+        if data is None:
+            self.notModified=True
+            return self
+
+        for header in ['etag','last-modified']:
+            if header in response.headers:
+                self.validators[header]=response.headers[header]
+        self._firstPage=data
+        return self
+
+    def __iter__(self):
+        self.open()
+        if self.notModified:
+            return
+
+        data=self._firstPage
+        self._firstPage=None
+        yielded=0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                values=data.get('values',[])
+                if self.limit is not None:
+                    values=values[:self.limit-yielded]
+                last=data.get('isLastPage',True)
+
+                nextStart=None
+                nextPage=None
+                fetched=yielded+len(values)
+                if not last and (self.limit is None or fetched < self.limit):
+                    nextStart=data['nextPageStart']
+                    if self.prefetch:
+                        nextPage=executor.submit(self._get,nextStart,fetched)
+
+                for item in values:
+                    yield item
+                    yielded+=1
+
+                if nextStart is None:
+                    self.complete=last
+                    return
+                data=(nextPage.result() if nextPage else self._get(nextStart,fetched))[1]
@@ -0,0 +1,161 @@
+"""Local index of pull requests, synchronized incrementally
+
+Pull requests of every repository are stored in a SQLite database, together
+with the highest updatedDate seen (watermark). Bitbucket lists pull requests
+of a repository most recently updated first (order=NEWEST), so a sync only
+reads pages until it finds a pull request not updated since the watermark.
+Validators (etag, last-modified) of the first page are stored with the
+watermark and sent with the first request of next sync: when nothing changed,
+a single request per repository is made, answered with 304 Not Modified.
+Pull requests deleted on server are only removed by a full sync.
+"""
+import json
+import sqlite3
+import threading
+
+schema=[
+    """CREATE TABLE IF NOT EXISTS pullrequests (server TEXT NOT NULL, project TEXT NOT NULL, repo TEXT NOT NULL, id INTEGER NOT NULL,
+        state TEXT, author TEXT, target TEXT, updated INTEGER, data TEXT NOT NULL, PRIMARY KEY (server, project, repo, id))""",
+    "CREATE INDEX IF NOT EXISTS pullrequests_state ON pullrequests (server, state, author)",
+    "CREATE INDEX IF NOT EXISTS pullrequests_target ON pullrequests (server, target)",
+    """CREATE TABLE IF NOT EXISTS reviewers (server TEXT NOT NULL, project TEXT NOT NULL, repo TEXT NOT NULL, id INTEGER NOT NULL,
+        reviewer TEXT NOT NULL, PRIMARY KEY (server, project, repo, id, reviewer))""",
+    "CREATE INDEX IF NOT EXISTS reviewers_reviewer ON reviewers (server, reviewer)",
+    """CREATE TABLE IF NOT EXISTS syncstate (server TEXT NOT NULL, project TEXT NOT NULL, repo TEXT NOT NULL,
+        watermark INTEGER, validators TEXT, PRIMARY KEY (server, project, repo))""",
+]
+
+
+def _userName(participant):
+    return participant.get('user',{}).get('name','').lower()
+
+
+class PullRequestIndex:
+    """SQLite index of pull requests of many servers and repositories"""
+    def __init__(self,path):
+        self._lock=threading.Lock()
+        # connection is shared with sync worker threads, access is serialized by _lock
+        self._db=sqlite3.connect(path,timeout=30,isolation_level=None,check_same_thread=False)
+        with self._lock:
+            # index can be rebuilt from server: durability of last transactions is not worth a sync to disk every time
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            for statement in schema:
+                self._db.execute(statement)
+            # indexes created before validators were stored
+            if 'validators' not in [row[1] for row in self._db.execute("PRAGMA table_info(syncstate)")]:
+                self._db.execute("ALTER TABLE syncstate ADD COLUMN validators TEXT")
+
+    def watermark(self,server,project,repo):
+        """Return updatedDate of most recently updated pull request, None if repository was never synchronized"""
+        with self._lock:
+            row=self._db.execute("SELECT watermark FROM syncstate WHERE server=? AND project=? AND repo=?",(server,project,repo)).fetchone()
+        return row[0] if row else None
+
+    def validators(self,server,project,repo):
+        """Return validators of first page of last sync, {} when unknown"""
+        with self._lock:
+            row=self._db.execute("SELECT validators FROM syncstate WHERE server=? AND project=? AND repo=?",(server,project,repo)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def storedVersions(self,server,project,repo,ids):
+        """Return {id: updatedDate} of stored pull requests among ids"""
+        ids=list(ids)
+        if not ids:
+            return {}
+        with self._lock:
+            return dict(self._db.execute("SELECT id,updated FROM pullrequests WHERE server=? AND project=? AND repo=? AND id IN ({})".format(",".join("?"*len(ids))),
+                [server,project,repo]+ids).fetchall())
+
+    def repositories(self):
+        """Return list of (server, project, repo, watermark) of synchronized repositories"""
+        with self._lock:
+            return self._db.execute("SELECT server,project,repo,watermark FROM syncstate ORDER BY server,project,repo").fetchall()
+
+    def update(self,server,project,repo,pullRequests,full=False,validators=None):
+        """Store changed pull requests and first page validators in a single transaction; full replaces all pull requests of repository"""
+        key=(server,project,repo)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row=self._db.execute("SELECT watermark FROM syncstate WHERE server=? AND project=? AND repo=?",key).fetchone()
+                watermark=row[0] if row and not full else 0
+                if full:
+                    self._db.execute("DELETE FROM pullrequests WHERE server=? AND project=? AND repo=?",key)
+                    self._db.execute("DELETE FROM reviewers WHERE server=? AND project=? AND repo=?",key)
+                for pr in pullRequests:
+                    self._db.execute("INSERT OR REPLACE INTO pullrequests (server,project,repo,id,state,author,target,updated,data) VALUES (?,?,?,?,?,?,?,?,?)",
+                        key+(pr['id'],pr.get('state'),_userName(pr.get('author',{})),pr.get('toRef',{}).get('displayId'),pr.get('updatedDate',0),json.dumps(pr)))
+                    self._db.execute("DELETE FROM reviewers WHERE server=? AND project=? AND repo=? AND id=?",key+(pr['id'],))
+                    self._db.executemany("INSERT OR IGNORE INTO reviewers (server,project,repo,id,reviewer) VALUES (?,?,?,?,?)",
+                        [key+(pr['id'],_userName(reviewer)) for reviewer in pr.get('reviewers',[])])
+                    watermark=max(watermark or 0,pr.get('updatedDate',0))
+                self._db.execute("INSERT OR REPLACE INTO syncstate (server,project,repo,watermark,validators) VALUES (?,?,?,?,?)",
+                    key+(watermark,json.dumps(validators) if validators else None))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get(self,server,project,repo,id):
+        """Return stored pull request, or None"""
+        with self._lock:
+            row=self._db.execute("SELECT data FROM pullrequests WHERE server=? AND project=? AND repo=? AND id=?",(server,project,repo,id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self,server,project=None,repo=None,state='OPEN',author=None,reviewer=None,target=None,limit=None):
+        """Return list of (project, repo, pull request) matching filters, most recently updated first within each repository"""
+        sql="SELECT project,repo,data FROM pullrequests p WHERE server=?"
+        params=[server]
+        if project is not None:
+            sql+=" AND project=? AND repo=?"
+            params+=[project,repo]
+        if state and 'ALL' != state:
+            sql+=" AND state=?"
+            params.append(state)
+        if author:
+            sql+=" AND author=?"
+            params.append(author.lower())
+        if target:
+            sql+=" AND target=?"
+            params.append(target)
+        if reviewer:
+            sql+=" AND EXISTS (SELECT 1 FROM reviewers r WHERE r.server=p.server AND r.project=p.project AND r.repo=p.repo AND r.id=p.id AND r.reviewer=?)"
+            params.append(reviewer.lower())
+        sql+=" ORDER BY project,repo,updated DESC"
+        if limit is not None:
+            sql+=" LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows=self._db.execute(sql,params).fetchall()
+        return [(project,repo,json.loads(data)) for project,repo,data in rows]
+
+
+def sync(index,server,project,repo,fetch,full=False):
+    """Synchronize pull requests of a repository, return number of pull requests changed since last sync
+
+    fetch(prefetch,validators) must return a listing of pull requests of all
+    states, most recently updated first, empty when validators of its first
+    page match; its validators attribute holds the ones of the first page
+    received. prefetch tells whether next pages are worth fetching in
+    background, i.e. when the whole listing is read"""
+    watermark=None if full else index.watermark(server,project,repo)
+    validators=index.validators(server,project,repo) if watermark is not None else {}
+    listing=fetch(watermark is None,validators)
+    changed=[]
+    for pr in listing:
+        if watermark is not None and pr.get('updatedDate',0) < watermark:
+            break
+        changed.append(pr)
+    # validators of a not modified first page are the ones sent
+    received=listing.validators or validators
+    if watermark is not None:
+        # pull requests updated exactly at watermark time are read again: skip the ones already stored
+        stored=index.storedVersions(server,project,repo,[pr['id'] for pr in changed])
+        changed=[pr for pr in changed if stored.get(pr['id']) != pr.get('updatedDate',0)]
+        if not changed:
+            if received != validators:
+                index.update(server,project,repo,[],validators=received)
+            return 0
+    index.update(server,project,repo,changed,full=watermark is None,validators=received)
+    return len(changed)
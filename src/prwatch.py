@@ -0,0 +1,189 @@
+"""Watch of pull requests: adaptive polling, reporting state transitions only
+
+Every poll synchronizes the local pull requests index incrementally (see
+prindex.sync), its first page being a conditional request: when nothing
+changed the server answers 304 Not Modified, or a single small page.
+Pull requests are compared with their previous snapshot (state, reviewers
+statuses, source commit) and only differences are reported.
+Build statuses do not change pull requests: they are polled for the source
+commit of open pull requests until every build finished, conditionally as
+well; a commit with no build is polled until buildWait seconds after the
+pull request update that brought it.
+The poll interval starts at minimum, is multiplied by factor after every
+poll that found no change, up to maximum, and goes back to minimum as soon
+as something changes.
+"""
+import random
+import time
+
+finalBuildStates=('SUCCESSFUL','FAILED')
+closedStates=('MERGED','DECLINED')
+
+
+class PollInterval:
+    def __init__(self,minimum,maximum,factor=1.5,jitter=0.1):
+        self.minimum=minimum
+        self.maximum=max(minimum,maximum)
+        self.factor=factor
+        self.jitter=jitter
+        self.current=minimum
+
+    def next(self,changed):
+        """Return seconds to wait before next poll"""
+        self.current=self.minimum if changed else min(self.maximum,self.current*self.factor)
+        # many watchers started together must not poll the server at the same time
+        return self.current*random.uniform(1-self.jitter,1+self.jitter)
+
+
+def _reviewStatus(participant):
+    return participant.get('status') or ('APPROVED' if participant.get('approved') else 'UNAPPROVED')
+
+
+def snapshot(pr):
+    """Return watched attributes of a pull request"""
+    return {'state':pr.get('state'),'title':pr.get('title',''),'commit':pr.get('fromRef',{}).get('latestCommit'),'updated':pr.get('updatedDate',0),
+        'reviewers':{reviewer.get('user',{}).get('name',''):_reviewStatus(reviewer) for reviewer in pr.get('reviewers',[])}}
+
+
+def summary(state,builds=None):
+    """Return one line description of a pull request snapshot"""
+    reviewers=state['reviewers']
+    text="{}, {}/{} approvals".format(state['state'],sum(1 for status in reviewers.values() if 'APPROVED' == status),len(reviewers))
+    needsWork=sorted(name for name,status in reviewers.items() if 'NEEDS_WORK' == status)
+    if needsWork:
+        text+=", needs work from {}".format(", ".join(needsWork))
+    if builds:
+        text+=", builds: {}".format(", ".join("{} {}".format(name,buildState.lower()) for _,(buildState,name) in sorted(builds.items())))
+    return text
+
+
+def transitions(old,new):
+    """Return descriptions of changes between two snapshots of a pull request, old being None for a new one"""
+    if old is None:
+        return ["new pull request ({})".format(summary(new))]
+    events=[]
+    if old['state'] != new['state']:
+        events.append(new['state'].lower() if new['state'] in closedStates else "reopened" if old['state'] in closedStates else "state {}".format(new['state']))
+    if old['commit'] != new['commit'] and new['commit']:
+        events.append("new commits pushed ({})".format(new['commit'][:11]))
+    for name,status in sorted(new['reviewers'].items()):
+        previous=old['reviewers'].get(name)
+        if previous == status:
+            continue
+        if 'APPROVED' == status:
+            events.append("approved by {}".format(name))
+        elif 'NEEDS_WORK' == status:
+            events.append("needs work from {}".format(name))
+        elif previous is None:
+            events.append("{} added as reviewer".format(name))
+        else:
+            events.append("{} withdrew {}".format(name,"approval" if 'APPROVED' == previous else "needs work"))
+    for name in sorted(set(old['reviewers'])-set(new['reviewers'])):
+        events.append("{} removed from reviewers".format(name))
+    if old['title'] != new['title']:
+        events.append("renamed to '{}'".format(new['title']))
+    return events
+
+
+def buildStates(statuses):
+    """Return {key: (state, name)} of build statuses"""
+    return {status.get('key') or status.get('url',''):(status.get('state'),status.get('name') or status.get('key') or 'build') for status in statuses}
+
+
+def buildTransitions(old,new):
+    events=[]
+    for key,(state,name) in sorted(new.items()):
+        if old.get(key,(None,))[0] == state:
+            continue
+        events.append("build {} {}".format(name,{'SUCCESSFUL':'succeeded','FAILED':'failed','INPROGRESS':'started'}.get(state,state)))
+    return events
+
+
+class _Builds:
+    """Build statuses of a commit"""
+    def __init__(self,commit,pushed):
+        self.commit=commit
+        # time commit was pushed, approximated by pull request update time
+        self.pushed=pushed
+        self.states={}
+        self.validators={}
+        self.checked=False
+
+    def pending(self,buildWait):
+        if not self.checked:
+            return True
+        if not self.states:
+            # repository without builds, or builds not yet started
+            return time.time()-self.pushed < buildWait
+        return any(state not in finalBuildStates for state,_ in self.states.values())
+
+
+class Watcher:
+    """Reports changes of pull requests of a repository
+
+    sync() updates the local index and returns the number of changed pull
+    requests; load(ids) returns {id: pull request} of the given ids and of
+    every open pull request (ids None: just the open ones);
+    fetchBuilds(commit,validators) returns (statuses or None when not
+    modified, validators)."""
+    def __init__(self,sync,load,fetchBuilds,ids=None,buildWait=900):
+        self.sync=sync
+        self.load=load
+        self.fetchBuilds=fetchBuilds
+        # None: every pull request of the repository
+        self.ids=ids
+        self.buildWait=buildWait
+        self.states={}
+        self.builds={}
+
+    def _watched(self,pullRequests):
+        if self.ids is not None:
+            return {id:pr for id,pr in pullRequests.items() if id in self.ids}
+        return pullRequests
+
+    def start(self):
+        """Synchronize and return list of (id, title, summary) of watched pull requests"""
+        self.sync()
+        for id,pr in self._watched(self.load(self.ids)).items():
+            self.states[id]=snapshot(pr)
+        self._pollBuilds()
+        return [(id,state['title'],summary(state,self.builds[id].states if id in self.builds else None)) for id,state in sorted(self.states.items())]
+
+    def poll(self):
+        """Return list of (id, title, event) of changes found since previous poll"""
+        events=[]
+        if self.sync():
+            for id,pr in sorted(self._watched(self.load(list(self.states))).items()):
+                new=snapshot(pr)
+                events+=[(id,new['title'],event) for event in transitions(self.states.get(id),new)]
+                self.states[id]=new
+        events+=[(id,self.states[id]['title'],event) for id,event in self._pollBuilds()]
+        # closed pull requests are reported once, then forgotten when watching the whole repository
+        if self.ids is None:
+            for id in [id for id,state in self.states.items() if state['state'] in closedStates]:
+                del self.states[id]
+                self.builds.pop(id,None)
+        return events
+
+    def done(self):
+        """True when every watched pull request is closed"""
+        return self.ids is not None and all(self.states.get(id,{}).get('state') in closedStates for id in self.ids)
+
+    def _pollBuilds(self):
+        events=[]
+        for id,state in sorted(self.states.items()):
+            if state['state'] in closedStates or not state['commit']:
+                continue
+            builds=self.builds.get(id)
+            if builds is None or builds.commit != state['commit']:
+                builds=self.builds[id]=_Builds(state['commit'],min(time.time(),state['updated']/1000))
+            if not builds.pending(self.buildWait):
+                continue
+            statuses,builds.validators=self.fetchBuilds(builds.commit,builds.validators)
+            builds.checked=True
+            if statuses is None:
+                continue
+            new=buildStates(statuses)
+            events+=[(id,event) for event in buildTransitions(builds.states,new)]
+            builds.states=new
+        return events
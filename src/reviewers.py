@@ -0,0 +1,187 @@
+"""Reviewers validation and resolution
+
+Reviewers are user names, matched case insensitively against user name, slug
+or email address and replaced by the user name known by the server; names
+starting with "@" are groups, replaced by their members.
+Names are deduplicated and resolved from the user directory cache first;
+the server has no batch lookup of users by name, so the remaining names are
+looked up with one request each, concurrently, and a name requested by
+several threads at the same time is looked up only once.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from paging import PagedListing
+from workers import runParallel
+
+groupPrefix='@'
+
+
+def parseReviewers(text):
+    """Return list of reviewers of a comma separated string (or list), without blanks"""
+    if not text:
+        return []
+    if isinstance(text,str):
+        text=text.split(",")
+    return [name.strip() for name in text if name.strip()]
+
+
+class UserDirectory:
+    """Cache of user and group lookups, stored in a json file
+
+    Entries expire after ttl seconds; when more than maxEntries are stored the
+    least recently used ones are evicted. Unknown names are not cached."""
+    def __init__(self,path,ttl,maxEntries=1000):
+        self.path=path
+        self.ttl=ttl
+        self.maxEntries=maxEntries
+        self.lock=threading.Lock()
+        self.changed=False
+        self.entries={}
+        try:
+            with open(path) as infile:
+                self.entries=json.load(infile)
+        except (OSError,ValueError):
+            pass
+
+    def get(self,key):
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None or time.time()-entry['stored'] > self.ttl:
+                return None
+            entry['used']=time.time()
+            self.changed=True
+            return entry['value']
+
+    def put(self,key,value):
+        now=time.time()
+        with self.lock:
+            self.entries[key]={'value':value,'stored':now,'used':now}
+            self.changed=True
+
+    def save(self):
+        """Write cache file, evicting expired and least recently used entries"""
+        with self.lock:
+            if not self.changed:
+                return
+            now=time.time()
+            entries=sorted(((key,entry) for key,entry in self.entries.items() if now-entry['stored'] <= self.ttl),
+                key=lambda item: item[1]['used'],reverse=True)
+            self.entries=dict(entries[:self.maxEntries])
+            # concurrent bpc processes must not write the same temporary file
+            tmpPath=self.path+".{}.tmp".format(os.getpid())
+            try:
+                with open(tmpPath,'w') as outfile:
+                    json.dump(self.entries,outfile)
+                os.replace(tmpPath,self.path)
+            finally:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+            self.changed=False
+
+
+class ReviewerResolver:
+    """Resolve reviewers names of a server into user names, using a UserDirectory"""
+    def __init__(self,directory,jobs=8):
+        self.directory=directory
+        self.jobs=jobs
+        self.lock=threading.Lock()
+        self.inflight={}
+
+    def _findUser(self,client,name):
+        from stashy.errors import maybe_throw
+        response=client.get("api/1.0/users",params={'filter':name,'limit':100})
+        maybe_throw(response)
+        wanted=name.lower()
+        for user in response.json().get('values',[]):
+            if wanted in [str(user.get(field,'')).lower() for field in ['name','slug','emailAddress']]:
+                return user['name']
+        return None
+
+    def _groupMembers(self,client,group):
+        from stashy.errors import NotFoundException,GenericException
+        try:
+            return [user['name'] for user in PagedListing(client,"api/1.0/admin/groups/more-members",{'context':group})]
+        except NotFoundException:
+            return None
+        except GenericException as e:
+            # no permission to read group members
+            logging.debug("Cannot read members of group {}: {}".format(group,e))
+            return None
+
+    def lookup(self,server,client,name):
+        """Return user name, list of members for groups, None when unknown"""
+        key="{}\n{}".format(server,name.lower())
+        value=self.directory.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            event=self.inflight.get(key)
+            owner=event is None
+            if owner:
+                event=self.inflight[key]=threading.Event()
+        if not owner:
+            event.wait()
+            return self.directory.get(key)
+
+        try:
+            if name.startswith(groupPrefix):
+                value=self._groupMembers(client,name[len(groupPrefix):])
+            else:
+                value=self._findUser(client,name)
+            if value is not None:
+                self.directory.put(key,value)
+            return value
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+
+    def _lookupAll(self,server,client,reviewers):
+        reviewers=parseReviewers(reviewers)
+        values={}
+        # lowercased name: name as first written
+        missing={}
+        for name in reviewers:
+            key=name.lower()
+            if key in values or key in missing:
+                continue
+            value=self.directory.get("{}\n{}".format(server,key))
+            if value is None:
+                missing[key]=name
+            else:
+                values[key]=value
+        results=runParallel(lambda name: self.lookup(server,client,name),list(missing.values()),self.jobs)
+        for key,(value,error) in zip(missing,results):
+            if error:
+                raise error
+            values[key]=value
+        return [(name,values[name.lower()]) for name in reviewers]
+
+    def resolve(self,server,client,reviewers,exclude=None):
+        """Return (user names, unknown names) of reviewers; exclude is the PR author, who cannot be a reviewer"""
+        users=[]
+        unknown=[]
+        for name,value in self._lookupAll(server,client,reviewers):
+            if value is None:
+                unknown.append(name)
+                continue
+            for user in value if isinstance(value,list) else [value]:
+                if user not in users and (exclude is None or user.lower() != exclude.lower()):
+                    users.append(user)
+        return users,unknown
+
+    def canonicalize(self,server,client,reviewers):
+        """Return (reviewers with user names as known by server, unknown names); groups are kept as they are"""
+        names=[]
+        unknown=[]
+        for name,value in self._lookupAll(server,client,reviewers):
+            if value is None:
+                unknown.append(name)
+            else:
+                names.append(name if isinstance(value,list) else value)
+        return names,unknown
@@ -0,0 +1,130 @@
+"""Offline search index over projects, repositories and pull requests
+
+Documents are grouped by source (e.g. the repositories listing of a
+project): a source is indexed again only when its digest changes, so a
+refresh mostly costs the listing requests.
+Every document is split in lowercase tokens stored in an inverted index
+(tokens table); query terms are matched as token prefixes using a range scan
+of the token index, and every term must match: documents matching the
+rarest term are checked for the other terms through the (document, token)
+index. Documents are ranked by the weight of the fields matched, exact token
+matches counting twice.
+"""
+import json
+import re
+import sqlite3
+
+schema=[
+    "CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, digest TEXT NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, source TEXT NOT NULL, kind TEXT NOT NULL,
+        server TEXT NOT NULL, title TEXT NOT NULL, data TEXT)""",
+    "CREATE INDEX IF NOT EXISTS documents_source ON documents (source)",
+    "CREATE TABLE IF NOT EXISTS tokens (token TEXT NOT NULL, document INTEGER NOT NULL, weight INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS tokens_token ON tokens (token)",
+    "CREATE INDEX IF NOT EXISTS tokens_document ON tokens (document, token)",
+]
+
+
+def tokenize(text):
+    """Return lowercase alphanumeric words of text, plus the whole text without separators (e.g. "repo-1": repo, 1, repo1)"""
+    words=[word for word in re.split(r'[^0-9a-z]+',(text or '').lower()) if word]
+    if len(words) > 1:
+        words.append(''.join(words))
+    return words
+
+
+class SearchIndex:
+    """SQLite inverted index"""
+    def __init__(self,path):
+        self._db=sqlite3.connect(path,timeout=30,isolation_level=None)
+        for statement in schema:
+            self._db.execute(statement)
+
+    def isEmpty(self):
+        return self._db.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def sources(self):
+        """Return {source: digest} of indexed sources"""
+        return dict(self._db.execute("SELECT source,digest FROM sources").fetchall())
+
+    def update(self,sources):
+        """Index documents of (source, digest, documents) tuples whose digest changed, in a single transaction
+
+        documents are dictionaries: kind, server, title, data (any json value)
+        and fields, a list of (text, weight). Return number of sources indexed"""
+        digests=self.sources()
+        changed=0
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for source,digest,documents in sources:
+                if digests.get(source) == digest:
+                    continue
+                self._deleteSource(source)
+                for document in documents:
+                    cursor=self._db.execute("INSERT INTO documents (source,kind,server,title,data) VALUES (?,?,?,?,?)",
+                        (source,document['kind'],document['server'],document['title'],json.dumps(document.get('data'))))
+                    weights={}
+                    for text,weight in document['fields']:
+                        for token in tokenize(text):
+                            weights[token]=max(weight,weights.get(token,0))
+                    self._db.executemany("INSERT INTO tokens (token,document,weight) VALUES (?,?,?)",
+                        [(token,cursor.lastrowid,weight) for token,weight in weights.items()])
+                self._db.execute("INSERT OR REPLACE INTO sources (source,digest) VALUES (?,?)",(source,digest))
+                changed+=1
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return changed
+
+    def _deleteSource(self,source):
+        self._db.execute("DELETE FROM tokens WHERE document IN (SELECT id FROM documents WHERE source=?)",(source,))
+        self._db.execute("DELETE FROM documents WHERE source=?",(source,))
+        self._db.execute("DELETE FROM sources WHERE source=?",(source,))
+
+    def removeSources(self,sources):
+        """Remove documents of sources no longer existing"""
+        if not sources:
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for source in sources:
+                self._deleteSource(source)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def search(self,query,kind=None,limit=20):
+        """Return list of (kind, server, title, data, score) of documents matching every term of query, best first"""
+        terms=list(dict.fromkeys(word for text in query.split() for word in re.split(r'[^0-9a-z]+',text.lower()) if word))
+        if not terms:
+            return []
+        # prefix match: every token between term and term followed by the highest character
+        ranges=[(term,term+'\uffff') for term in terms]
+        counts=[self._db.execute("SELECT COUNT(*) FROM tokens WHERE token>=? AND token<?",bounds).fetchone()[0] for bounds in ranges]
+        if 0 in counts:
+            return []
+        order=sorted(range(len(terms)),key=lambda i: counts[i])
+        first=order[0]
+        score="MAX(t.weight*(CASE WHEN t.token=? THEN 2 ELSE 1 END))"
+        params=[terms[first]]
+        for i in order[1:]:
+            score+="+(SELECT MAX(u.weight*(CASE WHEN u.token=? THEN 2 ELSE 1 END)) FROM tokens u WHERE u.document=t.document AND u.token>=? AND u.token<?)"
+            params+=[terms[i],ranges[i][0],ranges[i][1]]
+        params+=ranges[first]
+        # score is NULL when a term does not match
+        sql="""SELECT d.kind,d.server,d.title,d.data,m.score FROM
+            (SELECT t.document,{} AS score FROM tokens t WHERE t.token>=? AND t.token<? GROUP BY t.document) m
+            JOIN documents d ON d.id=m.document WHERE m.score IS NOT NULL""".format(score)
+        if kind:
+            sql+=" AND d.kind=?"
+            params.append(kind)
+        sql+=" ORDER BY m.score DESC,CASE d.kind WHEN 'project' THEN 0 WHEN 'repo' THEN 1 ELSE 2 END,LENGTH(d.title),d.title LIMIT ?"
+        params.append(limit)
+        return [(kind,server,title,json.loads(data),score) for kind,server,title,data,score in self._db.execute(sql,params).fetchall()]
+
+    def size(self):
+        """Return (number of documents, number of tokens)"""
+        return (self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0],
+            self._db.execute("SELECT COUNT(*) FROM tokens").fetchone()[0])
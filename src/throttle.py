@@ -0,0 +1,238 @@
+"""Rate limiting, retries and circuit breaking of requests to Bitbucket servers
+
+Every server (scheme, host and port) has one ServerPolicy, shared by all the
+connections and threads of the process:
+* a token bucket limiting the rate of requests (disabled when rate is 0)
+* an adaptive concurrency limit: halved when the server throttles (429/503),
+  increased by one every limit successful requests, up to the maximum
+* a pause of all requests when the server asks for it (Retry-After header)
+* a circuit breaker: after failureThreshold consecutive failures (connection
+  errors, 5xx) requests fail immediately for cooldown seconds, then a single
+  request probes the server again
+Requests that failed with a temporary error are retried with exponential
+backoff and full jitter, unless Retry-After says otherwise; requests that
+change data are retried only when the server did not process them.
+"""
+import email.utils
+import random
+import threading
+import time
+
+import timings
+
+retryStatuses=(429,502,503,504)
+# the server refused the request without processing it
+throttleStatuses=(429,503)
+idempotentMethods=('GET','HEAD','OPTIONS','PUT','DELETE')
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, burst at once"""
+    def __init__(self,rate,burst=None):
+        self.rate=rate
+        self.burst=burst or max(1,rate)
+        self.tokens=self.burst
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now=time.monotonic()
+            self.tokens=min(self.burst,self.tokens+(now-self.last)*self.rate)
+            self.last=now
+            # token is reserved even when not yet available: waiting threads are served in order
+            self.tokens-=1
+            wait=-self.tokens/self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """Concurrency limit decreasing multiplicatively when server is overloaded, increasing additively otherwise"""
+    def __init__(self,maximum,minimum=1,decreaseInterval=1.0):
+        self.maximum=maximum
+        self.minimum=minimum
+        self.limit=float(maximum)
+        self.decreaseInterval=decreaseInterval
+        self.active=0
+        self.lastDecrease=0
+        self.condition=threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active+=1
+
+    def release(self,throttled=False):
+        with self.condition:
+            self.active-=1
+            now=time.monotonic()
+            if throttled:
+                # requests in flight when server started throttling would halve the limit many times
+                if now-self.lastDecrease >= self.decreaseInterval:
+                    self.limit=max(self.minimum,self.limit/2)
+                    self.lastDecrease=now
+            else:
+                self.limit=min(self.maximum,self.limit+1/self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    def __init__(self,failureThreshold=5,cooldown=30):
+        self.failureThreshold=failureThreshold
+        self.cooldown=cooldown
+        self.failures=0
+        self.openedAt=None
+        self.probing=False
+        self.lock=threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpenError when requests must not be sent"""
+        with self.lock:
+            if self.openedAt is None:
+                return
+            remaining=self.openedAt+self.cooldown-time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError("server failed {} times in a row, requests suspended for {:.0f} more seconds".format(
+                    self.failureThreshold,max(remaining,1)))
+            self.probing=True
+
+    def success(self):
+        with self.lock:
+            self.failures=0
+            self.openedAt=None
+            self.probing=False
+
+    def failure(self):
+        with self.lock:
+            self.failures+=1
+            if self.probing or self.failures >= self.failureThreshold:
+                self.openedAt=time.monotonic()
+            self.probing=False
+
+
+class ServerPolicy:
+    def __init__(self,rate,maxConcurrency,failureThreshold=5,cooldown=30):
+        self.bucket=TokenBucket(rate) if rate else None
+        self.limit=AdaptiveLimit(maxConcurrency)
+        self.breaker=CircuitBreaker(failureThreshold,cooldown)
+        self.pausedUntil=0
+        self.lock=threading.Lock()
+
+    def pause(self,seconds):
+        with self.lock:
+            self.pausedUntil=max(self.pausedUntil,time.monotonic()+seconds)
+
+    def waitPause(self):
+        wait=self.pausedUntil-time.monotonic()
+        if wait > 0:
+            with timings.span("throttled"):
+                time.sleep(wait)
+
+
+_policies={}
+_policiesLock=threading.Lock()
+
+
+def policy(origin,rate=0,maxConcurrency=8):
+    """Return policy of a server, created with given settings on first use"""
+    with _policiesLock:
+        if origin not in _policies:
+            _policies[origin]=ServerPolicy(rate,maxConcurrency)
+        return _policies[origin]
+
+
+def retryAfter(response,maxDelay):
+    """Return seconds asked by Retry-After header (seconds or HTTP date), None when missing"""
+    value=response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds=float(value)
+    except ValueError:
+        try:
+            seconds=email.utils.parsedate_to_datetime(value).timestamp()-time.time()
+        except (TypeError,ValueError):
+            return None
+    return min(max(seconds,0),maxDelay)
+
+
+def backoff(attempt,base=0.5,maxDelay=30):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0,min(maxDelay,base*2**attempt))
+
+
+def notSent(error):
+    """Return whether a requests connection error happened before the request reached the server"""
+    import requests
+    import urllib3
+    if isinstance(error,requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps the urllib3 error whose reason is the error of the last connection attempt
+    reason=getattr(error.args[0],'reason',None) if error.args else None
+    return isinstance(reason,(urllib3.exceptions.NewConnectionError,ConnectionRefusedError))
+
+
+def adapter(wrapped,rate=0,maxConcurrency=8,retries=4,maxDelay=60):
+    """Return a requests transport adapter applying server policies to requests sent by wrapped adapter"""
+    import requests
+    from urllib.parse import urlsplit
+
+    class ThrottlingAdapter(requests.adapters.BaseAdapter):
+        def send(self,request,**kwargs):
+            url=urlsplit(request.url)
+            server=policy("{}://{}".format(url.scheme,url.netloc),rate,maxConcurrency)
+            attempt=0
+            while True:
+                try:
+                    server.breaker.before()
+                except CircuitOpenError as e:
+                    raise requests.ConnectionError("{}: {}".format(url.netloc,e),request=request)
+                server.waitPause()
+                server.limit.acquire()
+                throttled=False
+                try:
+                    if server.bucket:
+                        server.bucket.acquire()
+                    response=wrapped.send(request,**kwargs)
+                    throttled=response.status_code in throttleStatuses
+                except requests.ConnectionError as e:
+                    server.breaker.failure()
+                    # a request that could not connect was not processed by the server
+                    if attempt >= retries or (request.method not in idempotentMethods and not notSent(e)):
+                        raise
+                    delay=backoff(attempt,maxDelay=maxDelay)
+                except BaseException:
+                    # timeouts, SSL errors, interruptions: a probe must not leave the circuit half-open forever
+                    server.breaker.failure()
+                    raise
+                else:
+                    if response.status_code >= 500 and response.status_code != 503:
+                        server.breaker.failure()
+                    else:
+                        server.breaker.success()
+                    retryable=response.status_code in throttleStatuses or (response.status_code in retryStatuses and request.method in idempotentMethods)
+                    if not retryable or attempt >= retries:
+                        return response
+                    delay=retryAfter(response,maxDelay)
+                    if delay is None:
+                        delay=backoff(attempt,maxDelay=maxDelay)
+                    elif throttled:
+                        # every request to the server waits, not just this one
+                        server.pause(delay)
+                    response.close()
+                finally:
+                    server.limit.release(throttled)
+                attempt+=1
+                with timings.span("retry wait"):
+                    time.sleep(delay)
+
+        def close(self):
+            wrapped.close()
+
+    return ThrottlingAdapter()
@@ -0,0 +1,167 @@
+"""Spans of bpc phases and HTTP requests, for --timings and --trace-file
+
+Recording is disabled by default: span() then costs a function call and
+nothing is kept. When enabled, every span stores name, category, start,
+duration, thread and arguments; summary() aggregates them by name, and
+writeTrace() exports them in Chrome trace event format (chrome://tracing,
+Perfetto), with bpc version and command in metadata so that traces of many
+users can be aggregated.
+HTTP spans carry the URL template (project keys, repository slugs, ids and
+query string removed) instead of the URL, so traces can be shared.
+"""
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# time origin: bpc imports this module before doing anything else
+origin=time.perf_counter()
+enabled=False
+_spans=[]
+_lock=threading.Lock()
+_templates=[(re.compile(r'/projects/[^/]+'),'/projects/{project}'),(re.compile(r'/repos/[^/]+'),'/repos/{repo}'),
+    (re.compile(r'/users/[^/]+'),'/users/{user}'),(re.compile(r'/(pull-requests|commits|comments)/[^/]+'),r'/\1/{id}'),
+    (re.compile(r'/scm/[^/]+/[^/]+'),'/scm/{project}/{repo}')]
+
+
+def enable():
+    global enabled
+    enabled=True
+
+
+def record(name,category,start,end,args=None):
+    """Store a span, start and end being time.perf_counter() values"""
+    if not enabled:
+        return
+    thread=threading.current_thread()
+    with _lock:
+        _spans.append((name,category,start,end-start,thread.ident,thread.name,args or {}))
+
+
+@contextmanager
+def _span(name,category,args):
+    start=time.perf_counter()
+    try:
+        yield args
+    finally:
+        record(name,category,start,time.perf_counter(),args)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self,*exc):
+        return False
+
+_noSpan=_NoSpan()
+
+
+def span(name,category='phase',**args):
+    """Context manager recording a span; the yielded dictionary can be filled with more arguments"""
+    if not enabled:
+        return _noSpan
+    return _span(name,category,args)
+
+
+def phase(name):
+    """Decorator recording a span for every call of the function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not enabled:
+                return func(*args,**kwargs)
+            with _span(name,'phase',{}):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+def urlTemplate(url):
+    """Return path of url without query string, with variable parts replaced by placeholders"""
+    from urllib.parse import urlparse
+    path=urlparse(url).path
+    for pattern,replacement in _templates:
+        path=pattern.sub(replacement,path)
+    return path
+
+
+def adapter(wrapped):
+    """Return a requests transport adapter recording a span for every request sent by wrapped adapter"""
+    import requests
+
+    class TracingAdapter(requests.adapters.BaseAdapter):
+        def send(self,request,stream=False,**kwargs):
+            args={'method':request.method,'url':urlTemplate(request.url)}
+            start=time.perf_counter()
+            try:
+                response=wrapped.send(request,stream=stream,**kwargs)
+            except Exception as e:
+                args['error']=type(e).__name__
+                record("{} {}".format(args['method'],args['url']),'http',start,time.perf_counter(),args)
+                raise
+            args['status']=response.status_code
+            if stream:
+                # body is read later by caller: only its declared size is known
+                args['bytes']=int(response.headers.get('Content-Length',0))
+            else:
+                args['bytes']=len(response.content)
+            record("{} {}".format(args['method'],args['url']),'http',start,time.perf_counter(),args)
+            return response
+
+        def close(self):
+            wrapped.close()
+
+    return TracingAdapter()
+
+
+def summary(out=sys.stderr):
+    """Print table of spans grouped by name: count, total and maximum duration; HTTP requests also report bytes and statuses"""
+    with _lock:
+        spans=list(_spans)
+    total=time.perf_counter()-origin
+    groups={}
+    for name,category,_,duration,_,_,args in spans:
+        group=groups.setdefault((category,name),{'count':0,'total':0.0,'max':0.0,'bytes':0,'statuses':set()})
+        group['count']+=1
+        group['total']+=duration
+        group['max']=max(group['max'],duration)
+        group['bytes']+=args.get('bytes',0)
+        if 'status' in args or 'error' in args:
+            group['statuses'].add(str(args.get('status',args.get('error'))))
+
+    print("\n{:<70} {:>6} {:>10} {:>10} {:>10}  {}".format("span","count","total ms","max ms","KB","status"),file=out)
+    for category in ['phase','http']:
+        rows=sorted(((name,group) for (cat,name),group in groups.items() if cat == category),key=lambda row: -row[1]['total'])
+        for name,group in rows:
+            print("{:<70} {:>6} {:>10.1f} {:>10.1f} {:>10}  {}".format(name[:70],group['count'],group['total']*1000,group['max']*1000,
+                "{:.1f}".format(group['bytes']/1024) if category == 'http' else "",",".join(sorted(group['statuses']))),file=out)
+    requests=[group for (cat,_),group in groups.items() if cat == 'http']
+    print("{:<70} {:>6} {:>10.1f}".format("wall time (HTTP requests: {}, {:.1f} KB)".format(sum(group['count'] for group in requests),
+        sum(group['bytes'] for group in requests)/1024),1,total*1000),file=out)
+
+
+def writeTrace(path,metadata=None):
+    """Write recorded spans to path as Chrome trace event json"""
+    pid=os.getpid()
+    with _lock:
+        spans=list(_spans)
+    events=[]
+    threads={}
+    for name,category,start,duration,tid,threadName,args in spans:
+        threads[tid]=threadName
+        events.append({'name':name,'cat':category,'ph':'X','ts':round((start-origin)*1e6,1),'dur':round(duration*1e6,1),
+            'pid':pid,'tid':tid,'args':args})
+    for tid,threadName in threads.items():
+        events.append({'name':'thread_name','ph':'M','pid':pid,'tid':tid,'args':{'name':threadName}})
+    events.append({'name':'process_name','ph':'M','pid':pid,'tid':0,'args':{'name':'bpc'}})
+    trace={'traceEvents':events,'displayTimeUnit':'ms','metadata':dict(metadata or {},
+        wall_ms=round((time.perf_counter()-origin)*1000,1),python=sys.version.split()[0],platform=sys.platform)}
+    temp=path+".tmp"
+    with open(temp,'w') as outfile:
+        json.dump(trace,outfile)
+    os.replace(temp,path)
@@ -0,0 +1,29 @@
+"""Comparison of local branches with their upstream
+
+Commits are only counted by git, no commit object is ever built."""
+import subprocess
+
+
+def _git(location,args):
+    res=subprocess.run(["git"]+args,cwd=location.worktree,stdout=subprocess.PIPE,stderr=subprocess.PIPE,universal_newlines=True)
+    return res.returncode,res.stdout.strip(),res.stderr.strip()
+
+
+def upstreamOf(location,branch):
+    """Return full name of upstream ref of branch (e.g. refs/remotes/origin/feature)
+
+    Returns None when no upstream is configured, or when it has never been
+    fetched/pushed, i.e. branch is not present in remote"""
+    rc,out,_=_git(location,["rev-parse","--symbolic-full-name","--verify","--quiet",f'{branch}@{{upstream}}'])
+    if rc or not out:
+        return None
+    return out
+
+
+def aheadBehind(location,branch,upstream):
+    """Return (ahead, behind): number of commits of branch missing in upstream and vice versa"""
+    rc,out,err=_git(location,["rev-list","--left-right","--count",f'refs/heads/{branch}...{upstream}'])
+    if rc:
+        raise RuntimeError("git rev-list failed: {}".format(err))
+    ahead,behind=out.split()
+    return int(ahead),int(behind)
@@ -0,0 +1,46 @@
+"""Helpers to run bpc operations concurrently"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def runParallel(func,items,jobs):
+    """Run func on every item using at most jobs threads
+
+    Returns a list of (result, exception) tuples in the same order of items,
+    so that output does not depend on completion order"""
+    def call(item):
+        try:
+            return func(item),None
+        except Exception as e:
+            return None,e
+
+    items=list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1,min(jobs,len(items)))) as executor:
+        return list(executor.map(call,items))
+
+
+class deferBackgroundLogs:
+    """Context manager holding log records emitted by background threads until the block exits
+
+    Used while user is in editor/prompts, so that background operations do not
+    clutter the terminal; records are emitted, in order, on exit."""
+    def __enter__(self):
+        self.records=[]
+        self.mainThread=threading.get_ident()
+        logging.getLogger().addFilter(self)
+        return self
+
+    def filter(self,record):
+        if record.thread == self.mainThread:
+            return True
+        self.records.append(record)
+        return False
+
+    def __exit__(self,*exc):
+        logging.getLogger().removeFilter(self)
+        for record in self.records:
+            logging.getLogger().handle(record)
+        return False
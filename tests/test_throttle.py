@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+import pytest
+import requests
+import urllib3
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"src"))
+
+import throttle
+
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+    """Transport raising the queued exceptions, then answering 200"""
+    def __init__(self,errors):
+        super().__init__()
+        self.errors=list(errors)
+        self.sent=0
+
+    def send(self,request,**kwargs):
+        self.sent+=1
+        if self.errors:
+            raise self.errors.pop(0)
+        response=requests.Response()
+        response.status_code=200
+        response.request=request
+        return response
+
+    def close(self):
+        pass
+
+
+def send(adapter,url,method='GET'):
+    return adapter.send(requests.Request(method,url).prepare())
+
+
+def refused(url):
+    """Connection error raised by requests when the server refuses the connection"""
+    reason=urllib3.exceptions.NewConnectionError(None,"Failed to establish a new connection: [Errno 111] Connection refused")
+    return requests.ConnectionError(urllib3.exceptions.MaxRetryError(None,url,reason))
+
+
+def test_breaker_probe_exception_reopens_circuit(monkeypatch):
+    url="http://breaker-probe.test/rest/api/1.0/projects"
+    monkeypatch.setitem(throttle._policies,"http://breaker-probe.test",throttle.ServerPolicy(0,8,failureThreshold=2,cooldown=0.05))
+    breaker=throttle._policies["http://breaker-probe.test"].breaker
+    wrapped=FakeAdapter([requests.ConnectionError("down"),requests.ConnectionError("down"),requests.ReadTimeout("slow probe")])
+    adapter=throttle.adapter(wrapped,retries=0)
+
+    # open
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            send(adapter,url)
+    assert breaker.openedAt is not None
+    with pytest.raises(requests.ConnectionError,match="suspended"):
+        send(adapter,url)
+    assert wrapped.sent == 2
+
+    # half-open: the probe fails with an exception that is not a connection error
+    time.sleep(0.06)
+    with pytest.raises(requests.ReadTimeout):
+        send(adapter,url)
+    assert not breaker.probing
+    with pytest.raises(requests.ConnectionError,match="suspended"):
+        send(adapter,url)
+
+    # next probe after cooldown closes the circuit
+    time.sleep(0.06)
+    assert 200 == send(adapter,url).status_code
+    assert breaker.openedAt is None and not breaker.probing
+
+
+def test_post_not_retried_after_connection_lost(monkeypatch):
+    url="http://post-retry.test/rest/api/1.0/projects/P/repos/r/pull-requests"
+    monkeypatch.setitem(throttle._policies,"http://post-retry.test",throttle.ServerPolicy(0,8))
+    monkeypatch.setattr(throttle,"backoff",lambda attempt,**kwargs: 0)
+
+    # connection reset after the request was written: the server may have created the pull request
+    lost=FakeAdapter([requests.ConnectionError(urllib3.exceptions.ProtocolError("Connection aborted.",ConnectionResetError(104,"Connection reset by peer")))])
+    with pytest.raises(requests.ConnectionError):
+        send(throttle.adapter(lost,retries=2),url,'POST')
+    assert lost.sent == 1
+
+    # refused connection: nothing reached the server
+    wrapped=FakeAdapter([refused(url)])
+    assert 200 == send(throttle.adapter(wrapped,retries=2),url,'POST').status_code
+    assert wrapped.sent == 2